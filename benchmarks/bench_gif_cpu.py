@@ -0,0 +1,89 @@
+"""CPU cost of the dipping bird animation window, old render loop vs DippingBirdGIF.
+
+    python benchmarks/bench_gif_cpu.py [--seconds=10] [--focused=true]
+
+Runs each renderer for a fixed wall-clock time and reports process CPU seconds.
+Uses SDL's dummy video driver unless SDL_VIDEODRIVER is already set, so it runs headless.
+--focused=true disables the unfocused-window throttle (the dummy driver never has focus).
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pygame  # noqa: E402
+from PIL import Image, ImageSequence  # noqa: E402
+
+import dippingbird  # noqa: E402
+
+
+def run_legacy(seconds: float) -> dict:
+    # The pre-renderer loop: full fill + blit + flip every iteration, clock.tick(60) plus a 1/60s wait
+    screen = pygame.display.set_mode(dippingbird.WINDOW_SIZE)
+    gif = Image.open(dippingbird.GIF_PATH)
+    durations = [frame.info["duration"] for frame in ImageSequence.Iterator(gif)]
+    frames = [pygame.image.fromstring(f.convert("RGBA").tobytes(), f.size, "RGBA") for f in ImageSequence.Iterator(gif)]
+    clock = pygame.time.Clock()
+    current, frame_time, draws = 0, 0, 0
+    cpu0, end = time.process_time(), time.monotonic() + seconds
+    while time.monotonic() < end:
+        pygame.event.get()
+        screen.fill((255, 255, 255))
+        frame = frames[current]
+        screen.blit(frame, frame.get_rect(center=(screen.get_width() // 2, screen.get_height() // 2)))
+        pygame.display.flip()
+        draws += 1
+        frame_time += clock.tick(dippingbird.FRAME_RATE)
+        if frame_time > durations[current]:
+            current = (current + 1) % len(frames)
+            frame_time = 0
+        time.sleep(1 / 60)
+    return {"cpu_seconds": time.process_time() - cpu0, "redraws": draws}
+
+
+def run_renderer(seconds: float, focused: bool) -> dict:
+    bird = dippingbird.DippingBirdGIF()
+    if not bird.setup():
+        raise SystemExit("GIF setup failed")
+    if focused:
+        bird.background_fps = 0
+    redraws = 0
+    cpu0, end = time.process_time(), time.monotonic() + seconds
+    while time.monotonic() < end:
+        before = bird.current_frame
+        bird.update()
+        redraws += bird.current_frame != before
+        time.sleep(bird.next_wait())
+    return {"cpu_seconds": time.process_time() - cpu0, "redraws": redraws}
+
+
+def run(seconds: float = 10.0, focused: bool = True) -> dict:
+    pygame.init()
+    legacy = run_legacy(seconds)
+    renderer = run_renderer(seconds, focused)
+    pygame.quit()
+    result = {
+        "seconds": seconds,
+        "video_driver": os.environ.get("SDL_VIDEODRIVER"),
+        "legacy": legacy,
+        "renderer": renderer,
+    }
+    for name in ("legacy", "renderer"):
+        r = result[name]
+        print(f"{name:9s} cpu={r['cpu_seconds']:.3f}s ({100 * r['cpu_seconds'] / seconds:.1f}% of one core) redraws={r['redraws']}")
+    return result
+
+
+if __name__ == "__main__":
+    opts = {"seconds": "10", "focused": "true"}
+    for arg in sys.argv[1:]:
+        if arg.startswith("--") and "=" in arg:
+            key, val = arg[2:].split("=", 1)
+            opts[key] = val
+    run(float(opts["seconds"]), opts["focused"].lower() in {"1", "true", "yes", "y", "on"})
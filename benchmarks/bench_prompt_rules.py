@@ -0,0 +1,87 @@
+"""Corpus check and micro-benchmark for dippingbird's prompt rule engine.
+
+    python benchmarks/bench_prompt_rules.py [--rules=prompt_rules.example.txt] [--iterations=2000] [--scrollback=2000]
+
+Checks every tail in prompt_corpus.json against its expected verdict, then times the
+compiled, tail-anchored matcher against the old per-call pattern loop over the same
+tails padded with `--scrollback` lines of history.
+"""
+import json
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dippingbird  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_corpus.json")
+
+
+def _legacy_match(haystack: str) -> bool:
+    # The pre-engine _detect_confirmation_prompt: patterns rebuilt and searched over the whole buffer
+    patterns = [
+        r"\(y/n\)\s*\?*$",
+        r"\[y/n\]\s*\?*$",
+        r"\[yes\]:\s*$",
+        r"are you sure.*\(y/n\).*?$",
+    ]
+    for pat in patterns:
+        if re.search(pat, haystack, re.IGNORECASE | re.MULTILINE):
+            return True
+    return False
+
+
+def check_corpus(rules, corpus) -> int:
+    failures = 0
+    for case in corpus:
+        kinds = tuple(case.get("kinds", ["confirm"]))
+        got = rules.match(case["tail"], kinds)
+        if got != case["expect"]:
+            failures += 1
+            print(f"FAIL {case['name']}: expected {case['expect']!r}, got {got!r}")
+    print(f"corpus: {len(corpus) - failures}/{len(corpus)} verdicts match")
+    return failures
+
+
+def _time_per_call(fn, inputs, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text in inputs:
+            fn(text)
+    return (time.perf_counter() - start) / (iterations * len(inputs))
+
+
+def run(rules_path: str = "", iterations: int = 2000, scrollback: int = 2000) -> dict:
+    rules = dippingbird.build_prompt_rules(rules_path)
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = json.load(f)
+    failures = check_corpus(rules, corpus)
+
+    history = "\n".join(f"[{i:05d}] compiling module_{i % 97}.py ... ok" for i in range(scrollback))
+    padded = [history + "\n" + case["tail"] for case in corpus]
+    engine = _time_per_call(rules.match, padded, iterations)
+    legacy = _time_per_call(_legacy_match, padded, max(1, iterations // 20))
+    result = {
+        "corpus_cases": len(corpus),
+        "corpus_failures": failures,
+        "scrollback_lines": scrollback,
+        "engine_us_per_match": engine * 1e6,
+        "legacy_us_per_match": legacy * 1e6,
+        "engine_matches_per_sec": 1.0 / engine if engine else 0.0,
+    }
+    print(f"engine: {result['engine_us_per_match']:.2f} us/match ({result['engine_matches_per_sec']:.0f}/s)")
+    print(f"legacy: {result['legacy_us_per_match']:.2f} us/match over {scrollback} lines of scrollback")
+    return result
+
+
+if __name__ == "__main__":
+    opts = {"rules": os.path.join(ROOT, "prompt_rules.example.txt"), "iterations": "2000", "scrollback": "2000"}
+    for arg in sys.argv[1:]:
+        if arg.startswith("--") and "=" in arg:
+            key, val = arg[2:].split("=", 1)
+            opts[key] = val
+    res = run(opts["rules"], int(opts["iterations"]), int(opts["scrollback"]))
+    sys.exit(1 if res["corpus_failures"] else 0)
@@ -0,0 +1,100 @@
+"""Startup time of each dippingbird CLI mode, and which heavy modules each one loads.
+
+    python benchmarks/bench_startup.py [--repeat=5] [--out=startup.json] [--script=path/to/dippingbird.py] [--modes=help,list]
+
+Every mode runs `python dippingbird.py ...` in a fresh interpreter and is timed until it
+exits (or prints its ready marker, for modes that keep running). `-X importtime` output
+is used to tell whether pygame, PIL or pywinauto were imported (or attempted, where the
+package is not installed, e.g. pywinauto on Linux). --script points at another checkout
+for before/after comparisons.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "dippingbird.py")
+HEAVY = ("pygame", "PIL", "pywinauto")
+AGENT = [sys.executable, "-c", "pass"]  # stand-in agent that exits immediately
+
+
+def _modes(cache_path: str):
+    # name -> (args, extra env, stdin, ready marker or None to wait for exit, setup callable)
+    def cold_cache():
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+
+    gif_env = {"SDL_VIDEODRIVER": os.environ.get("SDL_VIDEODRIVER", "dummy"), "GIF_CACHE": cache_path}
+    return {
+        "help": (["--help"], {}, None, None, None),
+        "list": (["--list"], {}, None, None, None),
+        "select": (["--select"], {"DISABLE_GIF": "true"}, "q\n", ("Selection cancelled.", "No candidate windows found."), None),
+        "headless-pty": (["--"] + AGENT, {"DISABLE_GIF": "true"}, None, None, None),
+        "gif-cold-cache": (["--"] + AGENT, gif_env, None, None, cold_cache),
+        "gif-warm-cache": (["--"] + AGENT, gif_env, None, None, None),
+    }
+
+
+def _run_once(script, args, env_extra, stdin, marker):
+    env = dict(os.environ, PYTHONUNBUFFERED="1", PYGAME_HIDE_SUPPORT_PROMPT="1", **env_extra)
+    # importtime output goes to a file so a chatty stderr can't stall the stdout reader
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as err:
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-X", "importtime", script] + args,
+            cwd=os.path.dirname(os.path.abspath(script)), env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=err, text=True,
+        )
+        if stdin:
+            proc.stdin.write(stdin)
+        proc.stdin.close()
+        elapsed = None
+        for line in proc.stdout:
+            if marker and any(m in line for m in marker):
+                elapsed = time.perf_counter() - start
+                proc.kill()
+                break
+        proc.wait(timeout=60)
+        if elapsed is None:
+            elapsed = time.perf_counter() - start
+        err.seek(0)
+        stderr = err.read()
+    loaded = set()
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            name = line.rsplit("|", 1)[1].strip()
+            if name in HEAVY:
+                loaded.add(name)
+    return elapsed, sorted(loaded)
+
+
+def run(repeat: int = 5, script: str = SCRIPT, only=None) -> dict:
+    cache_path = os.path.join(tempfile.gettempdir(), "dippingbird-bench.frames.cache")
+    results = {}
+    for name, (args, env_extra, stdin, marker, setup) in _modes(cache_path).items():
+        if only and name not in only:
+            continue
+        times, loaded = [], []
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            elapsed, loaded = _run_once(script, args, env_extra, stdin, marker)
+            times.append(elapsed)
+        results[name] = {"median_s": statistics.median(times), "min_s": min(times), "loads": loaded}
+        print(f"{name:15s} median={results[name]['median_s'] * 1000:7.1f} ms  loads={','.join(loaded) or '-'}")
+    return results
+
+
+if __name__ == "__main__":
+    opts = {"repeat": "5", "out": "", "script": SCRIPT, "modes": ""}
+    for arg in sys.argv[1:]:
+        if arg.startswith("--") and "=" in arg:
+            key, val = arg[2:].split("=", 1)
+            opts[key] = val
+    res = run(int(opts["repeat"]), opts["script"], [m for m in opts["modes"].split(",") if m])
+    if opts["out"]:
+        with open(opts["out"], "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2)
@@ -0,0 +1,173 @@
+"""Hot-path benchmark suite against a simulated desktop (runs on Linux, no pywinauto needed).
+
+    python benchmarks/bench_suite.py [--windows=500] [--scrollback-bytes=1000000] [--line-bytes=80]
+                                     [--rate=20] [--iterations=50] [--call-latency-us=50]
+                                     [--out=bench_results.json]
+                                     [--compare=previous_results.json]
+
+Covers window enumeration (merged win32+uia vs the old sequential scan, with each
+property read costing --call-latency-us), window resolution (cold scan vs cached),
+snapshot read + hash (full vs tail), prompt detection (rule engine vs the old pattern
+loop) and full-tick latency. Results
+are written as JSON together with the git commit, so runs on two commits can be diffed
+with --compare.
+"""
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dippingbird  # noqa: E402
+from bench_prompt_rules import _legacy_match  # noqa: E402
+from fake_desktop import FakeDesktopState  # noqa: E402
+
+
+def _measure(fn, iterations: int, state: FakeDesktopState = None, setup=None) -> dict:
+    samples, calls = [], 0
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        before = state.calls if state is not None else 0
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+        if state is not None:
+            calls += state.calls - before
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "median_ms": statistics.median(samples) * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(0.95 * len(samples)))] * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "fake_calls_per_op": calls / iterations if state is not None else None,
+    }
+
+
+def _legacy_gather(backend):
+    # The pre-enumerator candidate scan: win32 then uia, sequentially, properties read per backend
+    seen, candidates = set(), []
+    for name in ("win32", "uia"):
+        for w in backend.windows(name):
+            title, cls, handle = w.window_text(), w.class_name(), w.handle
+            if handle in seen:
+                continue
+            if dippingbird._window_title_matches(title) or (name == "win32" and cls == "ConsoleWindowClass"):
+                seen.add(handle)
+                candidates.append((handle, cls, title, name))
+    return candidates
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except Exception:
+        return ""
+
+
+def run(windows: int = 500, scrollback_bytes: int = 1_000_000, line_bytes: int = 80,
+        rate: int = 20, iterations: int = 50, call_latency: float = 50e-6) -> dict:
+    desktop = FakeDesktopState(windows=windows, scrollback_bytes=scrollback_bytes, line_bytes=line_bytes)
+    backend = dippingbird.PywinautoBackend(desktop.Desktop, desktop.Application)
+    console = desktop.consoles[0]
+    # Exercise the heuristic desktop scan rather than the APP_TITLE shortcut
+    dippingbird.APP_TITLE = ""
+    dippingbird.APP_TITLE_CONTAINS = ""
+    dippingbird.SELECTED_HANDLE = None
+    dippingbird.TARGET_HANDLE_ENV = None
+    results = {}
+
+    # Enumeration on its own desktop whose property reads cost `call_latency` each, like real round-trips
+    slow = FakeDesktopState(windows=windows, scrollback_bytes=line_bytes, line_bytes=line_bytes,
+                            call_latency=call_latency)
+    slow_backend = dippingbird.PywinautoBackend(slow.Desktop, slow.Application)
+    enumerator = dippingbird.WindowEnumerator(slow_backend)
+    enum_iterations = max(1, iterations // 10)
+    results["enumerate_cold"] = _measure(lambda: enumerator.snapshot(prefetch=("title", "class_name")),
+                                         enum_iterations, slow, setup=enumerator.invalidate)
+    results["enumerate_legacy"] = _measure(lambda: _legacy_gather(slow_backend), enum_iterations, slow)
+
+    resolver = dippingbird.TargetResolver(backend)
+    # Drop the shared window listing too, so every cold resolve really rescans the desktop
+    def cold():
+        resolver.invalidate()
+        dippingbird._window_enumerator(backend).invalidate()
+
+    results["resolve_cold"] = _measure(resolver.resolve, iterations, desktop, setup=cold)
+    resolver.resolve()
+    results["resolve_cached"] = _measure(resolver.resolve, iterations, desktop)
+
+    for mode in ("full", "tail"):
+        detector = dippingbird.SnapshotChangeDetector(mode=mode)
+
+        def read_and_hash():
+            detector.update(detector.read(console, backend))
+
+        results[f"snapshot_{mode}"] = _measure(read_and_hash, max(1, iterations // 5), desktop)
+
+    text = "\n".join(console.lines) + "\nProceed (Y/n)? "
+    rules = dippingbird.build_prompt_rules()
+    results["prompt_engine"] = _measure(lambda: rules.match(text), iterations)
+    results["prompt_legacy"] = _measure(lambda: _legacy_match(text), max(1, iterations // 5))
+
+    for mode in ("full", "tail"):
+        target = dippingbird.Target(console.handle, stale_seconds=10 ** 6, backend=backend)
+        target.detector = dippingbird.SnapshotChangeDetector(mode=mode)
+        target.state.initial_sent = True
+        per_tick = max(0, int(rate * target.interval))
+        with contextlib.redirect_stdout(io.StringIO()):
+            target.tick()  # warm the resolver cache
+            results[f"tick_{mode}"] = _measure(target.tick, max(1, iterations // 5), desktop,
+                                               setup=lambda: desktop.emit(console, per_tick))
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "params": {"windows": windows, "scrollback_bytes": scrollback_bytes, "line_bytes": line_bytes,
+                       "rate_lines_per_s": rate, "iterations": iterations, "call_latency_s": call_latency},
+        },
+        "results": results,
+    }
+
+
+def _print(report: dict, previous: dict = None):
+    prev = (previous or {}).get("results", {})
+    for name, r in report["results"].items():
+        line = f"{name:16s} median={r['median_ms']:9.3f} ms  p95={r['p95_ms']:9.3f} ms"
+        if r["fake_calls_per_op"] is not None:
+            line += f"  calls/op={r['fake_calls_per_op']:.0f}"
+        if name in prev and prev[name]["median_ms"]:
+            line += f"  x{r['median_ms'] / prev[name]['median_ms']:.2f} vs {previous['meta'].get('commit') or 'previous'}"
+        print(line)
+
+
+if __name__ == "__main__":
+    opts = {"windows": "500", "scrollback-bytes": "1000000", "line-bytes": "80", "rate": "20",
+            "iterations": "50", "call-latency-us": "50", "out": "bench_results.json", "compare": ""}
+    for arg in sys.argv[1:]:
+        if arg.startswith("--") and "=" in arg:
+            key, val = arg[2:].split("=", 1)
+            opts[key] = val
+    report = run(int(opts["windows"]), int(opts["scrollback-bytes"]), int(opts["line-bytes"]),
+                 int(opts["rate"]), int(opts["iterations"]), float(opts["call-latency-us"]) / 1e6)
+    previous = None
+    if opts["compare"]:
+        with open(opts["compare"], encoding="utf-8") as f:
+            previous = json.load(f)
+    _print(report, previous)
+    if opts["out"]:
+        with open(opts["out"], "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {opts['out']}")
@@ -0,0 +1,163 @@
+"""Simulated Windows desktop exposing the slice of pywinauto's API that dippingbird uses.
+
+FakeDesktopState.Desktop / .Application stand in for pywinauto's Desktop / Application, so
+the real PywinautoBackend, TargetResolver and snapshot code run against them unchanged:
+
+    desktop = FakeDesktopState(windows=500, scrollback_bytes=1_000_000)
+    backend = dippingbird.PywinautoBackend(desktop.Desktop, desktop.Application)
+
+`call_latency` (seconds) makes each property read sleep, to model cross-process round-trips.
+"""
+import itertools
+import re
+import threading
+import time
+
+CONSOLE_CLASS = "ConsoleWindowClass"
+
+
+class FakeTextControl:
+    def __init__(self, state, text: str):
+        self._state = state
+        self._text = text
+
+    def window_text(self) -> str:
+        self._state.call()
+        return self._text
+
+
+class FakeWindow:
+    """A top-level window wrapper: title/class/pid plus an optional console buffer of Text lines."""
+
+    def __init__(self, state, handle: int, title: str, class_name: str, pid: int, lines=None):
+        self._state = state
+        self.handle = handle
+        self._title = title
+        self._class_name = class_name
+        self._pid = pid
+        self.lines = lines if lines is not None else []
+        self.sent = []
+        self.alive = True
+
+    def window_text(self) -> str:
+        self._state.call()
+        return self._title
+
+    def class_name(self) -> str:
+        self._state.call()
+        return self._class_name
+
+    def process_id(self) -> int:
+        self._state.call()
+        return self._pid
+
+    def exists(self, timeout=None) -> bool:
+        return self.alive
+
+    def descendants(self, control_type=None):
+        if control_type not in (None, "Text"):
+            return []
+        with self._state.lock:
+            # UIA walks every element of the subtree, so count one round-trip per element
+            self._state.calls += len(self.lines)
+            return [FakeTextControl(self._state, line) for line in self.lines]
+
+    def send_keystrokes(self, keys: str):
+        self.sent.append(keys)
+
+    def wrapper_object(self):
+        return self
+
+    def append_output(self, lines):
+        with self._state.lock:
+            self.lines.extend(lines)
+            overflow = len(self.lines) - self._state.max_lines
+            if overflow > 0:
+                del self.lines[:overflow]
+
+
+class _WindowSpec:
+    def __init__(self, window):
+        self._window = window
+
+    def wrapper_object(self):
+        if self._window is None or not self._window.alive:
+            raise RuntimeError("window not found")
+        return self._window
+
+
+class FakeDesktopState:
+    """Holds the simulated windows; `Desktop` and `Application` are the drop-in pywinauto classes."""
+
+    def __init__(self, windows: int = 50, consoles: int = 1, scrollback_bytes: int = 100_000,
+                 line_bytes: int = 80, target_title: str = "Administrator: Command Prompt - codex",
+                 call_latency: float = 0.0):
+        self.lock = threading.Lock()
+        self.calls = 0  # property reads and subtree elements walked, a proxy for UIA round-trips
+        self.call_latency = call_latency
+        self.line_bytes = line_bytes
+        self.max_lines = max(1, scrollback_bytes // line_bytes)
+        self._line_counter = itertools.count()
+        self.windows = []
+        handles = itertools.count(0x10000, 0x10)
+        for i in range(max(0, windows - consoles)):
+            self.windows.append(FakeWindow(self, next(handles), f"Document {i} - Editor", "Notepad", 1000 + i))
+        for i in range(consoles):
+            title = target_title if i == 0 else f"Administrator: Command Prompt - agent {i}"
+            lines = [self.make_line() for _ in range(self.max_lines)]
+            # Consoles last, so heuristic scans walk the whole desktop before finding them
+            self.windows.append(FakeWindow(self, next(handles), title, CONSOLE_CLASS, 5000 + i, lines))
+        self.consoles = self.windows[len(self.windows) - consoles:] if consoles else []
+        state = self
+
+        class Desktop:
+            def __init__(self, backend="win32"):
+                self.backend = backend
+
+            def windows(self):
+                return list(state.windows)
+
+        class Application:
+            def __init__(self, backend="win32"):
+                self.backend = backend
+                self._matches = []
+
+            def connect(self, handle=None, title_re=None, **kwargs):
+                self._matches = state.find(handle=handle, title_re=title_re)
+                if not self._matches:
+                    raise RuntimeError("no matching window")
+                return self
+
+            def window(self, handle=None, title_re=None, **kwargs):
+                matches = state.find(handle=handle, title_re=title_re) if (handle or title_re) else self._matches
+                return _WindowSpec(matches[0] if matches else None)
+
+        self.Desktop = Desktop
+        self.Application = Application
+
+    def call(self):
+        self.calls += 1
+        if self.call_latency:
+            time.sleep(self.call_latency)
+
+    def make_line(self) -> str:
+        n = next(self._line_counter)
+        prefix = f"[{n:08d}] "
+        return prefix + "x" * max(0, self.line_bytes - len(prefix))
+
+    def find(self, handle=None, title_re=None):
+        pattern = re.compile(title_re) if title_re else None
+        found = []
+        for w in self.windows:
+            if not w.alive:
+                continue
+            if handle is not None and w.handle != handle:
+                continue
+            if pattern is not None and not pattern.match(w._title):
+                continue
+            found.append(w)
+        return found
+
+    def emit(self, console: FakeWindow, count: int):
+        """Appends `count` new output lines to a console, trimming to the scrollback limit."""
+        console.append_output([self.make_line() for _ in range(count)])
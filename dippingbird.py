@@ -1,9 +1,6 @@
 import time
 import os
 import threading
-import pygame
-from pywinauto import Application, Desktop
-from PIL import Image, ImageSequence
 import signal
 import sys
 import re
@@ -11,6 +8,22 @@ import random
 import atexit
 import subprocess
 import hashlib
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+import zlib
+import codecs
+import bisect
+import json
+import mmap
+import struct
+import tempfile
+from contextlib import contextmanager
+import shutil
+import weakref
+import logging
+import logging.handlers
+import itertools
+from collections import deque
 
 # Environment helpers
 def _get_env_bool(name: str, default: bool) -> bool:
@@ -28,23 +41,88 @@ def _get_env_int(name: str, default: int) -> int:
 APP_TITLE = os.environ.get("APP_TITLE", "Administrator: Command Prompt")
 APP_TITLE_CONTAINS = os.environ.get("APP_TITLE_CONTAINS", "")
 ALWAYS_SEND_Y = _get_env_bool("ALWAYS_SEND_Y", True)
-RUN_EVERY = _get_env_int("RUN_EVERY", 3)  # seconds
+RUN_EVERY = _get_env_int("RUN_EVERY", 3)  # seconds; base poll interval
+POLL_ADAPTIVE = _get_env_bool("POLL_ADAPTIVE", True)  # back off while idle, wake at the stale deadline
+POLL_MAX_SECONDS = _get_env_int("POLL_MAX_SECONDS", 30)  # longest idle poll interval
+POLL_ERROR_MAX_SECONDS = _get_env_int("POLL_ERROR_MAX_SECONDS", 60)  # longest backoff after repeated errors
 TARGET_HANDLE_ENV = os.environ.get("TARGET_HANDLE")
 PERSISTENT = _get_env_bool("PERSISTENT", False)
 STALE_SECONDS = _get_env_int("STALE_SECONDS", 30)
-REEVALUATION_ENABLED = _get_env_bool("REEVALUATION_ENABLED", False)
+REEVALUATION_ENABLED = _get_env_bool("REEVALUATION_ENABLED", False)  # send REEVALUATION_MESSAGE when output loops
+ACTIVITY_PROBE = _get_env_bool("ACTIVITY_PROBE", False)  # skip text reads while the target's process tree is busy
+ACTIVITY_CPU_PERCENT = _get_env_int("ACTIVITY_CPU_PERCENT", 2)  # tree CPU use (% of one core) that counts as busy
+ACTIVITY_IO_BYTES = _get_env_int("ACTIVITY_IO_BYTES", 4096)  # bytes read+written per poll that count as busy
 MIN_SEND_MINUTES = _get_env_int("MIN_SEND_MINUTES", 0)
 MIN_SEND_SECONDS = max(0, MIN_SEND_MINUTES * 60)
+RESOLVE_TTL = _get_env_int("RESOLVE_TTL", 30)  # seconds a resolved target is trusted before a full rescan
+CONN_POOL = _get_env_bool("CONN_POOL", True)  # keep connected window wrappers between ticks
+CONN_POOL_LOG_SECONDS = _get_env_int("CONN_POOL_LOG_SECONDS", 300)  # how often the pool hit rate is printed; 0 = only at exit
+ENUM_SNAPSHOT_TTL = _get_env_int("ENUM_SNAPSHOT_TTL", 2)  # seconds a desktop window listing is shared between callers
+SNAPSHOT_MODE = os.environ.get("SNAPSHOT_MODE", "tail").strip().lower()  # "tail" or "full"
+SNAPSHOT_TAIL_LINES = _get_env_int("SNAPSHOT_TAIL_LINES", 40)
+SNAPSHOT_TAIL_CHARS = _get_env_int("SNAPSHOT_TAIL_CHARS", 4096)
+SCROLLBACK_LINES = _get_env_int("SCROLLBACK_LINES", 2000)  # console lines kept per target (ring buffer)
+SCROLLBACK_LINE_CHARS = _get_env_int("SCROLLBACK_LINE_CHARS", 1024)  # longer lines keep only their end
+TEXT_SOURCE = os.environ.get("TEXT_SOURCE", "auto").strip().lower()  # "auto" (UIA TextPattern if available) or "descendants"
+WATCH_MODE = os.environ.get("WATCH_MODE", "poll").strip().lower()  # "poll" or "events"
+TARGETS_FILE = os.environ.get("TARGETS_FILE", "")
+PTY_COMMAND = shlex.split(os.environ.get("PTY_COMMAND", ""))  # agent CLI to run under a pty instead of scraping a window
+PTY_ECHO = _get_env_bool("PTY_ECHO", True)  # mirror the child's output to our stdout
+DAEMON = _get_env_bool("DAEMON", False)  # keep running with a local control socket (see --ctl)
+CONTROL_PORT = _get_env_int("CONTROL_PORT", 0)  # 127.0.0.1 port for the daemon; 0 picks a free one
+CONTROL_FILE = os.environ.get("CONTROL_FILE", os.path.join(os.path.expanduser("~"), ".dippingbird-control.json"))
+FLEET_WORKERS = _get_env_int("FLEET_WORKERS", 0)  # >0 shards targets across this many worker processes
+FLEET_HANG_SECONDS = _get_env_int("FLEET_HANG_SECONDS", 180)  # a worker whose target rows stop updating this long is restarted
+FLEET_STATUS_SECONDS = _get_env_int("FLEET_STATUS_SECONDS", 60)  # how often the fleet status table is printed
+SUPERVISOR_WORKERS = _get_env_int("SUPERVISOR_WORKERS", 8)
+PROMPT_RULES_FILE = os.environ.get("PROMPT_RULES_FILE", "")
+PROMPT_TAIL_LINES = _get_env_int("PROMPT_TAIL_LINES", 3)  # prompts only count on the last few lines
+PROMPT_TAIL_WINDOW = 8192  # characters scanned from the end of the buffer when cutting the tail
+PROMPT_SETTLE_SECONDS = 0.5  # quiet time after a change event before the tail is checked for a prompt
 
 REEVALUATION_MESSAGE = "Let's take a step back and re-evaluate if what we're doing makes sense. We might be getting in a loop here. Let's do something a little more out of left field instead."
-REEVALUATION_CHANCE = 0.1
+LOOP_TAIL_LINES = _get_env_int("LOOP_TAIL_LINES", 40)  # lines of each snapshot the loop detector looks at
+LOOP_SHINGLE_LINES = _get_env_int("LOOP_SHINGLE_LINES", 3)  # consecutive lines hashed into one shingle
+LOOP_HISTORY = _get_env_int("LOOP_HISTORY", 4096)  # shingles remembered (bounded ring)
+LOOP_WINDOW = _get_env_int("LOOP_WINDOW", 8)  # recent output chunks the repetition ratio is taken over
+LOOP_MIN_SHINGLES = _get_env_int("LOOP_MIN_SHINGLES", 24)  # new shingles needed in the window before judging
+LOOP_THRESHOLD = _get_env_int("LOOP_THRESHOLD_PERCENT", 80) / 100.0  # share of new shingles seen before => loop
+LOOP_COOLDOWN_SECONDS = _get_env_int("LOOP_COOLDOWN_SECONDS", 300)  # minimum gap between two loop nudges
+
+SEND_QUEUE = _get_env_bool("SEND_QUEUE", True)  # deliver keystrokes from a send worker instead of inline
+SEND_QUEUE_SIZE = _get_env_int("SEND_QUEUE_SIZE", 64)
+SEND_RATE_PER_MINUTE = _get_env_int("SEND_RATE_PER_MINUTE", 30)  # per target
+SEND_GLOBAL_RATE_PER_MINUTE = _get_env_int("SEND_GLOBAL_RATE_PER_MINUTE", 120)
+SEND_BURST = _get_env_int("SEND_BURST", 3)  # sends a target's bucket can hold
+SEND_GLOBAL_BURST = _get_env_int("SEND_GLOBAL_BURST", 10)
+SEND_TIMEOUT_SECONDS = _get_env_int("SEND_TIMEOUT_SECONDS", 10)
+SEND_RETRIES = _get_env_int("SEND_RETRIES", 2)
 
 FORCE_EXIT_DELAY = 5  # seconds
 
 GIF_PATH = 'dippingbird.gif'
-DISABLE_GIF = False  # Set to True to disable the GIF display
+DISABLE_GIF = _get_env_bool("DISABLE_GIF", False)  # Set to True to disable the GIF display
+METRICS_JSONL = os.environ.get("METRICS_JSONL", "")  # append a metrics snapshot here every METRICS_INTERVAL seconds
+METRICS_INTERVAL = _get_env_int("METRICS_INTERVAL", 60)
+METRICS_PORT = _get_env_int("METRICS_PORT", 0)  # serve Prometheus text on 127.0.0.1:PORT/metrics; 0 disables
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").strip().upper()  # DEBUG adds the per-tick "skipping send" lines
+LOG_FILE = os.environ.get("LOG_FILE", "")  # also log to this file, rotated at LOG_MAX_BYTES
+LOG_MAX_BYTES = _get_env_int("LOG_MAX_BYTES", 10 * 1024 * 1024)
+LOG_BACKUPS = _get_env_int("LOG_BACKUPS", 5)
+LOG_JSON = _get_env_bool("LOG_JSON", False)  # write LOG_FILE as JSON lines
+LOG_QUEUE_SIZE = _get_env_int("LOG_QUEUE_SIZE", 10000)  # records waiting for the writer; more are dropped, never waited on
+RECORD_FILE = os.environ.get("RECORD_FILE", "")  # append a session record (changes + sends) for offline replay
+RECORD_TAIL_CHARS = _get_env_int("RECORD_TAIL_CHARS", 512)  # console tail stored with each recorded change
+ANALYTICS_DB = os.environ.get("ANALYTICS_DB", "")  # SQLite file for change/stale/send/error events; see --stats
+ANALYTICS_FLUSH_SECONDS = _get_env_int("ANALYTICS_FLUSH_SECONDS", 2)  # events are written in batches this often
+ANALYTICS_ACTIVE_GAP = _get_env_int("ANALYTICS_ACTIVE_GAP", 5)  # output gaps up to this long count as agent activity
+REPLAY_WASTE_SECONDS = _get_env_int("REPLAY_WASTE_SECONDS", 10)  # a replayed send with no output this soon after is "wasted"
+GIF_CACHE = os.environ.get("GIF_CACHE", "")  # decoded-frame cache path; "off" disables, "" = next to the GIF
 WINDOW_SIZE = (300, 300)
-FRAME_RATE = 60
+FRAME_RATE = 60  # upper bound on redraws per second
+GIF_BACKGROUND_FPS = _get_env_int("GIF_BACKGROUND_FPS", 2)  # redraw cap while the bird window is unfocused
+GIF_PAUSED_POLL = 0.5  # seconds between event checks while minimized (no drawing at all)
+GIF_MIN_FRAME_MS = 20  # GIFs with 0/too-small delays are shown at this pace, like browsers do
 
 
 # Event to manage thread termination
@@ -53,43 +131,33 @@ stop_event = threading.Event()
 # Global flag for stopping
 should_exit = False
 SELECTED_HANDLE = None  # Preferred target window handle for this run
+TARGET_HANDLES = []  # Every --handle= given; more than one switches to multi-target mode
 
 def list_open_windows():
-    print("Listing all open windows (win32 backend):")
-    try:
-        windows = Desktop(backend="win32").windows()
-        for w in windows:
-            try:
-                print(f"[{w.class_name()}] '{w.window_text()}' (pid={w.process_id()}, handle={hex(w.handle)})")
-            except Exception:
-                pass
-    except Exception as e:
-        print(f"Error listing win32 windows: {e}")
-    print("Listing all open windows (uia backend):")
-    try:
-        windows = Desktop(backend="uia").windows()
-        for w in windows:
-            try:
-                print(f"[{w.class_name()}] '{w.window_text()}' (pid={w.process_id()}, handle={hex(w.handle)})")
-            except Exception:
-                pass
-    except Exception as e:
-        print(f"Error listing uia windows: {e}")
+    print("Listing all open windows (win32 + uia backends):")
+    enumerator = _window_enumerator(_backend)
+    for info in enumerator.snapshot(("win32", "uia"), prefetch=("title", "class_name", "pid")):
+        print(f"[{info.class_name}] '{info.title}' (pid={info.pid}, handle={hex(info.handle)}, "
+              f"backends={'+'.join(info.wrappers)})")
+    for name, e in enumerator.errors.items():
+        print(f"Error listing {name} windows: {e}")
 
 # Connect to the command prompt window
 def inspect_controls():
     try:
         print("Listing relevant windows:")
-        windows = Desktop(backend="win32").windows()
         search_terms = ["administrator", "command", "prompt", "cmd", "aider"]
-        
+
+        enumerator = _window_enumerator(_backend)
         filtered_windows = [
-            w for w in windows
-            if any(term.lower() in w.window_text().lower() for term in search_terms)
+            info for info in enumerator.snapshot(("win32",))
+            if any(term in info.title.lower() for term in search_terms)
         ]
-        
-        for w in filtered_windows:
-            print(f"[{w.class_name()}] '{w.window_text()}' (pid={w.process_id()}, handle={hex(w.handle)})")
+
+        for info in filtered_windows:
+            print(f"[{info.class_name}] '{info.title}' (pid={info.pid}, handle={hex(info.handle)})")
+        if "win32" in enumerator.errors:
+            raise enumerator.errors["win32"]
 
     except Exception as e:
         print(f"Error listing windows: {e}")
@@ -105,9 +173,10 @@ def handle_sigint(signum, frame):
     threading.Timer(FORCE_EXIT_DELAY, force_exit_now).start()
     sys.exit(0)
 
-# Check if the cmd output matches either the "> " or "[Yes]:"
+# Check if the cmd output ends in an input ("> ") or confirmation prompt
 def check_cmd_output():
     try:
+        from pywinauto import Application
         # Connect to the window
         app = Application().connect(title_re=f"^{re.escape(APP_TITLE)}.*")
         window = app.window(title_re=f"^{re.escape(APP_TITLE)}.*")
@@ -115,20 +184,18 @@ def check_cmd_output():
         # Access the text control inside the command prompt window
         text_control = window.child_window(control_type="Edit")  # The command prompt text area is usually an "Edit" control
         
-        # Get the window text
-        window_text = text_control.wrapper_object().texts()
-        
-        # Join all the window text lines into one string
-        cmd_output = "\n".join(window_text).strip()
+        # Fold the window text into the ring; only the tail is ever joined again
+        _cmd_scrollback.merge(text_control.wrapper_object().texts())
         
         # Print the last 20 lines for debugging
-        print("\n".join(window_text[-20:]).strip())
+        log.debug(_cmd_scrollback.tail(20).strip())
         
-        # Check if the command ends with "> " or "[Yes]:"
-        if re.search(r"> *$", cmd_output) or cmd_output.endswith("[Yes]:"):
+        rule = _match_prompt(_cmd_scrollback.tail(PROMPT_TAIL_LINES), kinds=("confirm", "input"))
+        if rule is not None:
+            log.info(f"Prompt rule matched: {rule}")
             return True
     except Exception as e:
-        print(f"Error reading window: {e}")
+        log.error(f"Error reading window: {e}")
     return False
 
 
@@ -145,31 +212,436 @@ def _window_title_matches(title: str) -> bool:
     # Default heuristic: Elevated Command Prompt
     return title_lower.startswith("administrator:") and ("command prompt" in title_lower or "cmd" in title_lower)
 
-def _find_target_window_win32():
-    try:
-        candidates = []
-        for w in Desktop(backend="win32").windows():
+UIA_TEXT_CHANGED_EVENT_ID = 20015  # UIA_Text_TextChangedEventId
+
+
+# UIA TextPatternRangeEndpoint / TextUnit values
+UIA_ENDPOINT_START = 0
+UIA_ENDPOINT_END = 1
+UIA_TEXT_UNIT_LINE = 3
+
+
+class ConsoleTextPattern:
+    """Reads console text through the UIA TextPattern: the visible range, or the last N lines ending at its bottom.
+
+    Costs the same however long the scrollback is, unlike walking every Text descendant.
+    """
+
+    def __init__(self, handle: int, pattern, wrapper):
+        self.handle = handle
+        self.pattern = pattern
+        self.wrapper = wrapper
+
+    def exists(self, timeout=None) -> bool:
+        return bool(self.wrapper.exists())
+
+    def read(self, tail_lines: int = None) -> str:
+        ranges = self.pattern.GetVisibleRanges()
+        count = ranges.Length
+        if not count:
+            return ""
+        if tail_lines is not None and tail_lines > 0:
+            bottom = ranges.GetElement(count - 1)
+            rng = bottom.Clone()
+            # Collapse to the bottom of the viewport, then widen back over the last N lines
+            rng.MoveEndpointByRange(UIA_ENDPOINT_START, bottom, UIA_ENDPOINT_END)
+            rng.MoveEndpointByUnit(UIA_ENDPOINT_START, UIA_TEXT_UNIT_LINE, -tail_lines)
+            raw = rng.GetText(-1)
+        else:
+            raw = "\n".join(ranges.GetElement(i).GetText(-1) for i in range(count))
+        # Console rows come back space-padded, with blank rows below the cursor
+        lines = [line.rstrip() for line in raw.replace("\r\n", "\n").split("\n")]
+        while lines and not lines[-1]:
+            lines.pop()
+        return "\n".join(lines)
+
+
+class ConnectionPool:
+    """Connected wrapper objects keyed by (handle, backend), reused until the window closes or a read fails."""
+
+    def __init__(self, alive, enabled: bool = None):
+        self.alive = alive  # cheap liveness probe for a pooled wrapper
+        self.enabled = CONN_POOL if enabled is None else enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._wrappers = {}
+
+    def get(self, handle: int, backend: str, connect):
+        key = (handle, backend)
+        if self.enabled:
+            with self._lock:
+                wrapper = self._wrappers.get(key)
+            if wrapper is not None:
+                if self.alive(wrapper):
+                    self.hits += 1
+                    metrics.inc("conn_pool_hits")
+                    return wrapper
+                self.invalidate(handle, backend)
+        self.misses += 1
+        metrics.inc("conn_pool_misses")
+        wrapper = connect()
+        if self.enabled:
+            with self._lock:
+                self._wrappers[key] = wrapper
+        return wrapper
+
+    def invalidate(self, handle: int = None, backend: str = None):
+        """Drops pooled wrappers for a handle (all backends unless given), or everything when handle is None."""
+        with self._lock:
+            doomed = [k for k in self._wrappers
+                      if handle is None or (k[0] == handle and (backend is None or k[1] == backend))]
+            for k in doomed:
+                del self._wrappers[k]
+            self.evictions += len(doomed)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "size": len(self._wrappers), "hit_rate": self.hits / total if total else 0.0}
+
+
+class PywinautoBackend:
+    """Seam over pywinauto's Desktop/Application so window lookup can be driven by a fake desktop."""
+
+    def __init__(self, desktop=None, application=None):
+        # pywinauto itself is imported on first use so pty/headless runs never load it
+        self._desktop = desktop
+        self._application = application
+        # Injected (fake) classes are probed through their own wrappers, not real window handles
+        self._injected = desktop is not None or application is not None
+        self.pool = ConnectionPool(self.is_window)
+        self._no_text_pattern = set()  # handles whose console exposes no TextPattern
+
+    def _classes(self):
+        if self._desktop is None or self._application is None:
+            from pywinauto import Application, Desktop
+            self._desktop = self._desktop or Desktop
+            self._application = self._application or Application
+        return self._desktop, self._application
+
+    def windows(self, backend: str):
+        desktop, _ = self._classes()
+        return desktop(backend=backend).windows()
+
+    def connect_handle(self, handle: int, backend: str = "win32"):
+        def connect():
+            _, application = self._classes()
+            app = application(backend=backend).connect(handle=handle)
+            return app.window(handle=handle).wrapper_object()
+
+        return self.pool.get(handle, backend, connect)
+
+    def forget(self, handle: int = None):
+        """Drops pooled connections for a window that errored or closed."""
+        self.pool.invalidate(handle)
+        if handle is None:
+            self._no_text_pattern.clear()
+        else:
+            self._no_text_pattern.discard(handle)
+
+    def text_reader(self, handle: int):
+        """Pooled ConsoleTextPattern for the window, or None if no element in it supports TextPattern."""
+        if handle in self._no_text_pattern:
+            return None
+
+        def connect():
+            from pywinauto.uia_defines import IUIA, get_elem_interface
+            wrapper = self.connect_handle(handle, "uia")
+            element = wrapper.element_info.element
+            uia = IUIA()
+            # The console's text area is a descendant of the top-level window (or the window itself)
+            condition = uia.iuia.CreatePropertyCondition(uia.UIA_dll.UIA_IsTextPatternAvailablePropertyId, True)
+            text_element = element.FindFirst(uia.tree_scope["subtree"], condition)
+            if not text_element:
+                raise LookupError("no TextPattern provider")
+            return ConsoleTextPattern(handle, get_elem_interface(text_element, "Text"), wrapper)
+
+        try:
+            return self.pool.get(handle, "uia-text", connect)
+        except Exception:
+            self._no_text_pattern.add(handle)
+            return None
+
+    def connect_title_re(self, title_re: str, backend: str = "win32"):
+        _, application = self._classes()
+        app = application(backend=backend).connect(title_re=title_re)
+        return app.window(title_re=title_re).wrapper_object()
+
+    def is_window(self, window) -> bool:
+        # Cheap liveness probe: IsWindow() on the cached handle, no desktop walk
+        try:
+            if not self._injected:
+                from pywinauto import handleprops
+                return bool(handleprops.iswindow(window.handle))
+            return bool(window.exists())
+        except Exception:
+            return False
+
+    def read_text(self, window, tail_lines: int = None) -> str:
+        return _read_console_text_snapshot_by_handle(window.handle, tail_lines, backend=self)
+
+    def subscribe_text_changes(self, window, callback):
+        """Registers a UIA TextChanged handler on the window's subtree.
+
+        Returns an unsubscribe callable, or None when events are unavailable (caller falls back to polling).
+        """
+        try:
+            import comtypes
+            from pywinauto.uia_defines import IUIA
+        except ImportError:
+            return None
+        try:
+            uia = IUIA()
+            element = self.connect_handle(window.handle, "uia").element_info.element
+
+            class _TextChangedHandler(comtypes.COMObject):
+                _com_interfaces_ = [uia.UIA_dll.IUIAutomationEventHandler]
+
+                def HandleAutomationEvent(self, sender, event_id):
+                    callback()
+
+            handler = _TextChangedHandler()
+            uia.iuia.AddAutomationEventHandler(
+                UIA_TEXT_CHANGED_EVENT_ID, element, uia.tree_scope["subtree"], None, handler
+            )
+        except Exception:
+            return None
+
+        def unsubscribe():
             try:
-                if w.class_name() == "ConsoleWindowClass" and _window_title_matches(w.window_text()):
-                    candidates.append(w)
+                uia.iuia.RemoveAutomationEventHandler(UIA_TEXT_CHANGED_EVENT_ID, element, handler)
             except Exception:
-                continue
-        return candidates
-    except Exception:
-        return []
+                pass
 
-def _find_target_window_uia():
-    try:
-        candidates = []
-        for w in Desktop(backend="uia").windows():
+        return unsubscribe
+
+
+_WINDOW_PROPS = (("title", "window_text", ""), ("class_name", "class_name", ""), ("pid", "process_id", None))
+
+
+class WindowInfo:
+    """One top-level window merged across backends; title/class/pid are read on first use, once per snapshot."""
+
+    __slots__ = ("handle", "wrappers", "_props")
+
+    def __init__(self, handle: int, props: dict):
+        self.handle = handle
+        self.wrappers = {}  # backend name -> wrapper, in the order the backends were merged
+        self._props = props  # shared with the enumerator so reads survive across snapshot() calls
+
+    def wrapper(self, backend: str = None):
+        if backend is None:
+            return next(iter(self.wrappers.values()), None)
+        return self.wrappers.get(backend)
+
+    def _get(self, name: str):
+        try:
+            return self._props[name]
+        except KeyError:
+            pass
+        for attr, method, default in _WINDOW_PROPS:
+            if attr == name:
+                break
+        value = default
+        # Ask the first (cheapest) backend that listed the window
+        for w in self.wrappers.values():
             try:
-                if _window_title_matches(w.window_text()):
-                    candidates.append(w)
+                value = getattr(w, method)()
+                break
             except Exception:
                 continue
-        return candidates
-    except Exception:
-        return []
+        self._props[name] = value
+        return value
+
+    def prefetch(self, attrs=("title", "class_name", "pid")):
+        for attr in attrs:
+            self._get(attr)
+        return self
+
+    title = property(lambda self: self._get("title"))
+    class_name = property(lambda self: self._get("class_name"))
+    pid = property(lambda self: self._get("pid"))
+
+
+class WindowEnumerator:
+    """Shared desktop listing: backends are enumerated concurrently, merged by handle and kept for ENUM_SNAPSHOT_TTL.
+
+    Properties are cached per handle and read through the first backend that listed the window,
+    so a window seen by both win32 and UIA costs one set of (cheap, win32) property reads.
+    """
+
+    ORDER = ("win32", "uia")
+
+    def __init__(self, backend, ttl: float = ENUM_SNAPSHOT_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.scans = 0
+        self.errors = {}  # backend name -> last enumeration error
+        self._lock = threading.Lock()
+        self._raw = {}  # backend name -> (monotonic ts, [(handle, wrapper)])
+        self._props = {}  # handle -> {property: value}
+
+    def invalidate(self):
+        with self._lock:
+            self._raw.clear()
+            self._props.clear()
+
+    def _scan(self, name: str):
+        entries = []
+        with metrics.span(f"enumerate_{name}"):
+            for w in self.backend.windows(name):
+                try:
+                    handle = w.handle
+                except Exception:
+                    continue
+                if handle:
+                    entries.append((handle, w))
+        return entries
+
+    def _safe_scan(self, name: str):
+        try:
+            entries = self._scan(name)
+            self.errors.pop(name, None)
+            return entries
+        except Exception as e:
+            self.errors[name] = e
+            return []
+
+    def snapshot(self, backends=ORDER, prefetch: tuple = ()) -> list:
+        """Returns WindowInfo for every window listed by `backends`, in win32-then-uia order.
+
+        `prefetch` names properties to read up front, in parallel, for listings that show them all.
+        """
+        with self._lock:
+            now = time.monotonic()
+            missing = [b for b in backends if b not in self._raw or now - self._raw[b][0] >= self.ttl]
+            if missing:
+                self.scans += 1
+                # Titles can change between scans; re-read them against the new listing
+                self._props.clear()
+                if len(missing) == 1:
+                    results = {missing[0]: self._safe_scan(missing[0])}
+                else:
+                    with ThreadPoolExecutor(max_workers=len(missing), thread_name_prefix="dippingbird-enum") as pool:
+                        futures = {b: pool.submit(self._safe_scan, b) for b in missing}
+                        results = {b: f.result() for b, f in futures.items()}
+                for b, entries in results.items():
+                    self._raw[b] = (now, entries)
+            merged = {}
+            for b in sorted(backends, key=lambda b: self.ORDER.index(b) if b in self.ORDER else len(self.ORDER)):
+                for handle, w in self._raw[b][1]:
+                    info = merged.get(handle)
+                    if info is None:
+                        info = merged[handle] = WindowInfo(handle, self._props.setdefault(handle, {}))
+                    info.wrappers.setdefault(b, w)
+            infos = list(merged.values())
+            if prefetch and infos:
+                with ThreadPoolExecutor(max_workers=min(8, len(infos)), thread_name_prefix="dippingbird-enum") as pool:
+                    list(pool.map(lambda info: info.prefetch(prefetch), infos))
+            return infos
+
+
+_enumerators = weakref.WeakKeyDictionary()
+
+
+def _window_enumerator(backend) -> WindowEnumerator:
+    enumerator = _enumerators.get(backend)
+    if enumerator is None:
+        enumerator = _enumerators[backend] = WindowEnumerator(backend)
+    return enumerator
+
+
+class TargetResolver:
+    """Remembers the resolved target window and only rescans the desktop on a miss or after RESOLVE_TTL."""
+
+    def __init__(self, backend, ttl: float = RESOLVE_TTL, handles: tuple = None):
+        self.backend = backend
+        self.ttl = ttl
+        # Fixed handles for a pinned target; None follows SELECTED_HANDLE / TARGET_HANDLE
+        self.handles = handles
+        self.hits = 0
+        self.misses = 0
+        self._window = None
+        self._key = None
+        self._resolved_at = 0.0
+
+    def invalidate(self):
+        if self._window is not None:
+            self.backend.forget(getattr(self._window, "handle", None))
+        self._window = None
+        self._key = None
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _still_valid(self, window, pinned: tuple) -> bool:
+        if not self.backend.is_window(window):
+            return False
+        if pinned:
+            # Explicitly pinned handles are trusted regardless of title
+            return True
+        try:
+            return _window_title_matches(window.window_text())
+        except Exception:
+            return False
+
+    def resolve(self):
+        pinned = self.handles if self.handles is not None else _preferred_handles()
+        now = time.monotonic()
+        window = self._window
+        if (
+            window is not None
+            and self._key == pinned
+            and now - self._resolved_at < self.ttl
+            and self._still_valid(window, pinned)
+        ):
+            self.hits += 1
+            return window
+        self.misses += 1
+        window = self._full_resolve(pinned)
+        self._window = window
+        self._key = pinned if window is not None else None
+        self._resolved_at = now
+        return window
+
+    def _full_resolve(self, pinned: tuple):
+        # 1) Prefer explicitly selected handle, then TARGET_HANDLE env var
+        for handle in pinned:
+            wnd = _connect_window_by_handle(handle, self.backend)
+            if wnd is not None:
+                return wnd
+        if self.handles is not None:
+            # A pinned target never borrows another console: that window belongs to some other target
+            return None
+        # Prefer exact/regex via Application if APP_TITLE is provided
+        if APP_TITLE:
+            try:
+                return self.backend.connect_title_re(f"^{re.escape(APP_TITLE)}.*")
+            except Exception:
+                pass
+        # Heuristic search
+        win32_candidates = _find_target_window_win32(self.backend)
+        if win32_candidates:
+            return win32_candidates[0]
+        uia_candidates = _find_target_window_uia(self.backend)
+        if uia_candidates:
+            return uia_candidates[0]
+        return None
+
+
+def _find_target_window_win32(backend=None):
+    infos = _window_enumerator(backend or _backend).snapshot(("win32",))
+    return [
+        info.wrapper("win32") for info in infos
+        if info.class_name == "ConsoleWindowClass" and _window_title_matches(info.title)
+    ]
+
+def _find_target_window_uia(backend=None):
+    # Merged with the (cached) win32 listing so UIA properties are only read for windows win32 missed
+    infos = _window_enumerator(backend or _backend).snapshot(("win32", "uia"))
+    return [info.wrapper("uia") for info in infos if "uia" in info.wrappers and _window_title_matches(info.title)]
 
 def _parse_handle(value: str):
     if value is None:
@@ -182,89 +654,223 @@ def _parse_handle(value: str):
     except Exception:
         return None
 
-def _connect_window_by_handle(handle: int):
+def _preferred_handles() -> tuple:
+    handles = []
+    if SELECTED_HANDLE is not None:
+        handles.append(SELECTED_HANDLE)
+    env_handle = _parse_handle(TARGET_HANDLE_ENV)
+    if env_handle is not None and env_handle not in handles:
+        handles.append(env_handle)
+    return tuple(handles)
+
+def _connect_window_by_handle(handle: int, backend=None):
     if handle is None:
         return None
+    backend = backend or _backend
     # Try win32 first
     try:
-        app = Application(backend="win32").connect(handle=handle)
-        return app.window(handle=handle)
+        return backend.connect_handle(handle, "win32")
     except Exception:
         pass
     # Fallback UIA
     try:
-        app = Application(backend="uia").connect(handle=handle)
-        return app.window(handle=handle)
+        return backend.connect_handle(handle, "uia")
     except Exception:
         return None
 
+_backend = PywinautoBackend()
+_resolver = TargetResolver(_backend)
+
 def find_target_window():
-    # 1) Prefer explicitly selected handle
-    if SELECTED_HANDLE is not None:
-        wnd = _connect_window_by_handle(SELECTED_HANDLE)
-        if wnd is not None:
-            return wnd
-    # 2) Prefer TARGET_HANDLE env var
-    env_handle = _parse_handle(TARGET_HANDLE_ENV)
-    if env_handle is not None:
-        wnd = _connect_window_by_handle(env_handle)
-        if wnd is not None:
-            return wnd
-    # Prefer exact/regex via Application if APP_TITLE is provided
-    try:
-        if APP_TITLE:
+    return _resolver.resolve()
+
+
+ANSI_ESCAPE_RE = re.compile(r"\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]")
+PTY_KEYS = {"{ENTER}": "\r", "{TAB}": "\t", "{ESC}": "\x1b"}
+
+
+class PtySession:
+    """An agent CLI running under a pseudo-terminal owned by dippingbird; stands in for a console window."""
+
+    def __init__(self, argv, echo: bool = PTY_ECHO, scrollback_lines: int = SCROLLBACK_LINES):
+        self.argv = list(argv)
+        self.echo = echo
+        self.proc = None
+        self.master_fd = None
+        self.handle = None
+        self.on_exit = None
+        self.exited = threading.Event()
+        self.scrollback = Scrollback(scrollback_lines)
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def start(self):
+        import pty
+        master, slave = pty.openpty()
+        try:
+            import fcntl
+            import termios
+            size = shutil.get_terminal_size((120, 40))
+            fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", size.lines, size.columns, 0, 0))
+        except Exception:
+            pass
+        self.proc = subprocess.Popen(
+            self.argv, stdin=slave, stdout=slave, stderr=slave, start_new_session=True, close_fds=True
+        )
+        os.close(slave)
+        os.set_blocking(master, False)
+        self.master_fd = master
+        self.handle = self.proc.pid
+        threading.Thread(target=self._read_loop, name="dippingbird-pty", daemon=True).start()
+        return self
+
+    def _read_loop(self):
+        import select
+        while True:
+            fd = self.master_fd
+            if fd is None:
+                break  # closed by close() while the child was still running
+            try:
+                ready, _, _ = select.select([fd], [], [], 0.5)
+            except (OSError, ValueError):
+                break
+            if not ready:
+                if self.proc.poll() is not None:
+                    break
+                continue
+            try:
+                data = os.read(fd, 65536)
+            except BlockingIOError:
+                continue
+            except OSError:
+                break  # EIO once the child closes its side
+            if not data:
+                break
+            self._feed(data)
+        self.exited.set()
+        if self.on_exit is not None:
+            self.on_exit(self)
+
+    def _feed(self, data: bytes):
+        if self.echo:
             try:
-                app = Application(backend="win32").connect(title_re=f"^{re.escape(APP_TITLE)}.*")
-                return app.window(title_re=f"^{re.escape(APP_TITLE)}.*")
+                sys.stdout.buffer.write(data)
+                sys.stdout.flush()
             except Exception:
                 pass
-    except Exception:
-        pass
+        text = ANSI_ESCAPE_RE.sub("", self._decoder.decode(data))
+        text = text.replace("\r\n", "\n").replace("\r", "")
+        if not text:
+            return
+        with self._lock:
+            self.scrollback.feed(text)
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback()
 
-    # Heuristic search
-    win32_candidates = _find_target_window_win32()
-    if win32_candidates:
-        return win32_candidates[0]
-    uia_candidates = _find_target_window_uia()
-    if uia_candidates:
-        return uia_candidates[0]
-    return None
+    def text(self, tail_lines: int = None) -> str:
+        with self._lock:
+            return self.scrollback.tail(tail_lines if tail_lines is not None and tail_lines > 0 else None)
 
-def _gather_candidate_windows():
-    seen = set()
-    candidates = []
-    # win32
-    try:
-        for w in Desktop(backend="win32").windows():
+    def add_listener(self, callback):
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def send_keystrokes(self, keys: str):
+        for token, raw in PTY_KEYS.items():
+            keys = keys.replace(token, raw)
+        os.write(self.master_fd, keys.encode("utf-8"))
+
+    def window_text(self) -> str:
+        return " ".join(self.argv)
+
+    def process_id(self) -> int:
+        return self.proc.pid
+
+    def class_name(self) -> str:
+        return "PtySession"
+
+    def is_alive(self) -> bool:
+        return not self.exited.is_set()
+
+    def close(self):
+        if self.proc is not None and self.proc.poll() is None:
             try:
-                title = w.window_text()
-                cls = w.class_name()
-                handle = w.handle
-                if handle in seen:
-                    continue
-                if _window_title_matches(title) or cls == "ConsoleWindowClass":
-                    seen.add(handle)
-                    candidates.append((handle, cls, title, "win32"))
+                self.proc.terminate()
+                self.proc.wait(timeout=FORCE_EXIT_DELAY)
             except Exception:
-                continue
-    except Exception:
-        pass
-    # uia
-    try:
-        for w in Desktop(backend="uia").windows():
+                try:
+                    self.proc.kill()
+                except Exception:
+                    pass
+        if self.master_fd is not None:
             try:
-                title = w.window_text()
-                cls = w.class_name()
-                handle = w.handle
-                if handle in seen:
-                    continue
-                if _window_title_matches(title):
-                    seen.add(handle)
-                    candidates.append((handle, cls, title, "uia"))
-            except Exception:
-                continue
-    except Exception:
+                os.close(self.master_fd)
+            except OSError:
+                pass
+            self.master_fd = None
+
+
+class PtyBackend:
+    """Backend for agent CLIs that dippingbird launches itself under a pty (Linux/macOS).
+
+    Same interface as PywinautoBackend: sessions stand in for windows and their pid for the handle.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+
+    def spawn(self, argv, **kwargs) -> PtySession:
+        session = PtySession(argv, **kwargs).start()
+        self.sessions[session.handle] = session
+        return session
+
+    def windows(self, backend: str):
+        return [s for s in self.sessions.values() if s.is_alive()]
+
+    def connect_handle(self, handle: int, backend: str = "win32"):
+        session = self.sessions.get(handle)
+        if session is None or not session.is_alive():
+            raise LookupError(f"no live pty session {handle}")
+        return session
+
+    def forget(self, handle: int = None):
+        # Sessions are owned objects, nothing to reconnect
         pass
+
+    def connect_title_re(self, title_re: str, backend: str = "win32"):
+        raise LookupError("pty sessions are resolved by pid")
+
+    def is_window(self, window) -> bool:
+        return window.is_alive()
+
+    def read_text(self, window, tail_lines: int = None) -> str:
+        return window.text(tail_lines)
+
+    def subscribe_text_changes(self, window, callback):
+        window.add_listener(callback)
+        return lambda: window.remove_listener(callback)
+
+    def close(self):
+        for session in list(self.sessions.values()):
+            session.close()
+
+
+_pty_backend = None
+
+def _gather_candidate_windows():
+    candidates = []
+    for info in _window_enumerator(_backend).snapshot(("win32", "uia"), prefetch=("title", "class_name")):
+        source = next(iter(info.wrappers))
+        # win32 lists every top-level window, so keep consoles there even when the title doesn't match
+        if _window_title_matches(info.title) or (source == "win32" and info.class_name == "ConsoleWindowClass"):
+            candidates.append((info.handle, info.class_name, info.title, source))
     return candidates
 
 def list_candidates():
@@ -320,194 +926,2663 @@ def _detect_confirmation_prompt(uia_window) -> bool:
                     texts.append(t)
             except Exception:
                 pass
-        haystack = "\n".join(texts)
-        if not haystack:
-            return False
-        patterns = [
-            r"\(y/n\)\s*\?*$",
-            r"\[y/n\]\s*\?*$",
-            r"\[yes\]:\s*$",
-            r"are you sure.*\(y/n\).*?$",
-        ]
-        for pat in patterns:
-            if re.search(pat, haystack, re.IGNORECASE | re.MULTILINE):
-                return True
-        return False
+        return _text_has_confirmation_prompt("\n".join(texts))
     except Exception:
         return False
 
-def _read_console_text_snapshot_by_handle(handle: int) -> str:
-    try:
-        uia_app = Application(backend="uia").connect(handle=handle)
-        uia_window = uia_app.window(handle=handle)
-    except Exception:
-        return ""
-    try:
-        texts = []
-        for ctrl in uia_window.descendants(control_type="Text"):
-            try:
-                t = ctrl.window_text()
-                if t:
-                    texts.append(t)
-            except Exception:
+# (name, kind, pattern); "confirm" rules answer Y/N questions, "input" rules mark an idle input prompt
+DEFAULT_PROMPT_RULES = [
+    ("yn-paren", "confirm", r"\(y/n\)\s*\?*$"),
+    ("yn-bracket", "confirm", r"\[y/n\]\s*\?*$"),
+    ("yes-default", "confirm", r"\[yes\]:\s*$"),
+    ("are-you-sure", "confirm", r"are you sure.*\(y/n\).*?$"),
+    ("input-caret", "input", r">\s*$"),
+]
+
+
+_NUMBERED_BACKREF_RE = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]")
+
+
+class PromptRules:
+    """All prompt patterns compiled into one alternation and matched against the last few lines only."""
+
+    FLAGS = re.IGNORECASE | re.MULTILINE
+
+    def __init__(self, rules, tail_lines: int = PROMPT_TAIL_LINES):
+        self.rules = []
+        self.tail_lines = max(1, tail_lines)
+        # Each rule is checked as it will sit in the alternation: inline global flags, clashing
+        # group names or numbered backreferences (renumbered by the wrapping groups) break it there
+        for rule in rules:
+            name, _, pattern = rule
+            if _NUMBERED_BACKREF_RE.search(pattern):
+                log.warning(f"Ignoring prompt rule '{name}': numbered backreferences are not supported, "
+                            f"use (?P<name>...) and (?P=name)")
                 continue
-        if not texts:
             try:
-                t = uia_window.window_text()
-                if t:
-                    texts.append(t)
-            except Exception:
-                pass
-        return "\n".join(texts)
-    except Exception:
-        return ""
+                re.compile(self._alternation(self.rules + [rule]), self.FLAGS)
+            except re.error as e:
+                log.warning(f"Ignoring prompt rule '{name}': {e}")
+                continue
+            self.rules.append(rule)
+        self._regex = re.compile(self._alternation(self.rules) or r"(?!)", self.FLAGS)
 
-def send_keys_if_match():
-    global should_exit
-    start_time = time.time()
-    interval = RUN_EVERY
-    last_check = -interval
-    last_snapshot_hash = None
-    last_change_ts = time.time()
-    last_sent_ts = None
-    initial_sent = False
-    sent_during_current_stale = False
-    while not should_exit and not stop_event.is_set():
-        try:
-            # Check the command output every second
-            if stop_event.wait(1):  # Wait for 1 second or until stop_event is set
-                break
-            rounded_time = round(time.time() - start_time)
-            if rounded_time > last_check + interval:
-                window = find_target_window()
-                if window is None:
-                    print("No matching admin Command Prompt window found.")
-                    last_check = rounded_time
-                    continue
+    @staticmethod
+    def _alternation(rules) -> str:
+        return "|".join(f"(?P<r{i}>{pattern})" for i, (_, _, pattern) in enumerate(rules))
 
-                # Update staleness based on UIA snapshot
-                snapshot = _read_console_text_snapshot_by_handle(window.handle)
-                if snapshot:
-                    new_hash = hashlib.sha1(snapshot.encode("utf-8", errors="ignore")).hexdigest()
-                    if new_hash != last_snapshot_hash:
-                        last_snapshot_hash = new_hash
-                        last_change_ts = time.time()
-                        # Reset per-stale-cycle state on any change
-                        sent_during_current_stale = False
-                stale_secs = time.time() - last_change_ts
-
-                # Minimal behavior:
-                # 1) Send initial 'y' immediately once
-                if not initial_sent:
-                    if REEVALUATION_ENABLED and (random.random() < REEVALUATION_CHANCE):
-                        window.send_keystrokes(REEVALUATION_MESSAGE + "{ENTER}")
-                        print(f"{rounded_time}  sent re-eval (initial)")
-                    else:
-                        window.send_keystrokes("y{ENTER}")
-                        print(f"{rounded_time}  sent 'y' (initial)")
-                        last_sent_ts = time.time()
-                    initial_sent = True
-                    last_check = rounded_time
+    def tail(self, text: str) -> str:
+        # Only the end of the buffer is touched: slice a bounded window before stripping/splitting
+        window = text[-PROMPT_TAIL_WINDOW:].rstrip() or text.rstrip()
+        return "\n".join(window.rsplit("\n", self.tail_lines)[-self.tail_lines:])
+
+    def match(self, text: str, kinds=("confirm",)):
+        """Returns the name of the first rule of one of `kinds` matching the tail, or None."""
+        if not text:
+            return None
+        for m in self._regex.finditer(self.tail(text)):
+            name, kind, _ = self.rules[int(m.lastgroup[1:])]
+            if kind in kinds:
+                return name
+        return None
+
+
+def _load_prompt_rules(path: str):
+    """Reads 'name = regex' lines (optionally 'input:name = regex'); '#' lines are comments."""
+    rules = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
                     continue
+                name, pattern = (part.strip() for part in line.split("=", 1))
+                kind = "confirm"
+                if ":" in name:
+                    kind, name = (part.strip() for part in name.split(":", 1))
+                rules.append((name, kind, pattern))  # validated by PromptRules
+    except OSError as e:
+        log.error(f"Error reading prompt rules '{path}': {e}")
+    return rules
 
-                # 2) After STALE_SECONDS of no changes, send one 'y' then wait for change or next stale window
-                is_stale = stale_secs >= STALE_SECONDS
-                should_send = False
-                if PERSISTENT:
-                    should_send = True
-                else:
-                    if is_stale and not sent_during_current_stale:
-                        should_send = True
-
-                # 3) Minimum send guard: if set, send when elapsed >= MIN_SEND_SECONDS since last 'y'
-                if not should_send and MIN_SEND_SECONDS > 0:
-                    if last_sent_ts is None or (time.time() - last_sent_ts) >= MIN_SEND_SECONDS:
-                        should_send = True
-
-                if should_send:
-                    if REEVALUATION_ENABLED and (random.random() < REEVALUATION_CHANCE):
-                        window.send_keystrokes(REEVALUATION_MESSAGE + "{ENTER}")
-                        print(f"{rounded_time}  sent re-eval")
-                    else:
-                        window.send_keystrokes("y{ENTER}")
-                        if PERSISTENT:
-                            print(f"{rounded_time}  sent 'y' (persistent mode)")
-                        else:
-                            sent_during_current_stale = True
-                            print(f"{rounded_time}  sent 'y' (stale for ~{int(stale_secs)}s)")
-                        last_sent_ts = time.time()
-                else:
-                    reason = "active < stale threshold" if not PERSISTENT else "cond false"
-                    print(f"{rounded_time}  skipping send ({reason})")
-                last_check = rounded_time
-            time.sleep(1)
-        except Exception as e:
-            print(f"Error sending keys: {e}")
-            time.sleep(60)
 
-class DippingBirdGIF:
-    def __init__(self):
-        self.screen = None
-        self.frames = []
-        self.durations = []
-        self.current_frame = 0
-        self.frame_time = 0
-        self.clock = pygame.time.Clock()
+def build_prompt_rules(path: str = None) -> PromptRules:
+    path = PROMPT_RULES_FILE if path is None else path
+    rules = list(DEFAULT_PROMPT_RULES)
+    if path:
+        rules.extend(_load_prompt_rules(path))
+    return PromptRules(rules)
 
-    def setup(self):
-        self.screen = pygame.display.set_mode(WINDOW_SIZE)
-        pygame.display.set_caption("Dipping Bird")
 
-        if not os.path.exists(GIF_PATH):
-            print(f"Error: '{GIF_PATH}' not found.")
-            return False
+_prompt_rules = None
 
-        gif = Image.open(GIF_PATH)
-        self.durations = [frame.info['duration'] for frame in ImageSequence.Iterator(gif)]
-        self.frames = [pygame.image.fromstring(frame.convert("RGBA").tobytes(), frame.size, "RGBA") for frame in ImageSequence.Iterator(gif)]
-        return True
+def _match_prompt(text: str, kinds=("confirm",)):
+    global _prompt_rules
+    if _prompt_rules is None:
+        _prompt_rules = build_prompt_rules()
+    return _prompt_rules.match(text, kinds)
 
-    def update(self):
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                return False
+def _text_has_confirmation_prompt(haystack: str) -> bool:
+    return _match_prompt(haystack) is not None
 
-        self.screen.fill((255, 255, 255))
+def _read_uia_text(uia_window, tail_lines: int = None) -> str:
+    texts = []
+    # FindAll enumerates the whole subtree, so this is O(scrollback) even for a tail; only the
+    # window_text() calls are limited to the last tail_lines elements
+    ctrls = uia_window.descendants(control_type="Text")
+    if tail_lines is not None and tail_lines > 0:
+        ctrls = ctrls[-tail_lines:]
+    for ctrl in ctrls:
+        try:
+            t = ctrl.window_text()
+            if t:
+                texts.append(t)
+        except Exception:
+            continue
+    if not texts:
+        try:
+            t = uia_window.window_text()
+            if t:
+                texts.append(t)
+        except Exception:
+            pass
+    return "\n".join(texts)
 
-        frame = self.frames[self.current_frame]
-        duration = self.durations[self.current_frame]
+def _read_console_text_snapshot_by_handle(handle: int, tail_lines: int = None, backend=None) -> str:
+    # tail_lines limits the read to the last N lines; None reads the visible range (TextPattern) or everything
+    backend = backend or _backend
+    if TEXT_SOURCE != "descendants":
+        reader = backend.text_reader(handle)
+        if reader is not None:
+            try:
+                text = reader.read(tail_lines)
+                metrics.inc("text_pattern_reads")
+                return text
+            except Exception:
+                # Stale provider: drop it and let the next poll re-probe; walk descendants this time
+                backend.forget(handle)
+    metrics.inc("descendant_reads")
+    for attempt in range(2):
+        try:
+            uia_window = backend.connect_handle(handle, "uia")
+        except Exception:
+            return ""
+        try:
+            return _read_uia_text(uia_window, tail_lines)
+        except Exception:
+            # Most likely a stale pooled element (window recreated); reconnect once
+            backend.forget(handle)
+    return ""
 
-        frame_rect = frame.get_rect(center=(WINDOW_SIZE[0]//2, WINDOW_SIZE[1]//2))
-        self.screen.blit(frame, frame_rect)
+class Scrollback:
+    """Ring buffer of the last `max_lines` console lines, updated in place from each read.
 
-        pygame.display.flip()
+    merge() aligns a window snapshot (the console's last N lines) against the lines already held
+    and appends only what scrolled in; feed() appends a raw output stream. Staleness, prompt and
+    loop checks read tail() from here, so per-poll allocations and total memory stay bounded no
+    matter how long the session or how large the console's own scrollback.
+    """
 
-        self.frame_time += self.clock.tick(FRAME_RATE)
-        if self.frame_time > duration:
-            self.current_frame = (self.current_frame + 1) % len(self.frames)
-            self.frame_time = 0
+    redraw_rows = 3  # bottom rows a merge may find repainted in place rather than scrolled
 
-        return True
+    def __init__(self, max_lines: int = SCROLLBACK_LINES, max_line_chars: int = SCROLLBACK_LINE_CHARS):
+        self.lines = deque(maxlen=max(1, max_lines))
+        self.max_line_chars = max(1, max_line_chars)
+        self.partial = ""  # unterminated last line of a stream (feed only)
+        self.repainted = 0  # bottom rows the last merge rewrote in place
 
-def cleanup():
-    global should_exit
-    should_exit = True
-    stop_event.set()
-    pygame.quit()
-    print("Cleanup complete.")
+    def __len__(self):
+        return len(self.lines) + (1 if self.partial else 0)
 
-def main():
-    global should_exit
-    
-    # Set up signal handlers
-    signal.signal(signal.SIGINT, handle_sigint)
-    signal.signal(signal.SIGTERM, handle_sigint)
-    atexit.register(cleanup)
+    def _clip(self, line: str) -> str:
+        return line[-self.max_line_chars:] if len(line) > self.max_line_chars else line
 
-    # Initialize pygame in the main thread
+    def _overlap(self, new: list):
+        """(lines of `new` already held, trailing held lines repainted in place), None if nothing lines up."""
+        held = len(self.lines)
+        if not held or not new:
+            return 0, 0
+        prev = list(itertools.islice(self.lines, max(0, held - len(new) - self.redraw_rows), held))
+        first = new[0]
+        # Smallest scroll such that the held tail, shifted up, lines up with `new`. The last `skip` held
+        # rows may have been repainted instead of scrolled: a line still growing when it was read, or a
+        # TUI's status and input rows ("Working (12s)" over "> "). Only offsets whose line equals new[0]
+        # can match, which keeps this linear in practice.
+        for skip in range(min(self.redraw_rows, len(prev) - 1) + 1):
+            end = len(prev) - skip
+            for d in range(max(0, end - len(new)), end):
+                if prev[d] == first and new[:end - d] == prev[d:end]:
+                    return end - d, skip
+        return None
+
+    def merge(self, snapshot) -> int:
+        """Folds a read of the console's last lines in; returns how many lines scrolled in.
+
+        Rows repainted at the bottom are replaced, not counted; `repainted` says how many of the tail's
+        last lines they are. A read that lines up nowhere is taken as a redraw of the held tail: it
+        replaces those lines and counts as 0, so a repainting screen never reads as fresh output.
+        """
+        new = snapshot.split("\n") if isinstance(snapshot, str) else list(snapshot)
+        while new and not new[-1].strip():
+            new.pop()  # console padding below the cursor
+        # Anything older than the ring can hold would be dropped again straight away
+        new = [self._clip(line.rstrip()) for line in new[-self.lines.maxlen:]]
+        aligned = self._overlap(new)
+        if aligned is None:
+            for _ in range(min(len(self.lines), len(new))):
+                self.lines.pop()
+            self.lines.extend(new)
+            self.repainted = 0
+            return 0
+        overlap, skip = aligned
+        for _ in range(skip):
+            self.lines.pop()
+        self.lines.extend(new[overlap:])
+        appended = max(0, len(new) - overlap - skip)
+        self.repainted = len(new) - overlap - appended
+        return appended
+
+    def feed(self, text: str):
+        """Appends raw output that may end mid-line."""
+        parts = text.split("\n")
+        parts[0] = self.partial + parts[0]
+        self.partial = self._clip(parts.pop())
+        for line in parts:
+            self.lines.append(self._clip(line))
+
+    def tail(self, n: int = None) -> str:
+        """The last `n` lines (all of them if None) joined with newlines."""
+        count = len(self.lines) if n is None else max(0, n - (1 if self.partial else 0))
+        count = min(count, len(self.lines))
+        lines = list(itertools.islice(self.lines, len(self.lines) - count, None))
+        if self.partial:
+            lines.append(self.partial)
+        return "\n".join(lines)
+
+
+_cmd_scrollback = Scrollback()
+
+
+class SnapshotChangeDetector:
+    """Detects console changes by fingerprinting a bounded tail of each read.
+
+    Hashing and comparing cost the same regardless of scrollback. The read itself is bounded only
+    with the TextPattern source; the descendants walk still visits every Text element.
+
+    mode="full" keeps the old whole-buffer SHA1 for comparison.
+    """
+
+    def __init__(self, mode: str = SNAPSHOT_MODE, tail_lines: int = SNAPSHOT_TAIL_LINES, tail_chars: int = SNAPSHOT_TAIL_CHARS):
+        self.full = mode == "full"
+        self.tail_lines = None if self.full else tail_lines
+        self.tail_chars = tail_chars
+        self._last_fp = None
+        self._last_tail = None
+
+    def read(self, window, backend=None) -> str:
+        return (backend or _backend).read_text(window, tail_lines=self.tail_lines)
+
+    def update(self, snapshot: str) -> bool:
+        """Feed a new snapshot; returns True if it differs from the previous one."""
+        if self.full:
+            fp = hashlib.sha1(snapshot.encode("utf-8", errors="ignore")).hexdigest()
+            changed = fp != self._last_fp
+            self._last_fp = fp
+            return changed
+        tail = snapshot[-self.tail_chars:] if self.tail_chars > 0 else snapshot
+        fp = zlib.crc32(tail.encode("utf-8", errors="ignore"))
+        # CRC match is confirmed against the previous tail so a collision never hides a change
+        changed = fp != self._last_fp or tail != self._last_tail
+        self._last_fp = fp
+        self._last_tail = tail
+        return changed
+
+_LOOP_DIGITS_RE = re.compile(r"\d+")
+_LOOP_SPACE_RE = re.compile(r"\s+")
+
+
+class LoopDetector:
+    """Flags an agent whose new output keeps repeating output it already printed.
+
+    Each update gets the scrollback tail (LOOP_TAIL_LINES) and how many of its lines Scrollback.merge()
+    appended since the last one; those are normalized (numbers/whitespace folded, so counters and
+    timestamps don't hide a loop) and hashed into k-line shingles. The first snapshot only seeds the
+    history, so output already on the console at startup is never judged as a loop. Shingles live in a fixed-size ring with
+    counts, so memory and per-poll cost are constant however long the session runs.
+    """
+
+    def __init__(self, tail_lines: int = LOOP_TAIL_LINES, shingle_lines: int = LOOP_SHINGLE_LINES,
+                 history: int = LOOP_HISTORY, window: int = LOOP_WINDOW, min_shingles: int = LOOP_MIN_SHINGLES,
+                 threshold: float = LOOP_THRESHOLD, cooldown: float = LOOP_COOLDOWN_SECONDS):
+        self.tail_lines = tail_lines
+        self.k = max(1, shingle_lines)
+        self.min_shingles = min_shingles
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._ring = deque(maxlen=max(1, history))
+        self._counts = {}
+        self._chunks = deque(maxlen=max(1, window))  # (new shingles, already-seen shingles) per update
+        self._primed = False
+        self._last_flag = None
+        self.ratio = 0.0
+
+    @staticmethod
+    def _line_hash(line: str) -> int:
+        norm = _LOOP_SPACE_RE.sub(" ", _LOOP_DIGITS_RE.sub("0", line)).strip()
+        return zlib.crc32(norm.encode("utf-8", errors="ignore"))
+
+    def _remember(self, shingle: int):
+        if len(self._ring) == self._ring.maxlen:
+            old = self._ring[0]
+            n = self._counts[old] - 1
+            if n:
+                self._counts[old] = n
+            else:
+                del self._counts[old]
+        self._ring.append(shingle)
+        self._counts[shingle] = self._counts.get(shingle, 0) + 1
+
+    def update(self, snapshot: str, appended: int, now: float = None, repainted: int = 0) -> bool:
+        """Feed a changed snapshot whose last `appended` lines are new; True when they mostly repeat earlier output.
+
+        The last `repainted` lines (status and input rows redrawn in place) are left out altogether.
+        """
+        raw = snapshot.splitlines() if snapshot else []
+        raw = raw[:len(raw) - max(0, repainted)][-self.tail_lines:]
+        appended = min(max(0, appended), len(raw))
+        fresh = sum(1 for l in raw[len(raw) - appended:] if l.strip())
+        lines = tuple(h for h in map(self._line_hash, (l for l in raw if l.strip())))
+        primed, self._primed = self._primed, True
+        start = len(lines) - fresh if primed else 0
+        new = seen = 0
+        # Shingles ending in an appended line; the first ones borrow context from older lines
+        for i in range(max(start, self.k - 1), len(lines)):
+            shingle = hash(lines[i - self.k + 1:i + 1])
+            new += 1
+            if shingle in self._counts:
+                seen += 1
+            self._remember(shingle)
+        if not primed:
+            return False
+        if new:
+            self._chunks.append((new, seen))
+        total = sum(n for n, _ in self._chunks)
+        repeated = sum(r for _, r in self._chunks)
+        self.ratio = repeated / total if total else 0.0
+        if total < self.min_shingles or self.ratio < self.threshold:
+            return False
+        now = time.time() if now is None else now
+        if self._last_flag is not None and now - self._last_flag < self.cooldown:
+            return False
+        self._last_flag = now
+        # Judge the next stretch of output on its own
+        self._chunks.clear()
+        return True
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if "SC_CLK_TCK" in getattr(os, "sysconf_names", {}) else 100
+
+
+def _proc_children_linux(pid: int) -> list:
+    children = []
+    tids = os.listdir(f"/proc/{pid}/task")  # raises once the process is gone
+    try:
+        for tid in tids:
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children.extend(int(c) for c in f.read().split())
+        return children
+    except OSError:
+        children = []
+    # Kernels without task/*/children: fall back to scanning every process's parent
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                    children.append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+    return children
+
+
+def _proc_counters_linux(pid: int) -> tuple:
+    """(CPU seconds incl. reaped children, bytes read+written) from /proc/<pid>/stat and io."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime, stime, cutime, cstime are stat fields 14-17 (fields[0] here is field 3)
+    cpu = sum(int(v) for v in fields[11:15]) / _CLK_TCK
+    io = 0
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            for line in f:
+                if line.startswith(("rchar:", "wchar:")):
+                    io += int(line.split()[1])
+    except OSError:
+        pass  # io is owner/ptrace-only on some systems; CPU still works
+    return cpu, io
+
+
+def _proc_name_linux(pid: int) -> str:
+    with open(f"/proc/{pid}/comm") as f:
+        return f.read().strip()
+
+
+
+def _proc_tree_windows(pid: int) -> list:
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESSENTRY32W(ctypes.Structure):
+        _fields_ = [("dwSize", wintypes.DWORD), ("cntUsage", wintypes.DWORD), ("th32ProcessID", wintypes.DWORD),
+                    ("th32DefaultHeapID", ctypes.c_void_p), ("th32ModuleID", wintypes.DWORD),
+                    ("cntThreads", wintypes.DWORD), ("th32ParentProcessID", wintypes.DWORD),
+                    ("pcPriClassBase", ctypes.c_long), ("dwFlags", wintypes.DWORD),
+                    ("szExeFile", ctypes.c_wchar * 260)]
+
+    kernel32 = ctypes.windll.kernel32
+    kernel32.CreateToolhelp32Snapshot.restype = wintypes.HANDLE
+    snap = kernel32.CreateToolhelp32Snapshot(0x2, 0)  # TH32CS_SNAPPROCESS
+    if snap in (None, wintypes.HANDLE(-1).value):
+        raise OSError("CreateToolhelp32Snapshot failed")
+    parents = {}
+    try:
+        entry = PROCESSENTRY32W()
+        entry.dwSize = ctypes.sizeof(entry)
+        ok = kernel32.Process32FirstW(snap, ctypes.byref(entry))
+        while ok:
+            parents.setdefault(entry.th32ParentProcessID, []).append(entry.th32ProcessID)
+            ok = kernel32.Process32NextW(snap, ctypes.byref(entry))
+    finally:
+        kernel32.CloseHandle(snap)
+    tree, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        if p in tree:
+            continue  # pid reuse can make the parent map cyclic
+        tree.append(p)
+        todo.extend(c for c in parents.get(p, ()) if c != p)
+    return tree
+
+
+def _proc_counters_windows(pid: int) -> tuple:
+    import ctypes
+    from ctypes import wintypes
+    kernel32 = ctypes.windll.kernel32
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+    if not handle:
+        raise OSError(f"OpenProcess({pid}) failed")
+    try:
+        times = [wintypes.FILETIME() for _ in range(4)]
+        if not kernel32.GetProcessTimes(handle, *(ctypes.byref(t) for t in times)):
+            raise OSError(f"GetProcessTimes({pid}) failed")
+        cpu = sum((t.dwHighDateTime << 32 | t.dwLowDateTime) for t in times[2:]) / 1e7  # kernel + user, 100ns units
+        io_counters = (ctypes.c_ulonglong * 6)()
+        io = 0
+        if kernel32.GetProcessIoCounters(handle, ctypes.byref(io_counters)):
+            io = io_counters[3] + io_counters[4]  # ReadTransferCount + WriteTransferCount
+        return cpu, io
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def _proc_name_windows(pid: int) -> str:
+    import ctypes
+    from ctypes import wintypes
+    kernel32 = ctypes.windll.kernel32
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+    if not handle:
+        raise OSError(f"OpenProcess({pid}) failed")
+    try:
+        buf = ctypes.create_unicode_buffer(1024)
+        size = wintypes.DWORD(len(buf))
+        if not kernel32.QueryFullProcessImageNameW(handle, 0, buf, ctypes.byref(size)):
+            raise OSError(f"QueryFullProcessImageNameW({pid}) failed")
+        return os.path.basename(buf.value)
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+# Terminal hosts whose process tree holds every tab's shell, not just the target's
+_SHARED_CONSOLE_HOSTS = frozenset({"windowsterminal.exe", "conhost.exe", "openconsole.exe"})
+
+
+class ProcessActivityProbe:
+    """Tells whether a window's process tree is working, from CPU time, I/O and child processes.
+
+    A sample reads a few /proc files (Linux) or process counters (Windows) for the process and its
+    descendants, orders of magnitude cheaper than scraping console text. Between two samples the
+    tree is busy if it used ACTIVITY_CPU_PERCENT of a core, moved ACTIVITY_IO_BYTES, or started or
+    lost a child process. Any failure reads as "not busy", so callers fall back to the text check.
+
+    A window owned by a shared terminal host (Windows Terminal, conhost, OpenConsole) is never
+    probed: its tree spans every tab, so one busy agent would keep all of them "busy".
+    """
+
+    def __init__(self, pid: int, handle: int = None, cpu_percent: float = ACTIVITY_CPU_PERCENT,
+                 io_bytes: int = ACTIVITY_IO_BYTES, clock=time.monotonic):
+        self.pid = pid
+        self.handle = handle
+        self.cpu_fraction = max(0.0, cpu_percent) / 100.0
+        self.io_bytes = max(0, io_bytes)
+        self.clock = clock
+        self.failed = None
+        self._last = None  # (time, {pid: (cpu, io)})
+        if pid is None:
+            self.failed = "no process id"
+        elif sys.platform.startswith("linux"):
+            self._tree, self._counters, self._name = self._linux_tree, _proc_counters_linux, _proc_name_linux
+        elif os.name == "nt":
+            self._tree, self._counters, self._name = _proc_tree_windows, _proc_counters_windows, _proc_name_windows
+        else:
+            self.failed = f"no process probe for {sys.platform}"
+        if self.failed is None:
+            try:
+                name = self._name(pid)
+            except OSError:
+                name = ""  # busy() reports a process that can't be read
+            if name.lower() in _SHARED_CONSOLE_HOSTS:
+                self.failed = f"window belongs to {name}, which hosts other consoles too"
+
+    def _linux_tree(self, pid: int) -> list:
+        tree, todo = [], [pid]
+        while todo:
+            p = todo.pop()
+            tree.append(p)
+            try:
+                todo.extend(_proc_children_linux(p))
+            except OSError:
+                continue  # exited between listing and reading
+        return tree
+
+    def sample(self) -> dict:
+        counters = {}
+        for p in self._tree(self.pid):
+            try:
+                counters[p] = self._counters(p)
+            except OSError:
+                if p == self.pid:
+                    raise
+        return counters
+
+    def busy(self) -> bool:
+        if self.failed is not None:
+            return False
+        try:
+            now, counters = self.clock(), self.sample()
+        except Exception as e:
+            self.failed = str(e)
+            return False
+        last, self._last = self._last, (now, counters)
+        if last is None:
+            return False
+        then, before = last
+        if set(counters) != set(before):
+            return True  # a child started or exited: a tool call, build, test run...
+        cpu = sum(c for c, _ in counters.values()) - sum(c for c, _ in before.values())
+        io = sum(i for _, i in counters.values()) - sum(i for _, i in before.values())
+        elapsed = max(now - then, 1e-6)
+        return cpu >= self.cpu_fraction * elapsed or io >= max(1, self.io_bytes)
+
+
+# Upper bounds (seconds) shared by every latency histogram; fixed so memory never grows
+HISTOGRAM_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (cumulative counts are derived at export time)."""
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Bucket upper bound containing the q-th observation (an upper estimate)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Per-stage timing histograms and counters for the hot path, exported as JSONL and Prometheus text."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.started = time.time()
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = Histogram()
+            hist.observe(seconds)
+
+    def inc(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stages = {
+                name: {
+                    "count": h.count,
+                    "sum_s": round(h.sum, 6),
+                    "p50_s": h.quantile(0.5),
+                    "p99_s": h.quantile(0.99),
+                    "buckets": list(h.counts),
+                }
+                for name, h in self.histograms.items()
+            }
+            return {"ts": time.time(), "uptime_s": round(time.time() - self.started, 3),
+                    "counters": dict(self.counters), "stages": stages}
+
+    def prometheus(self) -> str:
+        lines = [
+            "# HELP dippingbird_stage_seconds Time spent in each polling stage.",
+            "# TYPE dippingbird_stage_seconds histogram",
+        ]
+        with self._lock:
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(h.buckets + (float("inf"),), h.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'dippingbird_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'dippingbird_stage_seconds_sum{{stage="{name}"}} {h.sum}')
+                lines.append(f'dippingbird_stage_seconds_count{{stage="{name}"}} {h.count}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE dippingbird_{name}_total counter")
+                lines.append(f"dippingbird_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def _metrics_jsonl_loop(path: str, interval: int):
+    while not stop_event.wait(max(1, interval)):
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(metrics.snapshot()) + "\n")
+        except OSError as e:
+            log.error(f"Error writing metrics to '{path}': {e}")
+
+
+def start_metrics_exporters():
+    """Starts the JSONL dump and/or the local Prometheus endpoint if configured."""
+    if METRICS_JSONL:
+        threading.Thread(target=_metrics_jsonl_loop, args=(METRICS_JSONL, METRICS_INTERVAL),
+                         name="dippingbird-metrics-jsonl", daemon=True).start()
+    if METRICS_PORT:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class _MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # keep scrapes out of the console
+
+        try:
+            server = ThreadingHTTPServer(("127.0.0.1", METRICS_PORT), _MetricsHandler)
+        except OSError as e:
+            log.error(f"Error starting metrics endpoint on port {METRICS_PORT}: {e}")
+            return
+        threading.Thread(target=server.serve_forever, name="dippingbird-metrics-http", daemon=True).start()
+        log.info(f"Metrics at http://127.0.0.1:{METRICS_PORT}/metrics")
+
+
+log = logging.getLogger("dippingbird")
+
+
+class _JsonFormatter(logging.Formatter):
+    FIELDS = ("event", "reason", "latency_ms")
+
+    def format(self, record):
+        entry = {"ts": round(record.created, 3), "level": record.levelname.lower(), "thread": record.threadName,
+                 "msg": record.getMessage().strip()}
+        for key in self.FIELDS:
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread; a full queue drops (and counts) the record instead of waiting."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Exception:
+            metrics.inc("log_dropped")
+
+
+class _LogListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Only called on shutdown; wait for room rather than failing on a full queue
+        self.queue.put(self._sentinel, timeout=5)
+
+
+_log_listener = None
+
+
+def start_logging(file_suffix: str = ""):
+    """Routes the 'dippingbird' logger through a bounded queue to a background writer.
+
+    Callers only format and enqueue; console, rotating file (text or JSON lines) writes all
+    happen on the listener thread, so a slow terminal or disk never stalls a tick.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return
+    import queue
+    level = logging.getLevelName(LOG_LEVEL)
+    if not isinstance(level, int):
+        print(f"Unknown LOG_LEVEL '{LOG_LEVEL}'; using INFO.")
+        level = logging.INFO
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    handlers = [console]
+    if LOG_FILE:
+        try:
+            handler = logging.handlers.RotatingFileHandler(LOG_FILE + file_suffix, maxBytes=max(0, LOG_MAX_BYTES),
+                                                           backupCount=max(0, LOG_BACKUPS), encoding="utf-8")
+            handler.setFormatter(_JsonFormatter() if LOG_JSON else
+                                 logging.Formatter("%(asctime)s %(levelname)s [%(threadName)s] %(message)s"))
+            handlers.append(handler)
+        except OSError as e:
+            print(f"Error opening log file '{LOG_FILE + file_suffix}': {e}")
+    q = queue.Queue(maxsize=max(1, LOG_QUEUE_SIZE))
+    log.handlers[:] = [_DroppingQueueHandler(q)]
+    log.setLevel(level)
+    log.propagate = False
+    _log_listener = _LogListener(q, *handlers)
+    _log_listener.start()
+
+
+def stop_logging():
+    """Drains queued records, then logs synchronously (for the last messages of a shutdown)."""
+    global _log_listener
+    listener, _log_listener = _log_listener, None
+    if listener is None:
+        return
+    try:
+        listener.stop()
+    except Exception:
+        pass
+    log.handlers[:] = list(listener.handlers)
+
+
+class StalenessState:
+    """Send policy for one console: initial 'y', one 'y' per stale cycle, PERSISTENT and MIN_SEND guards.
+
+    Fed either by snapshot polling or by pushed change/prompt notifications.
+    """
+
+    def __init__(self, stale_seconds: int = None, persistent: bool = None, min_send_seconds: int = None,
+                 clock=time.time):
+        self.stale_seconds = STALE_SECONDS if stale_seconds is None else stale_seconds
+        self.persistent = PERSISTENT if persistent is None else persistent
+        self.min_send_seconds = MIN_SEND_SECONDS if min_send_seconds is None else min_send_seconds
+        # Injectable so replay can drive the same policy from a virtual clock
+        self.clock = clock
+        self.last_change_ts = clock()
+        self.last_sent_ts = None
+        self.initial_sent = False
+        self.sent_during_current_stale = False
+        self.prompt_pending = False
+        self.prompt_rule = None
+        self.loop_pending = False
+
+    def text_changed(self, ts: float = None):
+        self.last_change_ts = self.clock() if ts is None else ts
+        # Reset per-stale-cycle state on any change
+        self.sent_during_current_stale = False
+        self.prompt_pending = False
+
+    def prompt_appeared(self, rule: str = None):
+        self.prompt_pending = True
+        self.prompt_rule = rule
+
+    def loop_detected(self):
+        self.loop_pending = True
+
+    def stale_for(self, now: float) -> float:
+        return now - self.last_change_ts
+
+    def decide(self, now: float):
+        """Returns the reason to send now ("initial", "loop", "persistent", "stale", "prompt", "min-send") or None."""
+        # 1) Send initial 'y' immediately once
+        if not self.initial_sent:
+            return "initial"
+        # A detected output loop is answered with the re-evaluation message, busy or not
+        if self.loop_pending:
+            return "loop"
+        # 2) After stale_seconds of no changes (or a detected prompt), send one 'y' then wait for change
+        if self.persistent:
+            return "persistent"
+        if not self.sent_during_current_stale:
+            if self.stale_for(now) >= self.stale_seconds:
+                return "stale"
+            if self.prompt_pending:
+                return "prompt"
+        # 3) Minimum send guard: if set, send when elapsed >= min_send_seconds since last 'y'
+        if self.min_send_seconds > 0:
+            if self.last_sent_ts is None or (now - self.last_sent_ts) >= self.min_send_seconds:
+                return "min-send"
+        return None
+
+    def send_failed(self, reason: str):
+        """Re-arms the policy after a queued send for `reason` could not be delivered."""
+        if reason == "initial":
+            self.initial_sent = False
+        elif reason == "loop":
+            self.loop_pending = True
+        elif reason in ("stale", "prompt"):
+            self.sent_during_current_stale = False
+            if reason == "prompt":
+                self.prompt_pending = True  # record_send cleared it; the prompt is still unanswered
+
+    def record_send(self, reason: str, now: float, reeval: bool = False):
+        if reason == "loop":
+            self.loop_pending = False
+            return
+        if reason == "initial":
+            self.initial_sent = True
+            if not reeval:
+                self.last_sent_ts = now
+            return
+        if reeval:
+            return
+        if not self.persistent:
+            self.sent_during_current_stale = True
+            self.prompt_pending = False
+        self.last_sent_ts = now
+
+    def seconds_until_due(self, now: float):
+        """Seconds until decide() could next return a reason without new input; None if never."""
+        if not self.initial_sent or self.persistent or self.loop_pending:
+            return 0.0
+        deadlines = []
+        if not self.sent_during_current_stale:
+            deadlines.append(self.last_change_ts + self.stale_seconds)
+        if self.min_send_seconds > 0 and self.last_sent_ts is not None:
+            deadlines.append(self.last_sent_ts + self.min_send_seconds)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - now)
+
+
+class TokenBucket:
+    """Allows `rate_per_minute` operations on average with bursts of up to `burst`."""
+
+    def __init__(self, rate_per_minute: float, burst: int = SEND_BURST, clock=time.monotonic):
+        self.rate = max(rate_per_minute, 0.001) / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float = None) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        now = self.clock() if now is None else now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float = None):
+        now = self.clock() if now is None else now
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _SendItem:
+    __slots__ = ("key", "window", "keys", "on_done", "queued_at", "attempts", "not_before",
+                 "timeouts", "timer", "hung", "abandoned")
+
+    def __init__(self, key, window, keys: str, on_done):
+        self.key = key
+        self.window = window
+        self.keys = keys
+        self.on_done = on_done
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+        self.not_before = 0.0
+        self.timeouts = 0
+        self.timer = None
+        self.hung = False  # given up and set aside, no longer counted against `workers`
+        self.abandoned = False  # on_done already reported failure
+
+    def report(self, ok: bool):
+        latency = time.monotonic() - self.queued_at
+        metrics.observe("send_latency", latency)
+        if self.on_done is not None:
+            self.on_done(ok, latency)
+
+
+class SendQueue:
+    """Delivers keystrokes off the polling path.
+
+    A bounded queue is drained by one scheduler thread. Per-target and global token buckets apply,
+    one send per target is in flight at a time, and an identical pending send to the same target
+    is coalesced. Each send_keystrokes call runs on a small executor, so a hung window costs one
+    executor thread, not the pollers. Calls that raise are retried SEND_RETRIES times; a call still
+    running after SEND_TIMEOUT_SECONDS never is, since that could deliver the keys twice. It is
+    waited for through SEND_RETRIES more timeouts, then given up: on_done reports the failure and the
+    target is wedged, its sends dropped until the hung call returns. Up to `hung_limit` given-up
+    calls are set aside on spare threads so `workers` calls can still run for the other targets.
+    on_done(ok, latency) reports each outcome, timed from enqueue.
+    """
+
+    def __init__(self, size: int = SEND_QUEUE_SIZE, per_target_rate: float = SEND_RATE_PER_MINUTE,
+                 global_rate: float = SEND_GLOBAL_RATE_PER_MINUTE, timeout: float = SEND_TIMEOUT_SECONDS,
+                 retries: int = SEND_RETRIES, workers: int = 4, hung_limit: int = 4):
+        self.size = size
+        self.per_target_rate = per_target_rate
+        self.timeout = timeout
+        self.retries = retries
+        self.workers = max(1, workers)
+        self.hung_limit = max(0, hung_limit)
+        self.global_bucket = TokenBucket(global_rate, SEND_GLOBAL_BURST)
+        self._buckets = {}
+        self._pending = deque()
+        self._in_flight = set()
+        self._wedged = set()
+        self._running = 0
+        self._hung = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=self.workers + self.hung_limit,
+                                            thread_name_prefix="dippingbird-send")
+        self._thread = threading.Thread(target=self._run, name="dippingbird-send-queue", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, window, keys: str, on_done=None) -> bool:
+        """Queues a send (or folds it into an identical pending one); False if it was dropped."""
+        with self._cond:
+            if self._closed:
+                return False
+            if key in self._wedged:
+                metrics.inc("sends_wedged")
+                return False
+            for item in self._pending:
+                if item.key == key and item.keys == keys and item.attempts == 0:
+                    metrics.inc("sends_coalesced")
+                    return True
+            if len(self._pending) >= self.size:
+                metrics.inc("sends_dropped")
+                return False
+            self._pending.append(_SendItem(key, window, keys, on_done))
+            self._cond.notify()
+            return True
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"pending": len(self._pending), "in_flight": len(self._in_flight), "wedged": len(self._wedged)}
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify()
+        self._executor.shutdown(wait=False)
+
+    def _next_ready(self, now: float):
+        """Pops the first sendable item; otherwise returns (None, seconds until one might be)."""
+        wait = None
+        global_wait = self.global_bucket.wait_time(now)
+        for item in self._pending:
+            if item.key in self._in_flight:
+                continue
+            bucket = self._buckets.get(item.key)
+            if bucket is None:
+                bucket = self._buckets[item.key] = TokenBucket(self.per_target_rate)
+            delay = max(global_wait, bucket.wait_time(now), item.not_before - now)
+            if delay <= 0:
+                self._pending.remove(item)
+                bucket.take(now)
+                self.global_bucket.take(now)
+                return item, 0.0
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    # Woken again when a call returns or is set aside
+                    item, wait = (self._next_ready(time.monotonic()) if self._running < self.workers
+                                  else (None, None))
+                    if item is not None:
+                        self._in_flight.add(item.key)
+                        self._running += 1
+                        break
+                    self._cond.wait(wait)
+            self._deliver(item)
+
+    def _give_up(self, item: _SendItem):
+        """Reports a hung call as failed and wedges its target until the call returns."""
+        with self._cond:
+            item.abandoned = True
+            self._wedged.add(item.key)
+            if self._hung < self.hung_limit:
+                item.hung = True
+                self._hung += 1
+                self._running -= 1
+            dropped = [p for p in self._pending if p.key == item.key]
+            for p in dropped:
+                self._pending.remove(p)
+            self._cond.notify()
+        metrics.inc("sends_given_up")
+        log.warning(f"send_keystrokes hung for {self.timeout * item.timeouts}s; "
+                    f"giving up and dropping sends to that window until it returns")
+        for p in [item] + dropped:
+            p.report(False)
+
+    def _deliver(self, item: _SendItem):
+        def finish(ok: bool, retry: bool):
+            with self._cond:
+                self._in_flight.discard(item.key)
+                self._wedged.discard(item.key)
+                if item.hung:
+                    self._hung -= 1
+                else:
+                    self._running -= 1
+                retry = retry and not item.abandoned and not self._closed
+                if retry:
+                    item.not_before = time.monotonic() + min(30.0, 2.0 ** item.attempts)
+                    self._pending.appendleft(item)
+                self._cond.notify()
+            if not retry and not item.abandoned:
+                item.report(ok)
+
+        def call():
+            with metrics.span("send_keystrokes"):
+                item.window.send_keystrokes(item.keys)
+
+        def arm():
+            item.timer = threading.Timer(self.timeout, slow)
+            item.timer.daemon = True
+            item.timer.start()
+
+        def slow():
+            if future.done():
+                return
+            metrics.inc("send_timeouts")
+            item.timeouts += 1
+            if item.timeouts > self.retries:
+                self._give_up(item)
+                return
+            log.warning(f"send_keystrokes still running after {self.timeout * item.timeouts}s; "
+                        f"waiting for it before the next send")
+            arm()
+
+        def done(fut):
+            item.timer.cancel()
+            failed = fut.exception() is not None
+            if failed:
+                metrics.inc("send_failures")
+            finish(not failed, failed and item.attempts <= self.retries)
+
+        item.attempts += 1
+        item.timeouts = 0
+        try:
+            future = self._executor.submit(call)
+        except RuntimeError:
+            finish(False, False)  # executor shut down
+            return
+        arm()
+        future.add_done_callback(done)
+
+
+_send_queue = None
+_send_queue_lock = threading.Lock()
+
+
+def _get_send_queue() -> SendQueue:
+    global _send_queue
+    with _send_queue_lock:
+        if _send_queue is None:
+            _send_queue = SendQueue()
+        return _send_queue
+
+
+def _deliver(window, state: StalenessState, keys: str, message: str, reason: str, on_failed=None):
+    """Sends inline or through the send queue; message is logged once the keystrokes went out.
+
+    The caller has already recorded the send; False (or an exception from an inline send) means
+    it was undone through state.send_failed().
+    """
+    if not SEND_QUEUE:
+        try:
+            with metrics.span("send_keystrokes"):
+                window.send_keystrokes(keys)
+        except Exception:
+            state.send_failed(reason)
+            raise
+        log.info(message, extra={"event": "send", "reason": reason})
+        return True
+
+    def on_done(ok: bool, latency: float):
+        if ok:
+            log.info(f"{message} [{latency * 1000:.0f} ms]",
+                     extra={"event": "send", "reason": reason, "latency_ms": round(latency * 1000, 1)})
+            return
+        log.warning(f"{message.split('  ', 1)[0]}  send failed after retries; will try again",
+                    extra={"event": "send_failed", "reason": reason})
+        state.send_failed(reason)
+        if on_failed is not None:
+            on_failed()
+
+    if not _get_send_queue().submit(id(state), window, keys, on_done):
+        # Dropped (queue full, window hung or closing): undo record_send so the policy sends again next poll
+        log.warning(f"{message.split('  ', 1)[0]}  send not queued (queue full or window not responding); will try again",
+                    extra={"event": "send_failed", "reason": reason})
+        state.send_failed(reason)
+        return False
+    return True
+
+
+def _send_for_state(window, state: StalenessState, rounded_time: int, label: str = "", on_failed=None):
+    """Sends if the policy says so; returns (reason, reeval) for a send, None when skipped.
+
+    With SEND_QUEUE the send is queued and counted as made; a send that finally fails is undone
+    through state.send_failed() so the policy fires it again.
+    """
+    now = state.clock()
+    reason = state.decide(now)
+    prefix = f"{rounded_time}  {label}" if label else f"{rounded_time}  "
+    if reason is None:
+        status = "active < stale threshold" if not state.persistent else "cond false"
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"{prefix}skipping send ({status})", extra={"event": "skip"})
+        return None
+    reeval = reason == "loop"
+    if reason == "stale":
+        metrics.inc("stale_cycles")
+    # Recorded up front: a queued send can fail (and call send_failed) before _deliver returns
+    state.record_send(reason, now, reeval)
+    if reeval:
+        metrics.inc("reevals")
+        delivered = _deliver(window, state, REEVALUATION_MESSAGE + "{ENTER}",
+                             f"{prefix}sent re-eval (output is repeating itself)", reason, on_failed)
+    else:
+        metrics.inc("sends")
+        if reason == "initial":
+            message = f"{prefix}sent 'y' (initial)"
+        elif reason == "persistent":
+            message = f"{prefix}sent 'y' (persistent mode)"
+        elif reason == "prompt":
+            message = f"{prefix}sent 'y' (prompt detected: {state.prompt_rule or 'pushed'})"
+        else:
+            message = f"{prefix}sent 'y' (stale for ~{int(state.stale_for(now))}s)"
+        delivered = _deliver(window, state, "y{ENTER}", message, reason, on_failed)
+    return (reason, reeval) if delivered else None
+
+
+class SessionRecorder:
+    """Appends a compact JSONL stream of console changes (with a short tail) and sends for offline replay."""
+
+    def __init__(self, path: str, tail_chars: int = RECORD_TAIL_CHARS):
+        self.path = path
+        self.tail_chars = tail_chars
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        self._write({"k": "start", "t": time.time(), "stale": STALE_SECONDS, "persistent": PERSISTENT,
+                     "min_send": MIN_SEND_SECONDS, "interval": RUN_EVERY})
+
+    def _write(self, record: dict):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._file.flush()
+
+    def change(self, target: str, ts: float, snapshot: str = None):
+        record = {"k": "c", "t": round(ts, 3), "id": target}
+        if snapshot:
+            record["tail"] = snapshot[-self.tail_chars:]
+        self._write(record)
+
+    def send(self, target: str, ts: float, reason: str, reeval: bool):
+        self._write({"k": "s", "t": round(ts, 3), "id": target, "reason": reason, "reeval": reeval})
+
+    def close(self):
+        self._write({"k": "end", "t": time.time()})
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_recorder = None
+
+
+class AnalyticsStore:
+    """Appends target events to a SQLite file from a background writer, in batched transactions.
+
+    event() only enqueues (never blocks; drops and counts if the writer falls far behind), so the
+    polling loop pays no disk I/O.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS events (session TEXT, target TEXT, ts REAL, kind TEXT, reason TEXT, detail TEXT)",
+        "CREATE INDEX IF NOT EXISTS events_target_ts ON events (target, ts)",
+    )
+
+    def __init__(self, path: str, flush_seconds: float = ANALYTICS_FLUSH_SECONDS, max_pending: int = 10000):
+        import queue
+        self.path = path
+        self.flush_seconds = max(0.1, flush_seconds)
+        self.session = f"{int(time.time())}-{os.getpid()}"
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._full = queue.Full
+        self._ready = threading.Event()
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name="dippingbird-analytics", daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+        if self.error is not None:
+            raise self.error
+
+    def event(self, target: str, kind: str, ts: float = None, reason: str = None, detail: str = None):
+        try:
+            self._queue.put_nowait((self.session, target, time.time() if ts is None else ts, kind, reason, detail))
+        except self._full:
+            metrics.inc("analytics_dropped")
+
+    def _run(self):
+        import sqlite3
+        try:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")  # fleet workers share the file
+            for stmt in self.SCHEMA:
+                conn.execute(stmt)
+            conn.commit()
+        except Exception as e:
+            self.error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        import queue
+        stop = False
+        while not stop:
+            batch = []
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < 1000:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    with metrics.span("analytics_flush"):
+                        with conn:
+                            conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?)", batch)
+                except Exception as e:
+                    metrics.inc("analytics_errors")
+                    log.error(f"Error writing analytics to '{self.path}': {e}")
+        conn.close()
+
+    def close(self):
+        try:
+            self._queue.put(None, timeout=1)
+        except self._full:
+            pass
+        self._thread.join(timeout=5)
+
+
+_analytics = None
+
+
+def _percentile(values, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def analytics_report(path: str, since_hours: float = None, active_gap: float = ANALYTICS_ACTIVE_GAP) -> list:
+    """Per (session, target): idle-to-send latency percentiles, answers per hour, stalls and duty cycle.
+
+    Idle-to-send is the quiet time between the agent's last output and each 'y' (initial sends
+    excluded). Duty cycle is the share of the session with output changing, counting each gap
+    between changes up to `active_gap` seconds as activity.
+    """
+    import sqlite3
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    query = "SELECT session, target, ts, kind, reason FROM events"
+    params = ()
+    if since_hours:
+        query += " WHERE ts >= ?"
+        params = (time.time() - since_hours * 3600,)
+    rows = conn.execute(query + " ORDER BY session, target, ts", params).fetchall()
+    conn.close()
+    report = []
+    for (session, target), group in itertools.groupby(rows, key=lambda r: (r[0], r[1])):
+        group = list(group)
+        start, end = group[0][2], group[-1][2]
+        last_change = None
+        prev_change = None
+        idle_to_send, busy = [], 0.0
+        counts = {"change": 0, "send": 0, "reeval": 0, "stale": 0, "error": 0}
+        for _, _, ts, kind, reason in group:
+            if kind == "change":
+                if prev_change is not None:
+                    busy += min(ts - prev_change, active_gap)
+                prev_change = last_change = ts
+            elif kind == "send":
+                if reason == "loop":
+                    counts["reeval"] += 1
+                    continue
+                if reason != "initial" and last_change is not None:
+                    idle_to_send.append(ts - last_change)
+            counts[kind] = counts.get(kind, 0) + 1
+        span = max(end - start, 1e-9)
+        hours = span / 3600
+        report.append({
+            "session": session,
+            "target": target,
+            "hours": round(hours, 2),
+            "sends": counts["send"],
+            "sends_per_hour": round(counts["send"] / hours, 1) if hours else None,
+            "stalls": counts["stale"],
+            "stalls_per_hour": round(counts["stale"] / hours, 1) if hours else None,
+            "errors": counts["error"],
+            "reevals": counts["reeval"],
+            "idle_to_send_p50": _percentile(idle_to_send, 0.5),
+            "idle_to_send_p90": _percentile(idle_to_send, 0.9),
+            "idle_to_send_p99": _percentile(idle_to_send, 0.99),
+            "duty_cycle": round(busy / span, 3),
+        })
+    return report
+
+
+def _stats_cli(args):
+    """--stats=FILE [--since=HOURS] [--json]: prints analytics_report() for an ANALYTICS_DB file."""
+    path = ANALYTICS_DB
+    since = None
+    for arg in args:
+        if arg.startswith("--stats="):
+            path = arg.split("=", 1)[1]
+        elif arg.startswith("--since="):
+            try:
+                since = float(arg.split("=", 1)[1])
+            except ValueError:
+                print(f"Ignoring bad option {arg}")
+    if not path or not os.path.exists(path):
+        print(f"No analytics database at '{path}'. Record one with ANALYTICS_DB=... or --analytics=FILE.")
+        return 1
+    report = analytics_report(path, since)
+    if "--json" in args:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    def fmt(v):
+        return "-" if v is None else f"{v:.1f}"
+
+    print(f"{'session':18s} {'target':10s} {'hours':>6s} {'sends':>6s} {'/hour':>6s} {'stalls':>6s} "
+          f"{'errors':>6s} {'idle p50':>8s} {'p90':>7s} {'p99':>7s} {'duty':>6s}")
+    for r in report:
+        print(f"{r['session'][:18]:18s} {r['target'][:10]:10s} {r['hours']:6.2f} {r['sends']:6d} "
+              f"{fmt(r['sends_per_hour']):>6s} {r['stalls']:6d} {r['errors']:6d} {fmt(r['idle_to_send_p50']):>8s} "
+              f"{fmt(r['idle_to_send_p90']):>7s} {fmt(r['idle_to_send_p99']):>7s} {r['duty_cycle']:6.1%}")
+    return 0
+
+
+class VirtualClock:
+    """Stand-in for time.time() during replay; the replay loop moves `now` forward."""
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def load_session(path: str) -> dict:
+    """Reads a RECORD_FILE into {target id: {"changes": [...], "tails": {t: text}, "start": t, "end": t, "sends": [...]}}."""
+    sessions = {}
+    start = end = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            t = rec.get("t")
+            if t is None:
+                continue
+            start = t if start is None else min(start, t)
+            end = t if end is None else max(end, t)
+            if rec.get("k") in ("c", "s"):
+                sess = sessions.setdefault(rec.get("id", ""), {"changes": [], "tails": {}, "sends": []})
+                sess["changes" if rec["k"] == "c" else "sends"].append(t)
+                if rec["k"] == "c" and rec.get("tail"):
+                    sess["tails"][t] = rec["tail"]
+    for sess in sessions.values():
+        sess["start"], sess["end"] = start, end
+    return sessions
+
+
+def replay_session(changes, start: float, end: float, stale_seconds: int, persistent: bool,
+                   min_send_seconds: int, interval: int, seed: int = 0,
+                   waste_seconds: int = REPLAY_WASTE_SECONDS, tails: dict = None, reeval: bool = False) -> dict:
+    """Drives StalenessState over recorded change times with a virtual clock and the live PollScheduler.
+
+    With `reeval`, recorded tails are fed to a LoopDetector so loop nudges are replayed too.
+
+    Returns the sends that would have fired, how many were wasted (no output within waste_seconds
+    afterwards) and how long the agent sat idle before the first send of each quiet gap.
+    """
+    clock = VirtualClock(start)
+    state = StalenessState(stale_seconds, persistent, min_send_seconds, clock=clock)
+    rng = random.Random(seed)
+    schedule = PollScheduler(max(1, interval), rng=rng)
+    loop = LoopDetector() if reeval and tails else None
+    scrollback = Scrollback(LOOP_TAIL_LINES)
+    changes = sorted(changes)
+    sends = []
+    polls = 0
+    i = 0
+    t = start
+    while t <= end:
+        clock.now = t
+        polls += 1
+        changed = False
+        while i < len(changes) and changes[i] <= t:
+            state.text_changed(changes[i])
+            tail = tails.get(changes[i]) if loop is not None else None
+            if tail:
+                # Recorded tails are cut by characters, so the first line may be partial
+                appended = scrollback.merge(tail.split("\n", 1)[-1])
+                if loop.update(scrollback.tail(), appended, now=changes[i], repainted=scrollback.repainted):
+                    state.loop_detected()
+            changed = True
+            i += 1
+        reason = state.decide(t)
+        if reason is not None:
+            sends.append({"t": round(t - start, 3), "reason": reason, "reeval": reason == "loop"})
+            state.record_send(reason, t, reason == "loop")
+        t += schedule.after_tick(changed, state, t)
+
+    send_times = [start + s["t"] for s in sends]
+    wasted = 0
+    for st in send_times:
+        j = bisect.bisect_right(changes, st)
+        if j >= len(changes) or changes[j] - st > waste_seconds:
+            wasted += 1
+    # Idle: for every quiet gap between changes, time until the first send inside it (or the whole gap)
+    idle = 0.0
+    bounds = changes + [end]
+    for a, b in zip(bounds, bounds[1:]):
+        k = bisect.bisect_right(send_times, a)
+        first_send = send_times[k] if k < len(send_times) and send_times[k] < b else b
+        idle += first_send - a
+    return {"sends": sends, "send_count": len(sends), "wasted": wasted, "idle_s": round(idle, 1),
+            "polls": polls, "duration_s": round(end - start, 1)}
+
+
+def run_replay(path: str, grid: dict, reeval: bool = REEVALUATION_ENABLED):
+    """Replays a recorded session under every combination of the parameter lists in `grid`."""
+    sessions = load_session(path)
+    if not sessions:
+        print(f"No recorded changes in '{path}'.")
+        return []
+    keys = ["stale", "min_send", "persistent", "interval"]
+    results = []
+    for values in itertools.product(*(grid[k] for k in keys)):
+        params = dict(zip(keys, values))
+        for target_id, sess in sorted(sessions.items()):
+            res = replay_session(sess["changes"], sess["start"], sess["end"], params["stale"],
+                                 params["persistent"], params["min_send"] * 60, params["interval"],
+                                 tails=sess["tails"], reeval=reeval)
+            res.update(params, target=target_id, recorded_sends=len(sess["sends"]))
+            results.append(res)
+    print(f"{'target':14s} {'stale':>5s} {'min':>4s} {'pers':>4s} {'int':>3s} {'polls':>6s} {'sends':>6s} {'wasted':>6s} {'idle_s':>9s}  first sends (s)")
+    for r in results:
+        first = ", ".join(f"{s['t']:.0f}{'*' if s['reeval'] else ''}" for s in r["sends"][:8])
+        more = " ..." if len(r["sends"]) > 8 else ""
+        print(f"{r['target'][:14]:14s} {r['stale']:5d} {r['min_send']:4d} {str(r['persistent'])[0]:>4s} "
+              f"{r['interval']:3d} {r['polls']:6d} {r['send_count']:6d} {r['wasted']:6d} {r['idle_s']:9.1f}  {first}{more}")
+    return results
+
+
+def _replay_cli(args):
+    """--replay=FILE [--stale=15,30,60] [--min-send=0,5] [--interval=3] [--persistent[=false,true]] [--reeval] [--out=FILE]"""
+    def int_list(val):
+        return [int(v) for v in val.split(",") if v.strip()]
+
+    grid = {"stale": [STALE_SECONDS], "min_send": [MIN_SEND_MINUTES], "persistent": [PERSISTENT], "interval": [RUN_EVERY]}
+    path = out = None
+    reeval = REEVALUATION_ENABLED
+    for arg in args:
+        try:
+            if arg.startswith("--replay="):
+                path = arg.split("=", 1)[1]
+            elif arg.startswith("--stale="):
+                grid["stale"] = int_list(arg.split("=", 1)[1])
+            elif arg.startswith("--min-send="):
+                grid["min_send"] = int_list(arg.split("=", 1)[1])
+            elif arg.startswith("--interval="):
+                grid["interval"] = int_list(arg.split("=", 1)[1])
+            elif arg == "--persistent":
+                grid["persistent"] = [True]
+            elif arg.startswith("--persistent="):
+                grid["persistent"] = [v.strip().lower() in {"1", "true", "yes", "y", "on"} for v in arg.split("=", 1)[1].split(",")]
+            elif arg == "--reeval":
+                reeval = True
+            elif arg.startswith("--out="):
+                out = arg.split("=", 1)[1]
+        except ValueError:
+            print(f"Ignoring bad replay option {arg}")
+    results = run_replay(path, grid, reeval)
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+class ChangeNotifier:
+    """Collects "text changed" / "prompt appeared" pushes from an event-capable backend for the watch loop."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._changed_at = None
+        self._prompt = None
+        self._woken = False
+
+    def text_changed(self, ts: float = None):
+        with self._cond:
+            self._changed_at = time.time() if ts is None else ts
+            self._cond.notify_all()
+
+    def prompt_appeared(self, rule: str = None):
+        with self._cond:
+            self._prompt = rule or "pushed"
+            self._cond.notify_all()
+
+    def wake(self):
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def wait(self, timeout: float = None):
+        """Blocks until a notification, wake() or timeout; returns (changed_at, prompt rule), each possibly None."""
+        with self._cond:
+            if self._changed_at is None and self._prompt is None and not self._woken:
+                self._cond.wait(timeout)
+            changed_at, prompt = self._changed_at, self._prompt
+            self._changed_at, self._prompt, self._woken = None, None, False
+            return changed_at, prompt
+
+
+_active_notifiers = set()  # woken by cleanup() so event waits end promptly
+
+
+class PollScheduler:
+    """Picks the delay before a target's next poll.
+
+    Output changing: poll at the base interval. Quiet: double the delay each unchanged tick
+    (up to POLL_MAX_SECONDS) but never sleep past the policy's next deadline, so a stall is
+    answered on time. Errors/missing window: exponential backoff with jitter up to
+    POLL_ERROR_MAX_SECONDS. With POLL_ADAPTIVE off it behaves like the fixed RUN_EVERY loop.
+    """
+
+    def __init__(self, interval: float, max_interval: float = None, error_max: float = None,
+                 adaptive: bool = None, rng=None):
+        self.interval = max(0.1, interval)
+        self.max_interval = max(self.interval, POLL_MAX_SECONDS if max_interval is None else max_interval)
+        self.error_max = max(self.interval, POLL_ERROR_MAX_SECONDS if error_max is None else error_max)
+        self.adaptive = POLL_ADAPTIVE if adaptive is None else adaptive
+        self.rng = rng or random
+        self.quiet_ticks = 0
+        self.errors = 0
+
+    def after_tick(self, changed: bool, state: "StalenessState", now: float) -> float:
+        self.errors = 0
+        if not self.adaptive:
+            return self.interval
+        self.quiet_ticks = 0 if changed else self.quiet_ticks + 1
+        delay = min(self.max_interval, self.interval * (2 ** min(self.quiet_ticks, 16)))
+        due = state.seconds_until_due(now)
+        if due is not None:
+            # A zero deadline means "send every tick" (persistent / initial): keep the base rate
+            delay = min(delay, due) if due > 0 else self.interval
+        return max(0.05, delay)
+
+    def after_error(self) -> float:
+        self.errors += 1
+        self.quiet_ticks = 0
+        if not self.adaptive:
+            return self.interval  # the fixed loop re-checked a missing window every RUN_EVERY
+        cap = min(self.error_max, self.interval * (2 ** min(self.errors, 16)))
+        # Jitter so several targets failing together don't retry in lockstep
+        return cap * self.rng.uniform(0.5, 1.0)
+
+
+class Target:
+    """One watched console: how to find it, its own thresholds, and its staleness/snapshot state."""
+
+    def __init__(self, handle: int = None, stale_seconds: int = None, persistent: bool = None,
+                 min_send_seconds: int = None, interval: int = None, label: str = "", backend=None):
+        self.handle = handle
+        self.label = label
+        self.backend = backend or _backend
+        self.interval = RUN_EVERY if interval is None else interval
+        self.state = StalenessState(stale_seconds, persistent, min_send_seconds)
+        self.detector = SnapshotChangeDetector()
+        self.scrollback = Scrollback()
+        self.loop = LoopDetector() if REEVALUATION_ENABLED else None
+        self.probe = None
+        # The default target follows SELECTED_HANDLE / TARGET_HANDLE / title heuristics
+        if handle is None and backend is None:
+            self.resolver = _resolver
+        else:
+            self.resolver = TargetResolver(self.backend, handles=(handle,) if handle is not None else None)
+        self.schedule = PollScheduler(self.interval)
+        self.started_at = time.time()
+        self.next_due = 0.0
+        # Paused targets keep tracking changes but never send
+        self.paused = False
+        self.errors = 0
+        self.sends = 0
+
+    def configure(self, stale_seconds: int = None, persistent: bool = None, min_send_seconds: int = None,
+                  interval: int = None):
+        """Changes thresholds in place; the staleness state (last change, sends so far) is kept."""
+        if stale_seconds is not None:
+            self.state.stale_seconds = stale_seconds
+        if persistent is not None:
+            self.state.persistent = persistent
+        if min_send_seconds is not None:
+            self.state.min_send_seconds = min_send_seconds
+        if interval is not None:
+            self.interval = interval
+            self.schedule = PollScheduler(interval)
+            self.next_due = 0.0
+
+    def status(self) -> dict:
+        now = time.time()
+        return {
+            "id": self.record_id,
+            "paused": self.paused,
+            "stale_seconds": self.state.stale_seconds,
+            "persistent": self.state.persistent,
+            "min_send_seconds": self.state.min_send_seconds,
+            "interval": self.interval,
+            "stale_for": round(self.state.stale_for(now), 1),
+            "last_sent_ago": None if self.state.last_sent_ts is None else round(now - self.state.last_sent_ts, 1),
+            "next_poll_in": round(max(0.0, self.next_due - now), 1),
+            "resolver": self.resolver.stats(),
+        }
+
+    def find_window(self):
+        with metrics.span("find_target_window"):
+            return self.resolver.resolve()
+
+    def read_snapshot(self, window):
+        """Reads the window and merges it into self.scrollback; returns the lines appended, None if unreadable."""
+        with metrics.span("snapshot_read"):
+            snapshot = self.detector.read(window, self.backend)
+        if not snapshot:
+            return None
+        return self.scrollback.merge(snapshot)
+
+    def tick(self):
+        """One poll: resolve the window, refresh staleness from its snapshot, send if due.
+
+        Returns "missing", "changed" or "idle" for the poll scheduler.
+        """
+        metrics.inc("ticks")
+        with metrics.span("tick"):
+            rounded_time = round(time.time() - self.started_at)
+            window = self.find_window()
+            if window is None:
+                metrics.inc("window_missing")
+                if self.handle is None:
+                    log.warning("No matching admin Command Prompt window found.")
+                else:
+                    log.warning(f"{rounded_time}  {self.label}window {hex(self.handle)} not found.")
+                return "missing"
+            # A busy process tree counts as output without scraping; text is only read once it looks idle
+            changed = False
+            appended = None
+            if self.process_busy(window):
+                metrics.inc("activity_busy")
+                self.state.text_changed()
+                self.note_change(self.state.last_change_ts)
+                changed = True
+            else:
+                # Update staleness based on UIA snapshot, folded into the bounded scrollback
+                appended = self.read_snapshot(window)
+            if appended is not None:
+                text = self.scrollback.tail(self.detector.tail_lines)
+                with metrics.span("snapshot_hash"):
+                    changed = self.detector.update(text)
+                if changed:
+                    self.state.text_changed()
+                    self.check_loop(text, appended)
+                    self.note_change(self.state.last_change_ts, text)
+            if not self.paused:
+                self.record_send(_send_for_state(window, self.state, rounded_time, self.label,
+                                                 on_failed=self.resolver.invalidate))
+            return "changed" if changed else "idle"
+
+    def process_busy(self, window) -> bool:
+        if not ACTIVITY_PROBE:
+            return False
+        if self.probe is None or self.probe.handle != window.handle:
+            try:
+                pid = window.process_id()
+            except Exception:
+                pid = None
+            self.probe = ProcessActivityProbe(pid, handle=window.handle)
+            if self.probe.failed is not None:
+                log.warning(f"{self.label}Process activity probe unavailable ({self.probe.failed}); reading text every poll.")
+        if self.probe.failed is not None:
+            return False
+        with metrics.span("activity_probe"):
+            busy = self.probe.busy()
+        if self.probe.failed is not None:
+            log.warning(f"{self.label}Process activity probe unavailable ({self.probe.failed}); reading text every poll.")
+        return busy
+
+    def check_loop(self, snapshot: str, appended: int):
+        if self.loop is None:
+            return
+        with metrics.span("loop_detect"):
+            looping = self.loop.update(snapshot, appended, repainted=self.scrollback.repainted)
+        if looping:
+            metrics.inc("loops_detected")
+            log.info(f"{self.label}Output is repeating ({self.loop.ratio:.0%} of recent lines seen before).")
+            self.state.loop_detected()
+
+    @property
+    def record_id(self) -> str:
+        return hex(self.handle) if self.handle is not None else "default"
+
+    def note_change(self, ts: float, snapshot: str = None):
+        if _recorder is not None:
+            _recorder.change(self.record_id, ts, snapshot)
+        if _analytics is not None:
+            _analytics.event(self.record_id, "change", ts)
+
+    def note_error(self, detail: str):
+        self.errors += 1
+        if _analytics is not None:
+            _analytics.event(self.record_id, "error", detail=detail)
+
+    def record_send(self, sent):
+        if sent is None:
+            return
+        self.sends += 1
+        reason, reeval = sent
+        now = self.state.clock()
+        if _recorder is not None:
+            _recorder.send(self.record_id, now, reason, reeval)
+        if _analytics is not None:
+            if reason == "stale":
+                _analytics.event(self.record_id, "stale", now)
+            _analytics.event(self.record_id, "send", now, reason=reason)
+
+
+def _parse_target_line(line: str):
+    """Parses a --targets file line: '<handle> [--stale=N] [--interval=N] [--min-send=M] [--persistent]'."""
+    parts = shlex.split(line, comments=True)
+    if not parts:
+        return None
+    handle = _parse_handle(parts[0])
+    if handle is None:
+        log.warning(f"Ignoring target line with bad handle: {line.strip()}")
+        return None
+    return handle, _parse_target_options(parts[1:], hex(handle))
+
+
+def _parse_target_options(args, label: str) -> dict:
+    """Per-target overrides shared by --targets files and the daemon's attach/set commands."""
+    opts = {}
+    for arg in args:
+        try:
+            if arg == "--persistent":
+                opts["persistent"] = True
+            elif arg.startswith("--persistent="):
+                opts["persistent"] = arg.split("=", 1)[1].strip().lower() in {"1", "true", "yes", "y", "on"}
+            elif arg.startswith("--stale="):
+                opts["stale_seconds"] = int(arg.split("=", 1)[1])
+            elif arg.startswith("--interval="):
+                opts["interval"] = int(arg.split("=", 1)[1])
+            elif arg.startswith("--min-send="):
+                opts["min_send_seconds"] = max(0, int(arg.split("=", 1)[1]) * 60)
+        except ValueError:
+            log.warning(f"Ignoring bad option {arg} for target {label}")
+    return opts
+
+
+def _spawn_pty_target():
+    global _pty_backend
+    if _pty_backend is None:
+        _pty_backend = PtyBackend()
+    session = _pty_backend.spawn(PTY_COMMAND, echo=PTY_ECHO)
+    log.info(f"Started '{' '.join(PTY_COMMAND)}' under a pty (pid={session.handle}).")
+
+    def on_exit(sess):
+        try:
+            code = sess.proc.wait(timeout=1)
+        except Exception:
+            code = None
+        log.info(f"\nAgent process exited (code={code}); stopping.")
+        stop_event.set()
+
+    session.on_exit = on_exit
+    return Target(session.handle, backend=_pty_backend)
+
+
+def _target_specs() -> list:
+    """(handle, per-target options) for every explicitly configured target."""
+    specs = []
+    if TARGETS_FILE:
+        try:
+            with open(TARGETS_FILE, encoding="utf-8") as f:
+                for line in f:
+                    spec = _parse_target_line(line)
+                    if spec is not None:
+                        specs.append(spec)
+        except OSError as e:
+            log.error(f"Error reading targets file '{TARGETS_FILE}': {e}")
+    # With a targets file, no default target is built, so a lone --handle= has to join the list too
+    if TARGETS_FILE or len(TARGET_HANDLES) > 1:
+        specs.extend((h, {}) for h in TARGET_HANDLES)
+    unique, seen = [], set()
+    for spec in specs:
+        if spec[0] not in seen:  # the first entry for a handle wins
+            seen.add(spec[0])
+            unique.append(spec)
+    return unique
+
+
+def _build_targets():
+    if PTY_COMMAND:
+        return [_spawn_pty_target()]
+    specs = _target_specs()
+    if not specs:
+        return [Target()]
+    return [Target(handle, label=f"[{hex(handle)}] ", **opts) for handle, opts in specs]
+
+
+class TargetSupervisor:
+    """Services many targets from one process: each is ticked on its own interval by a thread pool."""
+
+    def __init__(self, targets, workers: int = SUPERVISOR_WORKERS, elastic: bool = False, on_tick=None):
+        self.targets = list(targets)
+        self.on_tick = on_tick  # called with the target after every tick, e.g. to publish fleet status
+        # Elastic supervisors (daemon) keep the full pool since targets can be attached later
+        self.workers = max(1, workers if elastic else min(workers, len(self.targets)))
+        self.lock = threading.Lock()
+
+    def add(self, target: Target):
+        with self.lock:
+            self.targets.append(target)
+
+    def remove(self, target: Target):
+        with self.lock:
+            self.targets.remove(target)
+
+    def find(self, target_id: str):
+        """Targets matching a daemon command's id: a handle, "default" or "all"."""
+        with self.lock:
+            targets = list(self.targets)
+        if target_id in (None, "all"):
+            return targets
+        handle = _parse_handle(target_id)
+        return [t for t in targets if t.record_id == target_id or (handle is not None and t.handle == handle)]
+
+    def _run_tick(self, target: Target):
+        try:
+            outcome = target.tick()
+            now = time.time()
+            if outcome == "missing":
+                target.note_error("window not found")
+                target.next_due = now + target.schedule.after_error()
+            else:
+                target.next_due = now + target.schedule.after_tick(outcome == "changed", target.state, now)
+        except Exception as e:
+            metrics.inc("errors")
+            target.note_error(str(e))
+            log.error(f"{target.label}Error sending keys: {e}")
+            # The cached window may be what broke; rescan on the next tick
+            target.resolver.invalidate()
+            target.next_due = time.time() + target.schedule.after_error()
+        if self.on_tick is not None:
+            self.on_tick(target)
+
+    def run(self):
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="dippingbird-target") as pool:
+            while not should_exit and not stop_event.is_set():
+                now = time.time()
+                waiting = []
+                with self.lock:
+                    targets = list(self.targets)
+                for target in targets:
+                    fut = in_flight.get(id(target))
+                    if fut is not None and not fut.done():
+                        continue
+                    if target.next_due <= now:
+                        in_flight[id(target)] = pool.submit(self._run_tick, target)
+                    else:
+                        waiting.append(target.next_due)
+                # Sleep until the next target is due; in-flight ticks are re-checked at least every second
+                wait_for = min(waiting) - now if waiting else 1.0
+                if stop_event.wait(min(max(wait_for, 0.05), 1.0)):
+                    break
+
+
+class ControlServer:
+    """Daemon control socket on 127.0.0.1: one command line in, one JSON line out.
+
+    The port and a random token are written to CONTROL_FILE (readable only by this user);
+    requests must start with the token, so other local users can't drive the daemon.
+    """
+
+    def __init__(self, supervisor: TargetSupervisor, port: int = CONTROL_PORT, control_file: str = CONTROL_FILE):
+        self.supervisor = supervisor
+        self.port = port
+        self.control_file = control_file
+        self.token = os.urandom(16).hex()
+        self.server = None
+
+    def start(self) -> bool:
+        import socketserver
+        control = self
+
+        class _Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline(65536).decode("utf-8", "replace").strip()
+                token, _, command = line.partition(" ")
+                if token != control.token:
+                    reply = {"ok": False, "error": "bad token"}
+                else:
+                    try:
+                        reply = control.execute(shlex.split(command))
+                    except Exception as e:
+                        reply = {"ok": False, "error": str(e)}
+                self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+        class _Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        try:
+            self.server = _Server(("127.0.0.1", self.port), _Handler)
+        except OSError as e:
+            log.error(f"Error starting control socket on port {self.port}: {e}")
+            return False
+        self.port = self.server.server_address[1]
+        try:
+            fd = os.open(self.control_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"port": self.port, "token": self.token, "pid": os.getpid()}, f)
+        except OSError as e:
+            log.error(f"Error writing control file '{self.control_file}': {e}")
+            self.server.server_close()
+            return False
+        threading.Thread(target=self.server.serve_forever, name="dippingbird-control", daemon=True).start()
+        log.info(f"Control socket on 127.0.0.1:{self.port} (python dippingbird.py --ctl status)")
+        return True
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            try:
+                os.remove(self.control_file)
+            except OSError:
+                pass
+
+    def execute(self, words) -> dict:
+        if not words:
+            return {"ok": False, "error": "empty command"}
+        cmd, args = words[0].lower(), words[1:]
+        sup = self.supervisor
+        if cmd == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if cmd == "status":
+            return {"ok": True, "targets": [t.status() for t in sup.find("all")],
+                    "pool": _backend.pool.stats(), "metrics": metrics.snapshot()["counters"],
+                    "send_queue": _send_queue.stats() if _send_queue is not None else None}
+        if cmd == "list":
+            return {"ok": True, "windows": [
+                {"handle": hex(h), "class": cls, "title": title, "backend": b}
+                for h, cls, title, b in _gather_candidate_windows()
+            ]}
+        if cmd == "attach":
+            if not args:
+                return {"ok": False, "error": "usage: attach <handle> [--stale=N] [--interval=N] [--min-send=M] [--persistent]"}
+            handle = _parse_handle(args[0])
+            if handle is None:
+                return {"ok": False, "error": f"bad handle {args[0]}"}
+            if sup.find(args[0]):
+                return {"ok": False, "error": f"{hex(handle)} is already attached"}
+            target = Target(handle, label=f"[{hex(handle)}] ", **_parse_target_options(args[1:], hex(handle)))
+            sup.add(target)
+            log.info(f"Attached {target.record_id}.")
+            return {"ok": True, "target": target.status()}
+        if cmd in ("detach", "set", "pause", "resume"):
+            target_id = args[0] if args and not args[0].startswith("--") else "all"
+            if cmd == "detach" and not args:
+                return {"ok": False, "error": "usage: detach <handle|default|all>"}
+            targets = sup.find(target_id)
+            if not targets:
+                return {"ok": False, "error": f"no target {target_id}"}
+            for target in targets:
+                if cmd == "detach":
+                    sup.remove(target)
+                elif cmd == "set":
+                    target.configure(**_parse_target_options([a for a in args if a.startswith("--")], target.record_id))
+                else:
+                    target.paused = cmd == "pause"
+            log.info(f"{cmd.capitalize()}: {', '.join(t.record_id for t in targets)}")
+            return {"ok": True, "targets": [t.status() for t in targets]}
+        if cmd in ("shutdown", "stop"):
+            stop_event.set()
+            return {"ok": True}
+        return {"ok": False, "error": f"unknown command {cmd}"}
+
+
+_control_server = None
+
+
+def _control_client(words, control_file: str = CONTROL_FILE) -> int:
+    """--ctl <command...>: sends one command to a running daemon and prints the JSON reply."""
+    import socket
+    try:
+        with open(control_file, encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        print(f"No running daemon found (missing '{control_file}'). Start one with --daemon.")
+        return 1
+    line = info["token"] + " " + " ".join(shlex.quote(w) for w in words) + "\n"
+    try:
+        with socket.create_connection(("127.0.0.1", info["port"]), timeout=10) as sock:
+            sock.sendall(line.encode("utf-8"))
+            data = sock.makefile("rb").readline()
+    except OSError as e:
+        print(f"Error talking to daemon on port {info['port']}: {e}")
+        return 1
+    reply = json.loads(data or b'{"ok": false, "error": "no reply"}')
+    print(json.dumps(reply, indent=2))
+    return 0 if reply.get("ok") else 1
+
+
+class FleetStatusTable:
+    """Fixed-size per-target status rows in shared memory, written by fleet workers and read by the parent.
+
+    Each row is guarded by a sequence number (odd while being written), so readers never see a
+    torn row and never block a writer.
+    """
+
+    ROW = struct.Struct("<IIQdddIII")  # seq, worker, handle, last_change, last_send, updated, stale_s, errors, sends
+
+    def __init__(self, slots: int, name: str = None):
+        from multiprocessing import shared_memory
+        self.slots = slots
+        size = max(1, slots) * self.ROW.size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            # Workers are spawned, so they share the parent's resource tracker and only the owner unlinks
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+
+    def write(self, slot: int, worker: int, handle: int, last_change: float, last_send: float,
+              stale_seconds: int, errors: int, sends: int):
+        buf = self.shm.buf
+        offset = slot * self.ROW.size
+        # Odd while the payload is written (a worker killed mid-write leaves it odd); even only once it's all there
+        seq = struct.unpack_from("<I", buf, offset)[0] | 1
+        struct.pack_into("<I", buf, offset, seq)
+        self.ROW.pack_into(buf, offset, seq, worker, handle, last_change, last_send or 0.0,
+                           time.time(), max(0, stale_seconds), min(errors, 0xFFFFFFFF), min(sends, 0xFFFFFFFF))
+        struct.pack_into("<I", buf, offset, (seq + 1) & 0xFFFFFFFF)
+
+    def read(self, slot: int) -> dict:
+        offset = slot * self.ROW.size
+        for _ in range(100):
+            row = self.ROW.unpack_from(self.shm.buf, offset)
+            if row[0] % 2 == 0 and struct.unpack_from("<I", self.shm.buf, offset)[0] == row[0]:
+                break
+            time.sleep(0)
+        _, worker, handle, last_change, last_send, updated, stale_seconds, errors, sends = row
+        return {"worker": worker, "handle": handle, "last_change": last_change, "last_send": last_send or None,
+                "updated": updated, "stale_seconds": stale_seconds, "errors": errors, "sends": sends}
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _fleet_worker(index: int, shard, argv, table_name: str, slots: int, shutdown):
+    """Worker process entry point: runs a TargetSupervisor over one shard of (slot, handle, opts).
+
+    The parent stops workers by setting `shutdown` (a multiprocessing.Event); terminate() is only its
+    fallback, and on Windows that is TerminateProcess, which runs no cleanup at all.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent owns Ctrl+C and stops us
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    _apply_cli_overrides(argv)
+    start_logging(f".w{index}")  # one rotating file per worker; rotation isn't safe across processes
+    _open_analytics()
+    table = FleetStatusTable(slots, name=table_name)
+    targets, slot_of = [], {}
+    for slot, handle, opts in shard:
+        target = Target(handle, label=f"[w{index} {hex(handle)}] ", **opts)
+        targets.append(target)
+        slot_of[id(target)] = slot
+
+    def publish(target: Target):
+        table.write(slot_of[id(target)], index, target.handle, target.state.last_change_ts,
+                    target.state.last_sent_ts, target.state.stale_seconds, target.errors, target.sends)
+
+    for target in targets:
+        publish(target)
+
+    def watch_parent():
+        import multiprocessing
+        parent = multiprocessing.parent_process()
+        # Wind down (flushing queued analytics and log records) when asked to, or when the parent is gone
+        while not shutdown.wait(1):
+            if stop_event.is_set():
+                return
+            if parent is not None and not parent.is_alive():
+                break
+        stop_event.set()
+
+    threading.Thread(target=watch_parent, name="dippingbird-fleet-parent", daemon=True).start()
+    try:
+        TargetSupervisor(targets, on_tick=publish).run()
+    finally:
+        if _analytics is not None:
+            _analytics.close()
+        table.close()
+        stop_logging()
+
+
+class FleetSupervisor:
+    """Shards targets across worker processes and restarts any worker that dies or stops updating its rows."""
+
+    def __init__(self, specs, workers: int = FLEET_WORKERS, argv=None, hang_seconds: float = FLEET_HANG_SECONDS):
+        import multiprocessing
+        self.ctx = multiprocessing.get_context("spawn")
+        self.workers = max(1, min(workers, len(specs)))
+        self.argv = list(argv or [])
+        self.hang_seconds = hang_seconds
+        self.table = FleetStatusTable(len(specs))
+        self.shutdown = self.ctx.Event()
+        self.shards = [[] for _ in range(self.workers)]
+        for slot, (handle, opts) in enumerate(specs):
+            self.shards[slot % self.workers].append((slot, handle, opts))
+        # A healthy worker publishes each row at least once per tick of its slowest target
+        self.hang_limits = [max(hang_seconds, 2 * self._longest_delay(shard)) for shard in self.shards]
+        self.procs = [None] * self.workers
+        self.started = [0.0] * self.workers
+        self.restarts = 0
+
+    def _start(self, index: int):
+        proc = self.ctx.Process(target=_fleet_worker, name=f"dippingbird-fleet-{index}", daemon=True,
+                                args=(index, self.shards[index], self.argv, self.table.name, self.table.slots,
+                                      self.shutdown))
+        proc.start()
+        self.procs[index] = proc
+        self.started[index] = time.time()
+
+    @staticmethod
+    def _longest_delay(shard) -> float:
+        """Longest gap PollScheduler can leave between two ticks of any target in the shard."""
+        interval = max((RUN_EVERY if opts.get("interval") is None else opts["interval"]) for _, _, opts in shard)
+        return max(interval, POLL_MAX_SECONDS, POLL_ERROR_MAX_SECONDS)
+
+    def _hung(self, index: int, now: float) -> bool:
+        limit = self.hang_limits[index]
+        if now - self.started[index] < limit:
+            return False  # still starting up (spawn + first ticks)
+        oldest = min(self.table.read(slot)["updated"] for slot, _, _ in self.shards[index])
+        return now - oldest > limit
+
+    def status(self) -> list:
+        return [self.table.read(slot) for slot in range(self.table.slots)]
+
+    def print_status(self):
+        now = time.time()
+        lines = [f"fleet: {self.workers} workers, {self.table.slots} targets, {self.restarts} restarts"]
+        for row in self.status():
+            last_send = f"{now - row['last_send']:.0f}s ago" if row["last_send"] else "never"
+            lines.append(f"  w{row['worker']} {hex(row['handle'])}  quiet {now - row['last_change']:.0f}s "
+                  f"(stale at {row['stale_seconds']}s)  last send {last_send}  sends={row['sends']} "
+                         f"errors={row['errors']}  updated {now - row['updated']:.0f}s ago")
+        log.info("\n".join(lines))
+
+    def run(self):
+        for index in range(self.workers):
+            self._start(index)
+        log.info(f"Fleet mode: {self.table.slots} targets across {self.workers} worker processes.")
+        next_status = time.time() + FLEET_STATUS_SECONDS
+        try:
+            while not should_exit and not stop_event.wait(1):
+                now = time.time()
+                for index, proc in enumerate(self.procs):
+                    if not proc.is_alive():
+                        log.warning(f"Fleet worker {index} exited (code={proc.exitcode}); restarting.")
+                    elif self._hung(index, now):
+                        log.warning(f"Fleet worker {index} stopped updating for {self.hang_limits[index]:.0f}s; restarting.")
+                        proc.kill()
+                        proc.join(timeout=5)
+                    else:
+                        continue
+                    self.restarts += 1
+                    metrics.inc("fleet_restarts")
+                    self._start(index)
+                if FLEET_STATUS_SECONDS > 0 and now >= next_status:
+                    self.print_status()
+                    next_status = now + FLEET_STATUS_SECONDS
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = FORCE_EXIT_DELAY):
+        """Asks every worker to finish its tick and flush, then terminates any still running after `timeout`."""
+        self.shutdown.set()
+        deadline = time.time() + timeout
+        for proc in self.procs:
+            if proc is not None:
+                proc.join(timeout=max(0.1, deadline - time.time()))
+        for index, proc in enumerate(self.procs):
+            if proc is not None and proc.is_alive():
+                log.warning(f"Fleet worker {index} didn't stop within {timeout}s; terminating it.")
+                proc.terminate()
+                proc.join(timeout=FORCE_EXIT_DELAY)
+        self.table.close()
+
+
+def _log_pool_stats():
+    stats = _backend.pool.stats()
+    if stats["hits"] or stats["misses"]:
+        log.info(f"connection pool: {stats['hit_rate']:.0%} hits ({stats['hits']}/{stats['hits'] + stats['misses']}), "
+              f"{stats['size']} open, {stats['evictions']} evicted")
+
+
+def _pool_stats_loop(interval: int):
+    while not stop_event.wait(interval):
+        _log_pool_stats()
+
+
+def _open_analytics():
+    global _analytics
+    if ANALYTICS_DB and _analytics is None:
+        try:
+            _analytics = AnalyticsStore(ANALYTICS_DB)
+        except Exception as e:
+            log.error(f"Error opening analytics database '{ANALYTICS_DB}': {e}")
+
+
+def send_keys_if_match():
+    global _recorder, _control_server
+    if RECORD_FILE and _recorder is None:
+        try:
+            _recorder = SessionRecorder(RECORD_FILE)
+            log.info(f"Recording session to '{RECORD_FILE}'.")
+        except OSError as e:
+            log.error(f"Error opening record file '{RECORD_FILE}': {e}")
+    if not FLEET_WORKERS:
+        # Fleet workers open their own writer to the shared file
+        _open_analytics()
+    if CONN_POOL and CONN_POOL_LOG_SECONDS > 0:
+        threading.Thread(target=_pool_stats_loop, args=(CONN_POOL_LOG_SECONDS,),
+                         name="dippingbird-pool-stats", daemon=True).start()
+    if FLEET_WORKERS > 0 and not PTY_COMMAND:
+        specs = _target_specs() or [(h, {}) for h in TARGET_HANDLES]
+        if specs:
+            FleetSupervisor(specs, FLEET_WORKERS, argv=sys.argv[1:]).run()
+            return
+        log.warning("Fleet mode needs explicit targets (--handle=... or --targets=...); running in-process.")
+    targets = _build_targets()
+    if len(targets) > 1:
+        log.info(f"Watching {len(targets)} targets.")
+    if DAEMON:
+        if WATCH_MODE == "events":
+            log.warning("Daemon mode polls targets; --events is ignored.")
+        supervisor = TargetSupervisor(targets, elastic=True)
+        _control_server = ControlServer(supervisor)
+        if _control_server.start():
+            supervisor.run()
+        else:
+            stop_event.set()
+        return
+    if WATCH_MODE != "events":
+        TargetSupervisor(targets).run()
+        return
+    # Event mode: one watcher thread per target; targets without events are polled instead
+    def watch(target):
+        if not _watch_events(target):
+            log.info(f"{target.label}Change events unavailable for this window; falling back to polling.")
+            TargetSupervisor([target]).run()
+
+    threads = [threading.Thread(target=watch, args=(t,), daemon=True) for t in targets]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def _watch_events(target: Target) -> bool:
+    """Event-driven loop: sleeps until a change/prompt notification or the next stale deadline.
+
+    Returns False if the backend cannot deliver events, so the caller can fall back to polling.
+    """
+    state = target.state
+    notifier = ChangeNotifier()
+    _active_notifiers.add(notifier)
+    subscribed_handle = None
+    unsubscribe = None
+    prompt_check_at = None
+    try:
+        while not should_exit and not stop_event.is_set():
+            try:
+                window = target.find_window()
+                if window is None:
+                    log.warning("No matching admin Command Prompt window found.")
+                    notifier.wait(target.schedule.after_error())
+                    continue
+                if window.handle != subscribed_handle:
+                    if unsubscribe is not None:
+                        unsubscribe()
+                    unsubscribe = target.backend.subscribe_text_changes(window, notifier.text_changed)
+                    if unsubscribe is None:
+                        return False
+                    subscribed_handle = window.handle
+                    state.text_changed()
+                target.schedule.errors = 0
+
+                now = time.time()
+                if prompt_check_at is not None and now >= prompt_check_at:
+                    prompt_check_at = None
+                    appended = target.read_snapshot(window)
+                    if appended is not None:
+                        target.check_loop(target.scrollback.tail(LOOP_TAIL_LINES), appended)
+                    rule = _match_prompt(target.scrollback.tail(PROMPT_TAIL_LINES))
+                    if rule is not None:
+                        state.prompt_appeared(rule)
+                if not target.paused and state.decide(now) is not None:
+                    target.record_send(_send_for_state(window, state, round(now - target.started_at), target.label,
+                                                       on_failed=target.resolver.invalidate))
+
+                # Capped so a closed window (which sends no more events) is still noticed and re-resolved
+                timeout = state.seconds_until_due(time.time())
+                cap = max(1, POLL_MAX_SECONDS)
+                timeout = cap if timeout is None else min(timeout, cap)
+                if prompt_check_at is not None:
+                    timeout = min(timeout, max(0.0, prompt_check_at - time.time()))
+                changed_at, prompt = notifier.wait(timeout)
+                if changed_at is not None:
+                    metrics.inc("change_events")
+                    state.text_changed(changed_at)
+                    target.note_change(changed_at)
+                    prompt_check_at = changed_at + PROMPT_SETTLE_SECONDS
+                if prompt is not None:
+                    state.prompt_appeared(prompt)
+            except Exception as e:
+                metrics.inc("errors")
+                target.note_error(str(e))
+                log.error(f"{target.label}Error sending keys: {e}")
+                target.resolver.invalidate()
+                subscribed_handle = None
+                if stop_event.wait(target.schedule.after_error()):
+                    break
+        return True
+    finally:
+        _active_notifiers.discard(notifier)
+        if unsubscribe is not None:
+            unsubscribe()
+
+GIF_CACHE_MAGIC = b"DBFRAMES2\n"
+
+
+def _gif_cache_path() -> str:
+    if GIF_CACHE:
+        return GIF_CACHE
+    directory = os.path.dirname(os.path.abspath(GIF_PATH))
+    if not os.access(directory, os.W_OK):
+        directory = tempfile.gettempdir()
+    return os.path.join(directory, ".dippingbird.frames.cache")
+
+
+def _gif_cache_key() -> dict:
+    st = os.stat(GIF_PATH)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "window": list(WINDOW_SIZE)}
+
+
+def _decode_gif_frames():
+    """Decodes GIF_PATH in one pass into window-sized RGB frames composed over white.
+
+    Returns (durations, frame bytes, dirty rects as (x, y, w, h) or None relative to the previous frame).
+    """
+    from PIL import Image, ImageChops, ImageSequence
+
+    def diff(before, after):
+        bbox = ImageChops.difference(before, after).getbbox()
+        return (bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1]) if bbox else None
+
+    gif = Image.open(GIF_PATH)
+    left = (gif.size[0] - WINDOW_SIZE[0]) // 2
+    top = (gif.size[1] - WINDOW_SIZE[1]) // 2
+    durations, frames, dirty = [], [], []
+    first = previous = None
+    for frame in ImageSequence.Iterator(gif):
+        durations.append(max(frame.info.get("duration", 0) or 0, GIF_MIN_FRAME_MS))
+        canvas = Image.new("RGBA", WINDOW_SIZE, (255, 255, 255, 255))
+        canvas.alpha_composite(frame.convert("RGBA"), dest=(max(0, -left), max(0, -top)), source=(max(0, left), max(0, top)))
+        rgb = canvas.convert("RGB")
+        frames.append(rgb.tobytes())
+        dirty.append(diff(previous, rgb) if previous is not None else None)
+        if first is None:
+            first = rgb
+        previous = rgb
+    if frames:
+        # The first frame follows the last one when looping
+        dirty[0] = diff(previous, first)
+    return durations, frames, dirty
+
+
+def _write_gif_cache(path: str, key: dict, durations, frames, dirty):
+    header = json.dumps({"key": key, "durations": durations, "dirty": dirty, "frame_bytes": len(frames[0])}).encode("utf-8")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(GIF_CACHE_MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            for data in frames:
+                f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def _load_gif_frames(make_surface):
+    """Returns (durations, surfaces, dirty) from the frame cache if it matches GIF_PATH, else decodes and caches.
+
+    make_surface(buffer) turns one frame's RGB bytes into a display surface; cached frames are handed over
+    as views into a memory map, so a warm start never touches PIL.
+    """
+    path = None if GIF_CACHE.lower() == "off" else _gif_cache_path()
+    key = _gif_cache_key()
+    if path and os.path.exists(path):
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:len(GIF_CACHE_MAGIC)] == GIF_CACHE_MAGIC:
+                    offset = len(GIF_CACHE_MAGIC)
+                    (header_len,) = struct.unpack_from("<I", mm, offset)
+                    offset += 4
+                    header = json.loads(bytes(mm[offset:offset + header_len]))
+                    offset += header_len
+                    n = header["frame_bytes"]
+                    count = len(header["durations"])
+                    if header["key"] == key and len(mm) == offset + n * count:
+                        surfaces = []
+                        with memoryview(mm) as view:
+                            for i in range(count):
+                                with view[offset + i * n:offset + (i + 1) * n] as frame_view:
+                                    surfaces.append(make_surface(frame_view))
+                        return header["durations"], surfaces, header["dirty"]
+        except (OSError, ValueError, KeyError, struct.error):
+            pass
+    durations, frames, dirty = _decode_gif_frames()
+    if path and frames:
+        _write_gif_cache(path, key, durations, frames, dirty)
+    return durations, [make_surface(data) for data in frames], dirty
+
+
+class DippingBirdGIF:
+    """Low-CPU GIF window: pre-converted frames, redraws only on frame changes, dirty-rect updates."""
+
+    def __init__(self):
+        self.screen = None
+        self.frames = []
+        self.durations = []
+        self.dirty = []  # per frame: rect that differs from the previous frame (None if identical)
+        self.current_frame = None
+        self.background_fps = GIF_BACKGROUND_FPS
+        self._ends = []
+        self._total_ms = 0
+        self._started = time.monotonic()
+        self._needs_full_redraw = True
+
+    def setup(self):
+        import pygame
+        self.screen = pygame.display.set_mode(WINDOW_SIZE)
+        pygame.display.set_caption("Dipping Bird")
+
+        if not os.path.exists(GIF_PATH):
+            print(f"Error: '{GIF_PATH}' not found.")
+            return False
+
+        # Frames are composed onto the white background and cropped to the window once, so drawing is a plain blit
+        def make_surface(buffer):
+            # convert() copies into display format, so the buffer need not outlive this call
+            return pygame.image.frombuffer(buffer, WINDOW_SIZE, "RGB").convert()
+
+        self.durations, self.frames, dirty = _load_gif_frames(make_surface)
+        if not self.frames:
+            print(f"Error: '{GIF_PATH}' has no frames.")
+            return False
+        self.dirty = [pygame.Rect(r) if r else None for r in dirty]
+        total = 0
+        for d in self.durations:
+            total += d
+            self._ends.append(total)
+        self._total_ms = total
+        self._started = time.monotonic()
+        return True
+
+    def _frame_at(self, now: float):
+        """Returns (frame index, ms until that frame ends) for the looping animation clock."""
+        t = ((now - self._started) * 1000.0) % self._total_ms
+        idx = bisect.bisect_right(self._ends, t)
+        idx = min(idx, len(self._ends) - 1)
+        return idx, self._ends[idx] - t
+
+    def update(self):
+        import pygame
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return False
+            if event.type in (pygame.VIDEOEXPOSE, getattr(pygame, "WINDOWEXPOSED", -1)):
+                self._needs_full_redraw = True
+
+        if not pygame.display.get_active():
+            # Minimized: draw nothing; repaint fully once restored
+            self._needs_full_redraw = True
+            return True
+
+        idx, _ = self._frame_at(time.monotonic())
+        if self._needs_full_redraw:
+            self.screen.blit(self.frames[idx], (0, 0))
+            pygame.display.flip()
+            self._needs_full_redraw = False
+        elif idx != self.current_frame:
+            contiguous = self.current_frame is not None and idx == (self.current_frame + 1) % len(self.frames)
+            rect = self.dirty[idx] if contiguous else self.screen.get_rect()
+            if rect is not None:
+                self.screen.blit(self.frames[idx], rect, area=rect)
+                pygame.display.update(rect)
+        self.current_frame = idx
+        return True
+
+    def next_wait(self) -> float:
+        """Seconds the caller can sleep before the next update() has anything to draw."""
+        import pygame
+        if not pygame.display.get_active():
+            return GIF_PAUSED_POLL
+        _, remaining_ms = self._frame_at(time.monotonic())
+        wait = max(remaining_ms / 1000.0, 1.0 / FRAME_RATE)
+        if self.background_fps > 0 and not pygame.key.get_focused():
+            wait = max(wait, 1.0 / self.background_fps)
+        return wait
+
+def cleanup():
+    global should_exit
+    should_exit = True
+    stop_event.set()
+    for notifier in list(_active_notifiers):
+        notifier.wake()
+    if _pty_backend is not None:
+        _pty_backend.close()
+    if _recorder is not None:
+        _recorder.close()
+    if _analytics is not None:
+        _analytics.close()
+    if _control_server is not None:
+        _control_server.close()
+    if _send_queue is not None:
+        _send_queue.close()
+    _log_pool_stats()
+    stop_logging()
+    # Only shut pygame down if the GIF path actually loaded it
+    if "pygame" in sys.modules:
+        sys.modules["pygame"].quit()
+    print("Cleanup complete.")
+
+def main():
+    global should_exit, DISABLE_GIF
+
+    # Set up signal handlers
+    signal.signal(signal.SIGINT, handle_sigint)
+    signal.signal(signal.SIGTERM, handle_sigint)
+    atexit.register(cleanup)
+
+    if not DISABLE_GIF and sys.platform.startswith("linux") and not (
+        os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY") or os.environ.get("SDL_VIDEODRIVER")
+    ):
+        print("No display found; running without the GIF window.")
+        DISABLE_GIF = True
+
+    # Initialize pygame in the main thread (imported here so headless runs never load it)
     if not DISABLE_GIF:
+        import pygame
         pygame.init()
 
+    start_logging()
+    start_metrics_exporters()
+
     key_thread = threading.Thread(target=send_keys_if_match, daemon=True)
     key_thread.start()
 
@@ -522,7 +3597,8 @@ def main():
             if not DISABLE_GIF:
                 if not dipping_bird.update():
                     break
-                if stop_event.wait(1/60):  # Wait for 1/60 second or until stop_event is set
+                # Sleep until the next frame is due (or stop_event is set) instead of spinning
+                if stop_event.wait(dipping_bird.next_wait()):
                     break
             else:
                 if stop_event.wait(1):  # Wait for 1 second or until stop_event is set when GIF is disabled
@@ -537,16 +3613,31 @@ def main():
         os._exit(0)
 
 def _apply_cli_overrides(argv):
-    global REEVALUATION_ENABLED, PERSISTENT, STALE_SECONDS, RUN_EVERY, ALWAYS_SEND_Y
-    global APP_TITLE, APP_TITLE_CONTAINS, SELECTED_HANDLE, TARGET_HANDLE_ENV
+    global REEVALUATION_ENABLED, PERSISTENT, STALE_SECONDS, RUN_EVERY, ALWAYS_SEND_Y, WATCH_MODE
+    global APP_TITLE, APP_TITLE_CONTAINS, SELECTED_HANDLE, TARGET_HANDLE_ENV, TARGETS_FILE, PTY_COMMAND
     # Recognized forms:
-    # --reeval, --persistent, --stale=60, --interval=3, --always[=true|false]
-    # --title=... --contains=... --handle=0x1234
+    # --reeval, --persistent, --stale=60, --interval=3, --always[=true|false], --events
+    # --title=... --contains=... --handle=0x1234 (repeatable) --targets=targets.txt
+    # --pty="codex --full-auto" (or everything after "--") --record=session.jsonl --daemon --fleet=4
+    # --analytics=events.db --activity
     for arg in argv:
         if arg == "--reeval":
             REEVALUATION_ENABLED = True
         elif arg == "--persistent":
             PERSISTENT = True
+        elif arg == "--events":
+            WATCH_MODE = "events"
+        elif arg == "--activity":
+            globals()["ACTIVITY_PROBE"] = True
+        elif arg == "--daemon":
+            globals()["DAEMON"] = True
+        elif arg.startswith("--fleet="):
+            try:
+                globals()["FLEET_WORKERS"] = int(arg.split("=", 1)[1])
+            except ValueError:
+                pass
+        elif arg == "--no-gif":
+            globals()["DISABLE_GIF"] = True
         elif arg.startswith("--stale="):
             try:
                 STALE_SECONDS = int(arg.split("=", 1)[1])
@@ -576,19 +3667,42 @@ def _apply_cli_overrides(argv):
         elif arg.startswith("--handle="):
             val = arg.split("=", 1)[1]
             TARGET_HANDLE_ENV = val
+            handle = _parse_handle(val)
+            if handle is not None and handle not in TARGET_HANDLES:
+                TARGET_HANDLES.append(handle)
+        elif arg.startswith("--targets="):
+            TARGETS_FILE = arg.split("=", 1)[1]
+        elif arg.startswith("--record="):
+            globals()["RECORD_FILE"] = arg.split("=", 1)[1]
+        elif arg.startswith("--analytics="):
+            globals()["ANALYTICS_DB"] = arg.split("=", 1)[1]
+        elif arg.startswith("--pty="):
+            PTY_COMMAND = shlex.split(arg.split("=", 1)[1])
         # --help/--list/--select are handled below
 
 
 if __name__ == "__main__":
     # CLI: combine simple actions with overrides
     args = sys.argv[1:]
+    if "--" in args:
+        # Everything after "--" is an agent command to run under a pty
+        PTY_COMMAND = args[args.index("--") + 1:]
+        args = args[:args.index("--")]
     if args:
+        if args[0] == "--ctl":
+            # Thin client for a running --daemon: no GIF, no window lookups
+            sys.exit(_control_client(args[1:]))
         if "--help" in args:
             inspect_controls()
             sys.exit(0)
         if "--list" in args:
             list_candidates()
             sys.exit(0)
+        if any(a == "--stats" or a.startswith("--stats=") for a in args):
+            sys.exit(_stats_cli(args))
+        if any(a.startswith("--replay=") for a in args):
+            _replay_cli(args)
+            sys.exit(0)
         if "--select" in args:
             interactive_select()
             # continue to main after selection
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import dippingbird  # noqa: E402
+from fake_desktop import FakeDesktopState  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _heuristic_targeting(monkeypatch):
+    # Resolve through the desktop scan, never through settings picked up from the environment
+    monkeypatch.setattr(dippingbird, "APP_TITLE", "")
+    monkeypatch.setattr(dippingbird, "APP_TITLE_CONTAINS", "")
+    monkeypatch.setattr(dippingbird, "SELECTED_HANDLE", None)
+    monkeypatch.setattr(dippingbird, "TARGET_HANDLE_ENV", None)
+    monkeypatch.setattr(dippingbird, "SEND_QUEUE", False)
+
+
+@pytest.fixture
+def desktop():
+    return FakeDesktopState(windows=6, consoles=2, scrollback_bytes=80 * 200)
+
+
+@pytest.fixture
+def backend(desktop):
+    return dippingbird.PywinautoBackend(desktop.Desktop, desktop.Application)
@@ -0,0 +1,91 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import dippingbird
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc")
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _probe(samples, clock):
+    probe = dippingbird.ProcessActivityProbe(os.getpid(), cpu_percent=10, io_bytes=1000, clock=clock)
+    probe.failed = None
+    probe.sample = lambda: samples.pop(0)
+    return probe
+
+
+def test_busy_from_cpu_io_and_children():
+    clock = Clock()
+    samples = [{1: (1.0, 0)}, {1: (1.05, 10)}, {1: (1.5, 10)}, {1: (1.5, 5000)}, {1: (1.5, 5000), 2: (0.0, 0)},
+               {1: (1.5, 5000), 2: (0.0, 0)}]
+    probe = _probe(samples, clock)
+    verdicts = []
+    for _ in range(6):
+        verdicts.append(probe.busy())
+        clock.now += 1
+    assert verdicts == [False, False, True, True, True, False]
+
+
+def test_sampling_failure_falls_back_to_text():
+    probe = dippingbird.ProcessActivityProbe(os.getpid())
+    probe.failed = None
+
+    def gone():
+        raise OSError("process exited")
+
+    probe.sample = gone
+    assert not probe.busy()
+    assert probe.failed == "process exited"
+
+
+def test_shared_terminal_hosts_are_not_probed(monkeypatch):
+    name = "_proc_name_windows" if os.name == "nt" else "_proc_name_linux"
+    monkeypatch.setattr(dippingbird, name, lambda pid: "WindowsTerminal.exe")
+    probe = dippingbird.ProcessActivityProbe(os.getpid())
+    assert "WindowsTerminal.exe" in probe.failed
+    assert not probe.busy()
+
+
+@linux_only
+def test_proc_counters_match_os_times():
+    deadline = time.process_time() + 0.3
+    while time.process_time() < deadline:
+        pass
+    cpu, io = dippingbird._proc_counters_linux(os.getpid())
+    times = os.times()
+    assert abs(cpu - (times.user + times.system + times.children_user + times.children_system)) < 0.05
+    with open(__file__, "rb") as f:
+        size = len(f.read())
+    assert dippingbird._proc_counters_linux(os.getpid())[1] - io >= size
+
+
+@linux_only
+def test_probe_tells_a_spinning_child_from_a_sleeping_one():
+    spinning = subprocess.Popen([sys.executable, "-c", "while True: pass"])
+    sleeping = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        time.sleep(0.3)
+        verdicts = {}
+        for name, proc in (("spinning", spinning), ("sleeping", sleeping)):
+            probe = dippingbird.ProcessActivityProbe(proc.pid)
+            assert probe.failed is None
+            probe.busy()
+            time.sleep(0.3)
+            verdicts[name] = probe.busy()
+        assert verdicts == {"spinning": True, "sleeping": False}
+    finally:
+        spinning.kill()
+        sleeping.kill()
+        spinning.wait()
+        sleeping.wait()
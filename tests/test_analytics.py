@@ -0,0 +1,35 @@
+import time
+
+import dippingbird
+
+
+def test_percentile_picks_the_nearest_rank():
+    assert dippingbird._percentile([], 0.5) is None
+    assert dippingbird._percentile([40, 10, 30, 20], 0.5) == 30
+    assert dippingbird._percentile([40, 10, 30, 20], 0.9) == 40
+    assert dippingbird._percentile(list(range(100)), 0.99) == 99
+
+
+def test_report_idle_to_send_and_duty_cycle(tmp_path):
+    path = str(tmp_path / "analytics.db")
+    store = dippingbird.AnalyticsStore(path, flush_seconds=0.1)
+    base = time.time() - 600
+    events = [("change", 0, None), ("send", 1, "initial"), ("send", 10, "stale"),
+              ("change", 12, None), ("stale", 30, None), ("send", 32, "stale"),
+              ("change", 33, None), ("error", 50, None), ("send", 63, "min-send"),
+              ("change", 64, None), ("send", 70, "loop"), ("send", 104, "prompt")]
+    for kind, t, reason in events:
+        store.event("0x10", kind, base + t, reason)
+    store.event("0x20", "change", base - 3 * 3600)  # outside --since=1
+    store.close()
+
+    report = {r["target"]: r for r in dippingbird.analytics_report(path, active_gap=5)}
+    row = report["0x10"]
+    assert (row["sends"], row["stalls"], row["errors"], row["reevals"]) == (5, 1, 1, 1)
+    # Initial sends are excluded; the rest waited 10, 20, 30 and 40 seconds after the last change
+    assert (row["idle_to_send_p50"], row["idle_to_send_p90"], row["idle_to_send_p99"]) == (30, 40, 40)
+    # Gaps of 12, 21 and 31s between changes count as 5s of activity each, over a 104s span
+    assert row["duty_cycle"] == round(15 / 104, 3)
+    assert row["sends_per_hour"] == round(5 / (104 / 3600), 1)
+    assert list(report) == ["0x10", "0x20"]
+    assert [r["target"] for r in dippingbird.analytics_report(path, since_hours=1)] == ["0x10"]
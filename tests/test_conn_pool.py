@@ -0,0 +1,64 @@
+import pytest
+
+import dippingbird
+
+
+class Conn:
+    def __init__(self, name):
+        self.name = name
+        self.alive = True
+
+
+def _connect(made, name):
+    def connect():
+        conn = Conn(name)
+        made.append(conn)
+        return conn
+    return connect
+
+
+def test_wrappers_are_reused_until_the_window_dies():
+    made = []
+    pool = dippingbird.ConnectionPool(lambda conn: conn.alive, enabled=True)
+    first = pool.get(0x10, "uia", _connect(made, "a"))
+    assert pool.get(0x10, "uia", _connect(made, "b")) is first
+    assert (pool.hits, pool.misses) == (1, 1)
+
+    first.alive = False
+    second = pool.get(0x10, "uia", _connect(made, "c"))
+    assert second is not first and second.name == "c"
+    assert (pool.misses, pool.evictions) == (2, 1)
+
+
+def test_invalidate_by_handle_and_backend():
+    made = []
+    pool = dippingbird.ConnectionPool(lambda conn: True, enabled=True)
+    for handle in (0x10, 0x20):
+        for backend in ("win32", "uia"):
+            pool.get(handle, backend, _connect(made, f"{handle}/{backend}"))
+    pool.invalidate(0x10, "uia")
+    assert pool.stats()["size"] == 3
+    pool.invalidate(0x20)
+    assert pool.stats()["size"] == 1
+    assert pool.get(0x10, "win32", _connect(made, "again")).name == "16/win32"
+    pool.invalidate()
+    assert pool.stats() == {"hits": 1, "misses": 4, "evictions": 4, "size": 0, "hit_rate": 0.2}
+
+
+def test_disabled_pool_always_connects():
+    made = []
+    pool = dippingbird.ConnectionPool(lambda conn: True, enabled=False)
+    pool.get(0x10, "uia", _connect(made, "a"))
+    pool.get(0x10, "uia", _connect(made, "b"))
+    assert [conn.name for conn in made] == ["a", "b"]
+    assert pool.stats()["size"] == 0
+
+
+def test_backend_drops_a_closed_windows_connection(desktop, backend):
+    console = desktop.consoles[0]
+    assert backend.connect_handle(console.handle, "uia") is backend.connect_handle(console.handle, "uia")
+    assert backend.pool.hits == 1
+    console.alive = False
+    with pytest.raises(RuntimeError):
+        backend.connect_handle(console.handle, "uia")
+    assert backend.pool.evictions == 1 and backend.pool.stats()["size"] == 0
@@ -0,0 +1,67 @@
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+import dippingbird
+
+
+@pytest.fixture
+def control(desktop, backend, monkeypatch):
+    monkeypatch.setattr(dippingbird, "_backend", backend)
+    monkeypatch.setattr(dippingbird, "stop_event", threading.Event())
+    supervisor = dippingbird.TargetSupervisor([], elastic=True)
+    return dippingbird.ControlServer(supervisor, port=0)
+
+
+def test_attach_set_pause_and_detach(control, desktop):
+    handle = hex(desktop.consoles[1].handle)
+    reply = control.execute(["attach", handle, "--stale=45", "--persistent"])
+    assert reply["ok"] and reply["target"]["stale_seconds"] == 45 and reply["target"]["persistent"]
+    assert control.execute(["attach", handle]) == {"ok": False, "error": f"{handle} is already attached"}
+    assert not control.execute(["attach", "nonsense"])["ok"]
+
+    reply = control.execute(["set", handle, "--stale=90", "--interval=7"])
+    assert [(t["stale_seconds"], t["interval"]) for t in reply["targets"]] == [(90, 7)]
+    control.execute(["pause"])
+    assert [t.paused for t in control.supervisor.targets] == [True]
+    control.execute(["resume", handle])
+    assert [t.paused for t in control.supervisor.targets] == [False]
+
+    status = control.execute(["status"])
+    assert [t["id"] for t in status["targets"]] == [handle]
+    assert control.execute(["detach", handle])["ok"]
+    assert control.supervisor.targets == []
+    assert control.execute(["detach", handle]) == {"ok": False, "error": f"no target {handle}"}
+
+
+def test_errors_and_shutdown(control):
+    assert control.execute([]) == {"ok": False, "error": "empty command"}
+    assert control.execute(["frobnicate"]) == {"ok": False, "error": "unknown command frobnicate"}
+    assert control.execute(["detach"])["error"].startswith("usage:")
+    assert control.execute(["PING"])["ok"]
+    assert control.execute(["shutdown"]) == {"ok": True}
+    assert dippingbird.stop_event.is_set()
+
+
+def test_list_reports_desktop_windows(control, desktop):
+    handles = {w["handle"] for w in control.execute(["list"])["windows"]}
+    assert {hex(c.handle) for c in desktop.consoles} <= handles
+
+
+def test_socket_requires_the_token(control, tmp_path, capsys):
+    control.control_file = str(tmp_path / "control.json")
+    assert control.start()
+    try:
+        if os.name == "posix":
+            assert os.stat(control.control_file).st_mode & 0o777 == 0o600
+        assert dippingbird._control_client(["ping"], control.control_file) == 0
+        assert json.loads(capsys.readouterr().out)["ok"]
+        with socket.create_connection(("127.0.0.1", control.port), timeout=5) as sock:
+            sock.sendall(b"wrong ping\n")
+            assert json.loads(sock.makefile("rb").readline()) == {"ok": False, "error": "bad token"}
+    finally:
+        control.close()
+    assert not os.path.exists(control.control_file)
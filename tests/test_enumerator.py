@@ -0,0 +1,84 @@
+import dippingbird
+
+
+class Win:
+    def __init__(self, handle, title, reads):
+        self.handle = handle
+        self.title = title
+        self.reads = reads
+
+    def window_text(self):
+        self.reads.append((self.handle, self.title))
+        return self.title
+
+    def class_name(self):
+        return "ConsoleWindowClass"
+
+    def process_id(self):
+        return self.handle * 10
+
+
+class Backend:
+    def __init__(self):
+        self.reads = []
+        self.scans = []
+        self.fail = set()
+        self.listing = {
+            "win32": [Win(1, "one (win32)", self.reads), Win(2, "two (win32)", self.reads)],
+            "uia": [Win(2, "two (uia)", self.reads), Win(3, "three (uia)", self.reads), Win(0, "desktop", self.reads)],
+        }
+
+    def windows(self, name):
+        self.scans.append(name)
+        if name in self.fail:
+            raise RuntimeError(f"{name} unavailable")
+        return self.listing[name]
+
+
+def test_backends_merge_by_handle_win32_first():
+    backend = Backend()
+    enumerator = dippingbird.WindowEnumerator(backend, ttl=60)
+    infos = enumerator.snapshot()
+    assert [info.handle for info in infos] == [1, 2, 3]
+    assert list(infos[1].wrappers) == ["win32", "uia"]
+    assert [info.title for info in infos] == ["one (win32)", "two (win32)", "three (uia)"]
+    assert infos[2].pid == 30
+    # Each property is read once, through the first backend that listed the window
+    assert [info.title for info in enumerator.snapshot()] == ["one (win32)", "two (win32)", "three (uia)"]
+    assert sorted(backend.reads) == [(1, "one (win32)"), (2, "two (win32)"), (3, "three (uia)")]
+
+
+def test_listing_is_shared_until_the_ttl():
+    backend = Backend()
+    enumerator = dippingbird.WindowEnumerator(backend, ttl=60)
+    enumerator.snapshot()
+    enumerator.snapshot(backends=("win32",))
+    assert enumerator.scans == 1 and sorted(backend.scans) == ["uia", "win32"]
+    enumerator.invalidate()
+    enumerator.snapshot(backends=("uia",))
+    assert enumerator.scans == 2 and backend.scans[-1] == "uia"
+
+    rescanning = dippingbird.WindowEnumerator(backend, ttl=0)
+    rescanning.snapshot()
+    rescanning.snapshot()
+    assert rescanning.scans == 2
+
+
+def test_a_failing_backend_leaves_the_other_listed():
+    backend = Backend()
+    backend.fail.add("uia")
+    enumerator = dippingbird.WindowEnumerator(backend, ttl=0)
+    assert [info.handle for info in enumerator.snapshot()] == [1, 2]
+    assert "uia" in enumerator.errors
+    backend.fail.clear()
+    assert [info.handle for info in enumerator.snapshot()] == [1, 2, 3]
+    assert enumerator.errors == {}
+
+
+def test_prefetch_reads_every_listed_window(desktop, backend):
+    enumerator = dippingbird.WindowEnumerator(backend, ttl=60)
+    infos = enumerator.snapshot(prefetch=("title", "class_name"))
+    calls = desktop.calls
+    titles = [info.title for info in infos]
+    assert desktop.calls == calls
+    assert titles[-2:] == [c._title for c in desktop.consoles]
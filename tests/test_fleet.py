@@ -0,0 +1,88 @@
+import struct
+import time
+
+import dippingbird
+
+
+class SpyRow:
+    """Records the sequence number each row payload is written under."""
+
+    def __init__(self, row):
+        self.row = row
+        self.size = row.size
+        self.seqs = []
+
+    def pack_into(self, buf, offset, *values):
+        self.seqs.append(values[0])
+        self.row.pack_into(buf, offset, *values)
+
+    def unpack_from(self, buf, offset):
+        return self.row.unpack_from(buf, offset)
+
+
+def _seq(table, slot):
+    return struct.unpack_from("<I", table.shm.buf, slot * table.ROW.size)[0]
+
+
+def test_rows_round_trip_between_handles():
+    table = dippingbird.FleetStatusTable(3)
+    try:
+        reader = dippingbird.FleetStatusTable(3, name=table.name)
+        table.write(1, worker=2, handle=0x20, last_change=10.0, last_send=None, stale_seconds=30, errors=1, sends=4)
+        row = reader.read(1)
+        assert (row["worker"], row["handle"], row["last_change"], row["last_send"]) == (2, 0x20, 10.0, None)
+        assert (row["stale_seconds"], row["errors"], row["sends"]) == (30, 1, 4)
+        assert reader.read(0)["handle"] == 0
+        reader.close()
+    finally:
+        table.close()
+
+
+def test_payload_is_written_while_the_sequence_is_odd():
+    table = dippingbird.FleetStatusTable(2)
+    try:
+        table.ROW = spy = SpyRow(table.ROW)
+        for _ in range(3):
+            table.write(1, 0, 0x20, 1.0, 2.0, 30, 0, 1)
+            assert _seq(table, 1) % 2 == 0
+        assert spy.seqs == [1, 3, 5]
+        assert _seq(table, 0) == 0
+    finally:
+        table.close()
+
+
+def test_row_left_odd_by_a_killed_writer_recovers():
+    table = dippingbird.FleetStatusTable(1)
+    try:
+        struct.pack_into("<I", table.shm.buf, 0, 7)  # worker died mid-write
+        table.write(0, 1, 0x30, 1.0, 0.0, 30, 0, 0)
+        assert _seq(table, 0) == 8
+        assert table.read(0)["handle"] == 0x30
+        struct.pack_into("<I", table.shm.buf, 0, 0xFFFFFFFF)
+        table.write(0, 1, 0x31, 1.0, 0.0, 30, 0, 0)
+        assert _seq(table, 0) == 0
+    finally:
+        table.close()
+
+
+def test_hang_limit_covers_each_shards_slowest_target(monkeypatch):
+    monkeypatch.setattr(dippingbird, "POLL_MAX_SECONDS", 30)
+    monkeypatch.setattr(dippingbird, "POLL_ERROR_MAX_SECONDS", 60)
+    supervisor = dippingbird.FleetSupervisor([(0x10, {}), (0x20, {"interval": 400})], workers=2, hang_seconds=180)
+    try:
+        assert supervisor.hang_limits == [180, 800]
+    finally:
+        supervisor.table.close()
+
+
+def test_workers_stop_on_the_shared_event(caplog):
+    supervisor = dippingbird.FleetSupervisor([(0x10, {}), (0x20, {})], workers=2)
+    for index in range(supervisor.workers):
+        supervisor._start(index)
+    deadline = time.time() + 30
+    while time.time() < deadline and not all(row["updated"] for row in supervisor.status()):
+        time.sleep(0.1)
+    procs = list(supervisor.procs)
+    supervisor.stop(timeout=20)
+    assert [proc.exitcode for proc in procs] == [0, 0]
+    assert "terminating" not in caplog.text
@@ -0,0 +1,83 @@
+import dippingbird
+
+BLOCK = ["Running tests...", "FAILED test_parse (3 errors)", "Fixing the parser", "Applying patch", "Retrying"]
+
+
+def _feed(detector, scrollback, console, now):
+    appended = scrollback.merge("\n".join(console[-40:]))
+    return detector.update(scrollback.tail(40), appended, now=now, repainted=scrollback.repainted)
+
+
+def test_numbered_output_at_startup_is_not_a_loop(desktop):
+    scrollback = dippingbird.Scrollback()
+    detector = dippingbird.LoopDetector(min_shingles=5, cooldown=0)
+    # "[00000012] xxx..." lines all normalize to the same text once digits are folded
+    assert not _feed(detector, scrollback, desktop.consoles[0].lines, now=0)
+
+
+def test_a_loop_keeps_being_flagged():
+    scrollback = dippingbird.Scrollback()
+    detector = dippingbird.LoopDetector(cooldown=0)
+    console = [f"compiled module_{chr(97 + i % 26)}{i // 26}.py" for i in range(40)]
+    _feed(detector, scrollback, console, now=0)
+    flagged = []
+    for rep in range(30):
+        console += [line.replace("3", str(rep)) for line in BLOCK]
+        if _feed(detector, scrollback, console, now=rep):
+            flagged.append(rep)
+    assert len(flagged) >= 4
+    assert flagged[-1] >= 25
+
+
+def test_varied_output_is_not_flagged(desktop):
+    console = desktop.consoles[0]
+    scrollback = dippingbird.Scrollback()
+    detector = dippingbird.LoopDetector(cooldown=0)
+    words = "alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu".split()
+    lines = list(console.lines)
+    _feed(detector, scrollback, lines, now=0)
+    for i in range(200):
+        lines.append(" ".join(words[(i * k) % len(words)] for k in (1, 3, 5, 7)) + f" {words[i % 11]}{words[i % 7]}")
+        assert not _feed(detector, scrollback, lines, now=i)
+
+
+def test_target_tick_sends_the_nudge_on_every_flag(desktop, backend, monkeypatch):
+    monkeypatch.setattr(dippingbird, "REEVALUATION_ENABLED", True)
+    console = desktop.consoles[0]
+    target = dippingbird.Target(console.handle, stale_seconds=10 ** 6, backend=backend)
+    target.loop.cooldown = 0
+    target.tick()
+    for rep in range(12):
+        console.append_output([line.replace("3", str(rep)) for line in BLOCK])
+        target.tick()
+    nudges = [keys for keys in console.sent if keys.startswith(dippingbird.REEVALUATION_MESSAGE)]
+    assert len(nudges) >= 2
+    assert not target.state.loop_pending
+
+
+def test_ticking_status_rows_are_not_a_loop(desktop, backend, monkeypatch):
+    monkeypatch.setattr(dippingbird, "REEVALUATION_ENABLED", True)
+    console = desktop.consoles[0]
+    screen = [f"{name}.py | {'#' * (i % 9)} step {chr(97 + i % 26)}" for i, name in enumerate("abcdefghij" * 4)][:34]
+    console.lines[:] = screen + ["Working (0s - esc to interrupt)", "> "]
+    target = dippingbird.Target(console.handle, stale_seconds=10 ** 6, backend=backend)
+    target.loop.cooldown = 0
+    target.tick()
+    for t in range(1, 40):
+        console.lines[-2] = f"Working ({t}s - esc to interrupt)"
+        target.tick()
+        assert not target.state.loop_pending
+    assert not [keys for keys in console.sent if keys.startswith(dippingbird.REEVALUATION_MESSAGE)]
+    assert len(target.scrollback) == 36
+
+
+def test_loop_send_takes_precedence_and_clears_the_flag():
+    now = 1000.0
+    state = dippingbird.StalenessState(30, False, 0, clock=lambda: now)
+    state.record_send("initial", now)
+    state.loop_detected()
+    assert state.seconds_until_due(now) == 0
+    assert state.decide(now) == "loop"
+    state.record_send("loop", now, reeval=True)
+    assert state.decide(now) is None
+    assert state.seconds_until_due(now) == 30
@@ -0,0 +1,32 @@
+import dippingbird
+
+
+def _rules(tmp_path, text):
+    path = tmp_path / "rules.txt"
+    path.write_text(text, encoding="utf-8")
+    return dippingbird.build_prompt_rules(str(path))
+
+
+def test_rule_with_inline_global_flags_is_skipped(tmp_path, caplog):
+    rules = _rules(tmp_path, "pip = (?i)proceed \\(y/n\\)\\?\noverwrite = overwrite\\? \\[y/N\\]$\n")
+    names = [name for name, _, _ in rules.rules]
+    assert "pip" not in names
+    assert "overwrite" in names
+    assert "Ignoring prompt rule 'pip'" in caplog.text
+    assert rules.match("Overwrite? [y/N]") == "overwrite"
+    assert rules.match("Continue (y/n)") == "yn-paren"
+
+
+def test_numbered_backreference_is_skipped(tmp_path, caplog):
+    rules = _rules(tmp_path, "dup = (a)\\1 continue\\?\nnamed = (?P<w>ok)(?P=w)\\?$\n")
+    names = [name for name, _, _ in rules.rules]
+    assert "dup" not in names
+    assert [r.levelname for r in caplog.records] == ["WARNING"]
+    assert rules.match("okok?") == "named"
+
+
+def test_only_the_tail_is_matched():
+    rules = dippingbird.build_prompt_rules("")
+    assert rules.match("Proceed (y/n)?\nworking\nstill working\nmore") is None
+    assert rules.match("history\n" * 1000 + "Proceed (y/n)?") == "yn-paren"
+    assert rules.match("> ", kinds=("input",)) == "input-caret"
@@ -0,0 +1,54 @@
+import sys
+import time
+
+import pytest
+
+import dippingbird
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="needs a pty")
+
+CHILD = r"""
+import sys
+sys.stdout.write("\x1b[32mProceed (y/n)?\x1b[0m ")
+sys.stdout.flush()
+answer = input()
+print("got " + answer)
+"""
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return predicate()
+
+
+def test_session_streams_clean_text_and_takes_keystrokes():
+    backend = dippingbird.PtyBackend()
+    session = backend.spawn([sys.executable, "-c", CHILD], echo=False)
+    exits = []
+    session.on_exit = exits.append
+    try:
+        assert _wait_for(lambda: "Proceed" in session.text())
+        assert session.text() == "Proceed (y/n)? "  # colors stripped, unterminated prompt kept
+        assert dippingbird.build_prompt_rules("").match(session.text()) == "yn-paren"
+        assert backend.connect_handle(session.handle) is session
+
+        session.send_keystrokes("y{ENTER}")
+        assert _wait_for(lambda: "got y" in session.text())
+        assert session.exited.wait(10)
+        assert exits == [session]
+        assert session.text(1) == "got y"
+        with pytest.raises(LookupError):
+            backend.connect_handle(session.handle)
+        assert backend.windows("win32") == []
+    finally:
+        session.close()
+
+
+def test_close_stops_a_running_child():
+    session = dippingbird.PtySession([sys.executable, "-c", "import time; time.sleep(60)"], echo=False).start()
+    session.close()
+    assert session.proc.poll() is not None
+    assert session.exited.wait(5)
+    assert session.master_fd is None
@@ -0,0 +1,63 @@
+import time
+
+import dippingbird
+
+BUSY = [float(t) for t in range(101)]  # output every second for 100s, then quiet
+
+
+def test_quiet_gap_gets_one_stale_send():
+    result = dippingbird.replay_session(BUSY, 0.0, 200.0, stale_seconds=30, persistent=False,
+                                        min_send_seconds=0, interval=1)
+    assert [(s["t"], s["reason"]) for s in result["sends"]] == [(0.0, "initial"), (130.0, "stale")]
+    assert result["wasted"] == 1  # nothing followed the stale send
+    assert result["idle_s"] == 130.0  # 100 one-second gaps plus 30s before the stale send
+    assert result["duration_s"] == 200.0
+
+
+def test_persistent_and_min_send_policies():
+    persistent = dippingbird.replay_session(BUSY, 0.0, 200.0, 30, True, 0, 5)
+    assert [s["t"] for s in persistent["sends"]] == [float(t) for t in range(0, 201, 5)]
+    min_send = dippingbird.replay_session(BUSY, 0.0, 400.0, 30, False, 120, 1)
+    assert [(s["t"], s["reason"]) for s in min_send["sends"]][1:] == [(120.0, "min-send"), (240.0, "min-send"),
+                                                                      (360.0, "min-send")]
+
+
+def test_same_seed_same_result():
+    changes = [0.0, 3.0, 50.0, 51.0, 300.0]
+    runs = [dippingbird.replay_session(changes, 0.0, 600.0, 20, False, 0, 3, seed=7) for _ in range(2)]
+    assert runs[0] == runs[1]
+
+
+def test_looping_tails_replay_reeval_sends():
+    block = ["Running tests...", "FAILED test_parse", "Fixing the parser", "Applying patch", "Retrying"]
+    lines = [f"compiled module_{i}.py" for i in range(40)]
+    changes, tails = [], {}
+    for rep in range(30):
+        lines += block
+        t = 10.0 * rep
+        changes.append(t)
+        tails[t] = "partial first line\n" + "\n".join(lines[-40:])
+    result = dippingbird.replay_session(changes, 0.0, 400.0, 600, False, 0, 3, tails=tails, reeval=True)
+    assert any(s["reeval"] for s in result["sends"])
+    plain = dippingbird.replay_session(changes, 0.0, 400.0, 600, False, 0, 3, tails=tails, reeval=False)
+    assert not any(s["reeval"] for s in plain["sends"])
+
+
+def test_recorded_session_round_trip(tmp_path):
+    path = str(tmp_path / "session.jsonl")
+    recorder = dippingbird.SessionRecorder(path)
+    now = time.time()
+    for t in range(0, 60, 2):
+        recorder.change("0x10", now + t, f"line {t}")
+    recorder.send("0x10", now + 90, "stale", False)
+    recorder.close()
+
+    sessions = dippingbird.load_session(path)
+    assert list(sessions) == ["0x10"]
+    assert len(sessions["0x10"]["changes"]) == 30
+    assert sessions["0x10"]["tails"][round(now + 58, 3)] == "line 58"
+
+    grid = {"stale": [15, 30], "min_send": [0], "persistent": [False], "interval": [3]}
+    results = dippingbird.run_replay(path, grid)
+    assert [(r["stale"], r["recorded_sends"]) for r in results] == [(15, 1), (30, 1)]
+    assert all(r["send_count"] >= 2 for r in results)
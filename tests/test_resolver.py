@@ -0,0 +1,66 @@
+import dippingbird
+
+
+def test_default_resolver_falls_back_to_title_scan(desktop, backend):
+    resolver = dippingbird.TargetResolver(backend)
+    assert resolver.resolve().handle == desktop.consoles[0].handle
+
+
+def test_cached_resolve_skips_the_desktop_scan(desktop, backend):
+    resolver = dippingbird.TargetResolver(backend, handles=(desktop.consoles[0].handle,))
+    resolver.resolve()
+    calls = desktop.calls
+    resolver.resolve()
+    assert resolver.hits == 1
+    assert desktop.calls - calls <= 1
+
+
+def test_pinned_handle_resolves_only_itself(desktop, backend):
+    first, second = desktop.consoles
+    resolver = dippingbird.TargetResolver(backend, handles=(second.handle,), ttl=0)
+    assert resolver.resolve().handle == second.handle
+
+    second.alive = False
+    resolver.invalidate()
+    # Must not fall back to the other console, which belongs to another target
+    assert resolver.resolve() is None
+
+
+def test_pinned_target_goes_missing_with_its_window(desktop, backend):
+    second = desktop.consoles[1]
+    target = dippingbird.Target(second.handle, stale_seconds=60, backend=backend)
+    assert target.tick() != "missing"
+    second.alive = False
+    target.resolver.invalidate()
+    assert target.tick() == "missing"
+    assert desktop.consoles[0].sent == []
+
+
+def test_target_tick_sends_into_its_own_console(desktop, backend):
+    first, second = desktop.consoles
+    target = dippingbird.Target(second.handle, stale_seconds=10 ** 6, backend=backend)
+    assert target.tick() == "changed"
+    assert second.sent == ["y{ENTER}"]
+    assert first.sent == []
+    assert target.tick() == "idle"
+    desktop.emit(second, 2)
+    assert target.tick() == "changed"
+    assert second.sent == ["y{ENTER}"]
+
+
+def test_handles_join_the_targets_file(tmp_path, monkeypatch):
+    path = tmp_path / "targets.txt"
+    path.write_text("0x10 --stale=45\n0x20\n", encoding="utf-8")
+    monkeypatch.setattr(dippingbird, "TARGETS_FILE", str(path))
+    monkeypatch.setattr(dippingbird, "TARGET_HANDLES", [0x30])
+    assert dippingbird._target_specs() == [(0x10, {"stale_seconds": 45}), (0x20, {}), (0x30, {})]
+    monkeypatch.setattr(dippingbird, "TARGET_HANDLES", [0x20, 0x10])
+    assert dippingbird._target_specs() == [(0x10, {"stale_seconds": 45}), (0x20, {})]
+
+
+def test_a_single_handle_alone_is_the_default_target(monkeypatch):
+    monkeypatch.setattr(dippingbird, "TARGETS_FILE", "")
+    monkeypatch.setattr(dippingbird, "TARGET_HANDLES", [0x30])
+    assert dippingbird._target_specs() == []
+    monkeypatch.setattr(dippingbird, "TARGET_HANDLES", [0x30, 0x40, 0x30])
+    assert dippingbird._target_specs() == [(0x30, {}), (0x40, {})]
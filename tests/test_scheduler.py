@@ -0,0 +1,39 @@
+import random
+
+import dippingbird
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _state(clock, stale):
+    state = dippingbird.StalenessState(stale, False, 0, clock=clock)
+    state.record_send("initial", clock())
+    return state
+
+
+def test_scheduler_backs_off_only_when_adaptive():
+    clock = Clock()
+    state = _state(clock, 1000)
+    fixed = dippingbird.PollScheduler(5, adaptive=False)
+    assert fixed.after_tick(False, state, clock()) == 5
+    assert fixed.after_error() == 5
+
+    adaptive = dippingbird.PollScheduler(5, max_interval=30, error_max=60, adaptive=True, rng=random.Random(1))
+    delays = [adaptive.after_tick(False, state, clock()) for _ in range(4)]
+    assert delays == [10, 20, 30, 30]
+    assert adaptive.after_tick(True, state, clock()) == 5
+    assert 5 <= adaptive.after_error() <= 10
+
+
+def test_scheduler_never_sleeps_past_the_stale_deadline():
+    clock = Clock()
+    state = _state(clock, 12)
+    scheduler = dippingbird.PollScheduler(5, max_interval=60, adaptive=True)
+    clock.now += 4
+    assert scheduler.after_tick(False, state, clock()) == 8
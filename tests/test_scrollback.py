@@ -0,0 +1,82 @@
+import dippingbird
+
+
+def _window(lines, n=10):
+    return "\n".join(lines[-n:])
+
+
+def test_merge_appends_only_scrolled_in_lines(desktop):
+    console = desktop.consoles[0]
+    scrollback = dippingbird.Scrollback(100)
+    assert scrollback.merge(_window(console.lines)) == 10
+    assert scrollback.merge(_window(console.lines)) == 0
+
+    desktop.emit(console, 3)
+    assert scrollback.merge(_window(console.lines)) == 3
+    assert scrollback.tail(10) == _window(console.lines)
+
+
+def test_growing_last_line_is_rewritten_in_place():
+    scrollback = dippingbird.Scrollback(100)
+    scrollback.merge("a\nb\nThinking.")
+    assert scrollback.merge("a\nb\nThinking...") == 0
+    assert scrollback.repainted == 1
+    assert scrollback.merge("b\nThinking...\nDone") == 1
+    assert list(scrollback.lines) == ["a", "b", "Thinking...", "Done"]
+
+
+def test_status_rows_repainted_under_new_output():
+    scrollback = dippingbird.Scrollback(100)
+    screen = [f"line {i}" for i in range(10)]
+    scrollback.merge(screen + ["Working (1s - esc to interrupt)", "> "])
+    for t in range(2, 6):
+        assert scrollback.merge(screen + [f"Working ({t}s - esc to interrupt)", "> "]) == 0
+    screen = screen[1:] + ["line 10"]
+    assert scrollback.merge(screen + ["Working (6s - esc to interrupt)", "> "]) == 1
+    assert scrollback.repainted == 2
+    assert list(scrollback.lines) == [f"line {i}" for i in range(11)] + ["Working (6s - esc to interrupt)", ">"]
+
+
+def test_unaligned_read_is_a_redraw():
+    scrollback = dippingbird.Scrollback(100)
+    scrollback.merge("one\ntwo\nthree")
+    assert scrollback.merge("four\nfive\nsix") == 0
+    assert scrollback.merge("four\nfive\nsix") == 0
+    assert list(scrollback.lines) == ["four", "five", "six"]
+
+
+def test_console_padding_is_ignored():
+    scrollback = dippingbird.Scrollback(100)
+    scrollback.merge("one\ntwo\n\n   \n")
+    assert scrollback.merge("one\ntwo") == 0
+    assert scrollback.tail(1) == "two"
+
+
+def test_ring_stays_bounded():
+    console = []
+    scrollback = dippingbird.Scrollback(50, max_line_chars=16)
+    for i in range(40):
+        console += ["x" * 40 + f" line {i}.{j}" for j in range(7)]
+        scrollback.merge(_window(console, 20))
+    assert len(scrollback) == 50
+    assert all(len(line) <= 16 for line in scrollback.lines)
+    assert list(scrollback.lines) == [line[-16:] for line in console[-50:]]
+
+
+def test_whole_console_read_longer_than_the_ring(desktop):
+    console = desktop.consoles[0]
+    scrollback = dippingbird.Scrollback(50)
+    scrollback.merge("\n".join(console.lines))
+    desktop.emit(console, 5)
+    assert scrollback.merge("\n".join(console.lines)) == 5
+    assert list(scrollback.lines) == console.lines[-50:]
+
+
+def test_feed_keeps_the_unterminated_line():
+    scrollback = dippingbird.Scrollback(3)
+    scrollback.feed("ab")
+    scrollback.feed("c\nde")
+    assert scrollback.tail() == "abc\nde"
+    scrollback.feed("f\ng\nh\n")
+    assert scrollback.tail() == "def\ng\nh"
+    assert scrollback.tail(2) == "g\nh"
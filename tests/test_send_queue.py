@@ -0,0 +1,204 @@
+import threading
+import time
+
+import dippingbird
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Window:
+    def __init__(self, delay=0.0, fail=0):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.calls = 0
+
+    def send_keystrokes(self, keys):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.calls <= self.fail:
+            raise RuntimeError("window gone")
+        self.sent.append(keys)
+
+
+def _wait(results, n=1, timeout=10):
+    deadline = time.monotonic() + timeout
+    while len(results) < n and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return results
+
+
+def test_token_bucket_rate_and_burst():
+    clock = Clock()
+    bucket = dippingbird.TokenBucket(60, burst=2, clock=clock)
+    for _ in range(2):
+        assert bucket.wait_time() == 0
+        bucket.take()
+    assert bucket.wait_time() == 1.0
+    clock.now += 1
+    assert bucket.wait_time() == 0
+
+
+def test_slow_send_is_not_retried():
+    window, results = Window(delay=0.5), []
+    queue = dippingbird.SendQueue(timeout=0.2, retries=3, per_target_rate=600, global_rate=600)
+    try:
+        assert queue.submit("t", window, "y{ENTER}", lambda ok, latency: results.append(ok))
+        assert _wait(results) == [True]
+        time.sleep(0.3)
+        assert window.sent == ["y{ENTER}"]
+    finally:
+        queue.close()
+
+
+def test_send_in_flight_blocks_the_next_one_for_that_target():
+    window, results = Window(delay=0.4), []
+    queue = dippingbird.SendQueue(timeout=0.1, retries=10, per_target_rate=600, global_rate=600)
+    try:
+        queue.submit("t", window, "y{ENTER}", lambda ok, latency: results.append(time.monotonic()))
+        time.sleep(0.05)
+        queue.submit("t", window, "n{ENTER}", lambda ok, latency: results.append(time.monotonic()))
+        assert queue.stats()["in_flight"] == 1
+        _wait(results, 2)
+        assert window.sent == ["y{ENTER}", "n{ENTER}"]
+        assert results[1] - results[0] >= 0.35
+    finally:
+        queue.close()
+
+
+def test_raising_send_is_retried_then_reported():
+    window, results = Window(fail=1), []
+    queue = dippingbird.SendQueue(retries=1, per_target_rate=600, global_rate=600)
+    try:
+        queue.submit("t", window, "y{ENTER}", lambda ok, latency: results.append(ok))
+        assert _wait(results) == [True]
+        assert window.calls == 2
+    finally:
+        queue.close()
+
+
+def test_hung_send_is_given_up_without_blocking_other_targets():
+    gate = threading.Event()
+
+    class Hung(Window):
+        def send_keystrokes(self, keys):
+            gate.wait(10)
+            super().send_keystrokes(keys)
+
+    hung, healthy, results = Hung(), Window(), []
+    queue = dippingbird.SendQueue(timeout=0.1, retries=1, workers=1, hung_limit=1,
+                                  per_target_rate=600, global_rate=600)
+    try:
+        queue.submit("a", hung, "y{ENTER}", lambda ok, latency: results.append(("a", ok)))
+        assert _wait(results) == [("a", False)]
+        assert not queue.submit("a", hung, "y{ENTER}")  # wedged until the hung call returns
+        queue.submit("b", healthy, "y{ENTER}", lambda ok, latency: results.append(("b", ok)))
+        assert _wait(results, 2)[1] == ("b", True)
+        assert queue.stats() == {"pending": 0, "in_flight": 1, "wedged": 1}
+
+        gate.set()
+        deadline = time.monotonic() + 5
+        while queue.stats()["wedged"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert queue.submit("a", hung, "n{ENTER}", lambda ok, latency: results.append(("a", ok)))
+        assert _wait(results, 3)[2] == ("a", True)
+        assert hung.sent == ["y{ENTER}", "n{ENTER}"]
+    finally:
+        gate.set()
+        queue.close()
+
+
+def test_hung_calls_past_the_limit_keep_their_worker():
+    gate = threading.Event()
+
+    class Hung(Window):
+        def send_keystrokes(self, keys):
+            gate.wait(10)
+
+    results = []
+    queue = dippingbird.SendQueue(timeout=0.05, retries=0, workers=1, hung_limit=1,
+                                  per_target_rate=600, global_rate=600)
+    try:
+        for key in "ab":
+            queue.submit(key, Hung(), "y{ENTER}", lambda ok, latency: results.append(ok))
+        assert _wait(results, 2) == [False, False]
+        healthy = Window()
+        queue.submit("c", healthy, "y{ENTER}")
+        time.sleep(0.3)
+        # One thread set aside, the other still holds the only worker slot: nothing more is started
+        assert healthy.sent == []
+        gate.set()
+        deadline = time.monotonic() + 5
+        while not healthy.sent and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert healthy.sent == ["y{ENTER}"]
+    finally:
+        gate.set()
+        queue.close()
+
+
+def test_identical_pending_sends_coalesce_and_overflow_drops():
+    gate = threading.Event()
+
+    class Blocked(Window):
+        def send_keystrokes(self, keys):
+            gate.wait(5)
+            super().send_keystrokes(keys)
+
+    window = Blocked()
+    queue = dippingbird.SendQueue(size=1, per_target_rate=600, global_rate=600)
+    try:
+        assert queue.submit("t", window, "a")  # picked up and blocked in flight
+        time.sleep(0.1)
+        assert queue.submit("t", window, "b")
+        assert queue.submit("t", window, "b")  # coalesced into the pending one
+        assert not queue.submit("u", window, "c")  # queue full
+        gate.set()
+        deadline = time.monotonic() + 5
+        while len(window.sent) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert window.sent == ["a", "b"]
+    finally:
+        queue.close()
+
+
+def test_failed_sends_are_rearmed():
+    clock = Clock()
+    state = dippingbird.StalenessState(30, False, 0, clock=clock)
+    state.record_send("initial", clock())
+    clock.now += 30
+    state.record_send("stale", clock())
+    state.send_failed("stale")
+    assert state.decide(clock()) == "stale"
+
+    state.text_changed()
+    state.prompt_appeared("yn-paren")
+    assert state.decide(clock()) == "prompt"
+    state.record_send("prompt", clock())
+    assert state.decide(clock()) is None
+    state.send_failed("prompt")
+    assert state.decide(clock()) == "prompt"
+
+    state.send_failed("initial")
+    assert state.decide(clock()) == "initial"
+
+
+def test_dropped_send_rearms_the_policy(monkeypatch):
+    monkeypatch.setattr(dippingbird, "SEND_QUEUE", True)
+    queue = dippingbird.SendQueue(size=0)
+    monkeypatch.setattr(dippingbird, "_send_queue", queue)
+    clock = Clock(100.0)
+    state = dippingbird.StalenessState(30, False, 0, clock=clock)
+    state.record_send("initial", clock())
+    clock.now += 30
+    try:
+        assert dippingbird._send_for_state(Window(), state, 30) is None
+        assert state.decide(clock()) == "stale"
+    finally:
+        queue.close()
@@ -0,0 +1,41 @@
+import dippingbird
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _state(clock, stale=30, persistent=False, min_send=0):
+    state = dippingbird.StalenessState(stale, persistent, min_send, clock=clock)
+    state.record_send("initial", clock())
+    return state
+
+
+def test_one_send_per_stale_cycle():
+    clock = Clock()
+    state = dippingbird.StalenessState(30, False, 0, clock=clock)
+    assert state.decide(clock()) == "initial"
+    state.record_send("initial", clock())
+    assert state.decide(clock()) is None
+    clock.now += 30
+    assert state.decide(clock()) == "stale"
+    state.record_send("stale", clock())
+    clock.now += 300
+    assert state.decide(clock()) is None
+    state.text_changed()
+    clock.now += 30
+    assert state.decide(clock()) == "stale"
+
+
+def test_min_send_guard_and_deadline():
+    clock = Clock()
+    state = _state(clock, stale=30, min_send=120)
+    clock.now += 30
+    state.record_send("stale", clock())
+    assert state.seconds_until_due(clock()) == 120
+    clock.now += 120
+    assert state.decide(clock()) == "min-send"